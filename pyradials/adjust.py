@@ -0,0 +1,290 @@
+'''least-squares network adjustment of the control from the station observations in a reduced source
+
+Every shot whose point id names a station (ROs, foresights, check shots) is an observation, a
+direction with an unknown orientation per setup, a horizontal distance and a height difference.
+Plan and height are adjusted separately, plan by Gauss-Newton iteration and height in one linear
+solve, both as sparse normal equations so traverses of thousands of stations solve in seconds.
+
+	adjustment = adjust_source(source, control) # holds the first setup's station and backsight
+	control.update(adjustment.control)
+
+Stations missing from control get provisional coordinates by radiating from the stations around
+them, so control only has to hold the fixed stations.'''
+import math
+from collections import namedtuple
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+from calc import horizontal_to_azimuth_array
+from store import ObservationStore
+
+# a priori standard deviations, direction and zenith in seconds of arc, distance as mm + ppm
+Precision = namedtuple("Precision", "direction zenith distance_mm distance_ppm", defaults=(3.0, 5.0, 2.0, 2.0))
+
+Observations = namedtuple("Observations", "setup station target direction distance height_difference")
+AdjustedStation = namedtuple("AdjustedStation", "name easting northing elevation sigma_easting sigma_northing sigma_elevation semi_major semi_minor bearing fixed")
+Residual = namedtuple("Residual", "station target kind observed residual standardised")
+Adjustment = namedtuple("Adjustment", "control stations residuals orientations sigma0 degrees_of_freedom iterations")
+
+SECONDS = math.pi / 180 / 3600 # one second of arc in radians
+
+def station_observations(store:ObservationStore, station_names) -> tuple:
+	'''(names, Observations) for every shot at another station, as numpy columns indexing names'''
+	names = list(dict.fromkeys(list(station_names) + store.stations))
+	index = {name: i for i, name in enumerate(names)}
+
+	# point ids below zero are the interned names, see ObservationStore.point_id_to_index
+	named = np.flatnonzero(store.point_id_index < 0)
+	target = np.array([index.get(store.index_to_point_id(i), -1) for i in store.point_id_index[named]], dtype=np.int64)
+	setup = store.setup_index[named].astype(np.int64)
+	station = np.array([index[name] for name in store.stations], dtype=np.int64)[setup]
+
+	at_station = (target >= 0) & (target != station)
+	rows, setup, station, target = named[at_station], setup[at_station], station[at_station], target[at_station]
+
+	hz, vt, sd, th = store['hz'][rows], store['vt'][rows], store['sd'][rows], store['th'][rows]
+	face_two = vt > 180 # reduce face two shots to face one
+	hz = np.where(face_two, hz + 180, hz)
+	vt = np.where(face_two, 360 - vt, vt)
+	height = store.setup_columns['height'][setup]
+
+	observations = Observations(
+		setup, station, target,
+		np.radians(horizontal_to_azimuth_array(hz)),
+		sd * np.sin(np.radians(vt)),
+		sd * np.cos(np.radians(vt)) + np.nan_to_num(height) - np.nan_to_num(th),
+	)
+	return names, observations
+
+def wrap(angle):
+	'''radians to -pi..pi'''
+	return (angle + np.pi) % (2 * np.pi) - np.pi
+
+def setup_orientations(xyz:np.ndarray, known:np.ndarray, observations:Observations, setups:int) -> tuple:
+	'''(orientation, oriented) per setup, the circular mean of grid bearing less direction over its known targets'''
+	usable = known[observations.station] & known[observations.target]
+	d = xyz[observations.target] - xyz[observations.station]
+	offset = np.arctan2(d[:, 1], d[:, 0]) - observations.direction
+
+	sin = np.bincount(observations.setup[usable], np.sin(offset[usable]), setups)
+	cos = np.bincount(observations.setup[usable], np.cos(offset[usable]), setups)
+	return np.arctan2(sin, cos), np.bincount(observations.setup[usable], minlength=setups) > 0
+
+def provisional_coordinates(names:list, control:dict, observations:Observations, setups:int) -> np.ndarray:
+	'''control where it has the station, otherwise radiated from the nearest oriented setup, a ring at a time'''
+	xyz = np.array([control.get(name, (np.nan, np.nan, np.nan)) for name in names], dtype=np.float64).reshape(-1, 3)
+	known = ~np.isnan(xyz).any(axis=1)
+	s, t = observations.station, observations.target
+
+	while True:
+		orientation, oriented = setup_orientations(xyz, known, observations, setups)
+		radiate = oriented[observations.setup] & known[s] & ~known[t]
+		if not radiate.any():
+			break
+
+		# the first shot at each unknown target places it
+		unknown, first = np.unique(t[radiate], return_index=True)
+		shots = np.flatnonzero(radiate)[first]
+		bearing = observations.direction[shots] + orientation[observations.setup[shots]]
+		xyz[unknown] = xyz[s[shots]] + np.stack([observations.distance[shots] * np.cos(bearing), observations.distance[shots] * np.sin(bearing), observations.height_difference[shots]], axis=1)
+		known[unknown] = True
+
+	missing = [names[i] for i in np.flatnonzero(~known)]
+	if missing:
+		raise ValueError("no control or observations to place " + ', '.join(map(str, missing)))
+	return xyz
+
+def normal_equations(A, weights, misclosure) -> tuple:
+	N = (A.T @ scipy.sparse.diags(weights) @ A).tocsc()
+	u = A.T @ (weights * misclosure)
+	try:
+		factor = scipy.sparse.linalg.splu(N)
+	except RuntimeError:
+		raise ValueError("network is not fully determined, check every station is observed from enough setups and fixed stations")
+	return factor, factor.solve(u)
+
+def inverse_blocks(factor, columns:np.ndarray, width:int, size:int, chunk:int = 256) -> np.ndarray:
+	'''the width x width blocks of the inverse normal matrix starting at each of columns, solved a chunk at a time'''
+	blocks = np.zeros((len(columns), width, width))
+	for start in range(0, len(columns), chunk):
+		part = columns[start:start + chunk]
+		rhs = np.zeros((size, width * len(part)))
+		for k in range(width):
+			rhs[part + k, np.arange(k, width * len(part), width)] = 1
+		inverse = factor.solve(rhs)
+		for k, column in enumerate(part):
+			blocks[start + k] = inverse[column:column + width, width * k:width * (k + 1)]
+	return blocks
+
+def adjust_plan(xyz:np.ndarray, free:np.ndarray, observations:Observations, setups:int, precision:Precision, tolerance:float, max_iterations:int) -> tuple:
+	'''Gauss-Newton on easting and northing of the free stations and one orientation per setup'''
+	stations = len(xyz)
+	column = np.full(stations, -1, dtype=np.int64)
+	column[free] = 2 * np.arange(free.sum()) # unknowns are e0 n0 e1 n1 ... then the orientations
+	unknowns = 2 * free.sum() + setups
+	northing = np.where(column >= 0, column + 1, -1)
+
+	count = len(observations.setup)
+	rows = np.arange(count)
+	s, t, setup = observations.station, observations.target, observations.setup
+
+	sigma_direction = np.full(count, precision.direction * SECONDS)
+	sigma_distance = precision.distance_mm / 1000 + precision.distance_ppm * 1e-6 * observations.distance
+	weights = np.concatenate([1 / sigma_direction ** 2, 1 / sigma_distance ** 2])
+
+	orientation, oriented = setup_orientations(xyz, np.ones(stations, dtype=bool), observations, setups)
+	unused = np.flatnonzero(~oriented) # setups without a station shot, held so N stays regular
+
+	for iteration in range(1, max_iterations + 1):
+		d = xyz[t, :2] - xyz[s, :2]
+		length_squared = (d ** 2).sum(axis=1)
+		length = np.sqrt(length_squared)
+
+		# direction + orientation = bearing, distance = length
+		misclosure = np.concatenate([wrap(observations.direction + orientation[setup] - np.arctan2(d[:, 1], d[:, 0])), observations.distance - length])
+
+		entries = [
+			# direction rows, d bearing / d station and target coordinates, and -1 for the orientation
+			(rows, column[t], -d[:, 1] / length_squared), (rows, northing[t], d[:, 0] / length_squared),
+			(rows, column[s], d[:, 1] / length_squared), (rows, northing[s], -d[:, 0] / length_squared),
+			(rows, 2 * free.sum() + setup, -np.ones(count)),
+			# distance rows
+			(count + rows, column[t], d[:, 0] / length), (count + rows, northing[t], d[:, 1] / length),
+			(count + rows, column[s], -d[:, 0] / length), (count + rows, northing[s], -d[:, 1] / length),
+			(np.arange(len(unused)) + 2 * count, 2 * free.sum() + unused, np.ones(len(unused))),
+		]
+		i, j, value = [np.concatenate(part) for part in zip(*entries)]
+		fixed_column = j < 0 # coordinates of fixed stations aren't unknowns
+		A = scipy.sparse.csr_matrix((value[~fixed_column], (i[~fixed_column], j[~fixed_column])), shape=(2 * count + len(unused), unknowns))
+
+		all_weights = np.concatenate([weights, np.ones(len(unused))])
+		factor, correction = normal_equations(A, all_weights, np.concatenate([misclosure, np.zeros(len(unused))]))
+
+		xyz[free, 0] += correction[column[free]]
+		xyz[free, 1] += correction[column[free] + 1]
+		orientation += correction[2 * free.sum():]
+
+		if np.abs(correction[:2 * free.sum()]).max(initial=0) < tolerance:
+			break
+
+	# residuals at the final coordinates
+	d = xyz[t, :2] - xyz[s, :2]
+	residuals = np.concatenate([
+		wrap(np.arctan2(d[:, 1], d[:, 0]) - orientation[setup] - observations.direction),
+		np.sqrt((d ** 2).sum(axis=1)) - observations.distance,
+	])
+	blocks = inverse_blocks(factor, column[free], 2, unknowns)
+	return orientation, residuals, weights, blocks, iteration
+
+def adjust_height(xyz:np.ndarray, free:np.ndarray, observations:Observations, precision:Precision) -> tuple:
+	'''one linear solve for the elevations of the free stations from the height differences'''
+	column = np.full(len(xyz), -1, dtype=np.int64)
+	column[free] = np.arange(free.sum())
+	s, t = observations.station, observations.target
+	rows = np.arange(len(s))
+
+	slope = np.hypot(observations.distance, observations.height_difference)
+	sigma = np.hypot(precision.distance_mm / 1000 * observations.height_difference / np.maximum(slope, 1e-9), observations.distance * precision.zenith * SECONDS)
+	weights = 1 / np.maximum(sigma, 1e-4) ** 2
+
+	misclosure = observations.height_difference - (xyz[t, 2] - xyz[s, 2])
+	i, j, value = np.concatenate([rows, rows]), np.concatenate([column[t], column[s]]), np.concatenate([np.ones(len(s)), -np.ones(len(s))])
+	A = scipy.sparse.csr_matrix((value[j >= 0], (i[j >= 0], j[j >= 0])), shape=(len(s), free.sum()))
+
+	factor, correction = normal_equations(A, weights, misclosure)
+	xyz[free, 2] += correction
+
+	residuals = (xyz[t, 2] - xyz[s, 2]) - observations.height_difference
+	variance = inverse_blocks(factor, np.arange(free.sum()), 1, free.sum())[:, 0, 0]
+	return residuals, weights, variance
+
+def error_ellipse(block:np.ndarray) -> tuple:
+	'''(semi major, semi minor, bearing of the major axis in degrees) of a 2x2 easting/northing covariance'''
+	qee, qen, qnn = block[0, 0], block[0, 1], block[1, 1]
+	root = math.sqrt(((qee - qnn) / 2) ** 2 + qen ** 2)
+	major = math.sqrt(max((qee + qnn) / 2 + root, 0))
+	minor = math.sqrt(max((qee + qnn) / 2 - root, 0))
+	bearing = math.degrees(0.5 * math.atan2(2 * qen, qnn - qee)) % 180
+	return major, minor, bearing
+
+def adjust_source(source:dict, control:dict, fixed:list = None, precision:Precision = Precision(), tolerance:float = 0.00001, max_iterations:int = 10) -> Adjustment:
+	'''adjusts every station observed in a total station source, holding fixed (default, the first setup's station and backsight)'''
+	store = source.get('store')
+	if store is None:
+		store = ObservationStore.from_setups(source['data'])
+	if store.setup_count() == 0:
+		raise ValueError("no setups to adjust")
+
+	if not fixed:
+		from reduction import increment_string
+		first_backsight = store.backsights[0] or increment_string(store.stations[0])
+		fixed = [store.stations[0], first_backsight]
+	for name in fixed:
+		if name not in control:
+			raise ValueError("fixed station %s isn't in control" % name)
+
+	names, observations = station_observations(store, list(control) + list(fixed))
+	if len(observations.setup) == 0:
+		raise ValueError("no station observations to adjust")
+
+	setups = store.setup_count()
+	xyz = provisional_coordinates(names, control, observations, setups)
+	is_fixed = np.isin(np.array(names, dtype=object), np.array(list(fixed), dtype=object))
+	# only stations that appear in the observations are adjusted, the rest of control passes through
+	observed = np.zeros(len(names), dtype=bool)
+	observed[observations.station] = observed[observations.target] = True
+	free = observed & ~is_fixed
+
+	orientation, plan_residuals, plan_weights, blocks, iterations = adjust_plan(xyz, free, observations, setups, precision, tolerance, max_iterations)
+	height_residuals, height_weights, height_variance = adjust_height(xyz, free, observations, precision)
+
+	residuals = np.concatenate([plan_residuals, height_residuals])
+	weights = np.concatenate([plan_weights, height_weights])
+	degrees_of_freedom = len(residuals) - (2 * free.sum() + (np.bincount(observations.setup, minlength=setups) > 0).sum() + free.sum())
+	sigma0 = math.sqrt((weights * residuals ** 2).sum() / degrees_of_freedom) if degrees_of_freedom > 0 else None
+	scale = sigma0 ** 2 if sigma0 else 1.0
+
+	stations = []
+	free_position = np.cumsum(free) - 1
+	for k, name in enumerate(names):
+		if not observed[k]:
+			continue
+		if free[k]:
+			block = blocks[free_position[k]] * scale
+			major, minor, bearing = error_ellipse(block)
+			sigma_z = math.sqrt(height_variance[free_position[k]] * scale)
+			stations.append(AdjustedStation(name, *xyz[k].tolist(), math.sqrt(block[0, 0]), math.sqrt(block[1, 1]), sigma_z, major, minor, bearing, False))
+		else:
+			stations.append(AdjustedStation(name, *xyz[k].tolist(), 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, True))
+
+	count = len(observations.setup)
+	standardised = residuals * np.sqrt(weights)
+	rows = []
+	for kind, offset, unit in (('direction', 0, 1 / SECONDS), ('distance', count, 1), ('height', 2 * count, 1)):
+		observed_values = {'direction': np.degrees(observations.direction), 'distance': observations.distance, 'height': observations.height_difference}[kind]
+		for k in range(count):
+			rows.append(Residual(names[observations.station[k]], names[observations.target[k]], kind, float(observed_values[k]), float(residuals[offset + k] * unit), float(standardised[offset + k])))
+
+	adjusted = {station.name: [round(float(station.easting), 4), round(float(station.northing), 4), round(float(station.elevation), 4)] for station in stations}
+	return Adjustment(adjusted, stations, rows, np.degrees(orientation), sigma0, int(degrees_of_freedom), iterations)
+
+# Main block to execute if the script is run directly, adjusts a synthetic traverse from rough control
+if __name__ == "__main__":
+	import sys, tempfile, time, os, random
+	from synthetic import write_gsi
+	from instrument import instrument_file_as_source
+
+	setups = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+	with tempfile.TemporaryDirectory() as directory:
+		fn = os.path.join(directory, 'TRAVERSE.GSI')
+		truth = write_gsi(fn, setups, 5, foresight=True)
+		source = instrument_file_as_source(fn)
+
+	generator = random.Random(1)
+	rough = {name: [value + generator.uniform(-0.05, 0.05) for value in xyz] for name, xyz in truth.items()}
+	rough.update({name: truth[name] for name in ('STN1', 'STN2')})
+
+	started = time.perf_counter()
+	adjustment = adjust_source(source, rough)
+	print("%d stations adjusted in %.2fs, %d iterations, sigma0 %s" % (len(adjustment.stations), time.perf_counter() - started, adjustment.iterations, adjustment.sigma0))
+	print("worst error against the true control %.4fm" % max(max(abs(a - b) for a, b in zip(xyz, truth[name])) for name, xyz in adjustment.control.items()))
@@ -0,0 +1,108 @@
+'''batch mode, fans instrument files out to a process pool where each worker parses, reduces and plots a file'''
+import contextlib, io, os, pathlib, time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tabulate import tabulate
+from colour import Colour; colour = Colour()
+from instrument import instrument_file_as_source
+from reduction import reduce_source, reduction_to_drawing
+from cache import ResultCache, cached_source, cached_radials
+from control_store import job_control
+from adjust import adjust_source
+from spatial import PointIndex
+from dxf.plot import draw_dxf
+from profiling import Profiler, stage
+
+# coincident and duplicates are the --qc group counts, None without --qc
+Result = namedtuple("Result", "file_name type setups shots drawn dxf seconds error stages coincident duplicates", defaults=(None, None, None))
+
+def run_file(fn:str, control:dict, scale:int = 100, use_cache:bool = True, profile:bool = False, plot:dict = None, reject_sigma:float = None, adjust:list = None, qc:float = None) -> Result:
+	'''parses, reduces and plots one instrument file, errors are returned rather than raised so one bad file can't stop a batch'''
+	profiler = Profiler()
+	with profiler if profile else contextlib.nullcontext(), profiler.file(fn):
+		result = process_file_stages(fn, control, scale, use_cache, plot, reject_sigma, adjust, qc)
+
+	return result._replace(stages=profiler.as_dict()['stages']) if profile else result
+
+def process_file_stages(fn:str, control:dict, scale:int = 100, use_cache:bool = True, plot:dict = None, reject_sigma:float = None, adjust:list = None, qc:float = None) -> Result:
+	'''main.process_file's stages without the tables, reject_sigma, adjust and qc as there'''
+	started = time.perf_counter()
+	file_name = pathlib.Path(fn).name
+	coincident = duplicates = None
+
+	try:
+		cache = ResultCache() if use_cache else None
+
+		# a worker keeps quiet, the batch summary reports each file
+		with contextlib.redirect_stdout(io.StringIO()):
+			with stage('instrument_file_as_source'):
+				digest, source = cached_source(fn, lambda fn: instrument_file_as_source(fn, reject_sigma=reject_sigma), cache, reject_sigma)
+
+			if source['type'] != 'total_station':
+				return Result(file_name, source['type'], 0, len(source['data']), 0, None, time.perf_counter() - started, None)
+
+			control = job_control(source, control) # a ControlStore is reopened in the worker, read only what this file needs
+			if adjust is not None:
+				with stage('adjust_source') as record:
+					adjustment = adjust_source(source, control, adjust)
+					record.records = len(adjustment.stations)
+				control.update(adjustment.control)
+			with stage('reduce_source') as record:
+				hit, radials = cached_radials(digest, control, lambda: reduction_to_drawing(reduce_source(source, control)), cache)
+				record.records = len(radials)
+
+			if qc is not None:
+				with stage('coincident') as record:
+					index = PointIndex.from_drawing(radials, control)
+					record.records = len(index)
+				coincident, duplicates = len(index.coincident(qc)), len(index.duplicate_point_ids())
+
+			stations = [[key, *value] for key, value in control.items()]
+			dxf_fn = pathlib.Path(fn).with_suffix('.dxf')
+			with stage('draw_dxf') as record:
+				entities = draw_dxf(radials, stations, scale, dxf_fn, **(plot or {}))
+				record.records = sum(entities.values())
+
+		shots = sum(len(setup['coded_measurements']) for setup in source['data'])
+		return Result(file_name, source['type'], len(source['data']), shots, len(radials), str(dxf_fn), time.perf_counter() - started, None, None, coincident, duplicates)
+
+	except Exception as error:
+		return Result(file_name, None, 0, 0, 0, None, time.perf_counter() - started, "%s: %s" % (type(error).__name__, error))
+
+def run_batch(files:list, control:dict, workers:int = None, scale:int = 100, use_cache:bool = True, profile:bool = False, plot:dict = None, reject_sigma:float = None, adjust:list = None, qc:float = None) -> list:
+	'''processes files across a pool of worker processes, reporting each as it finishes, returns the Results in file order
+	gps epochs are rejected at reject_sigma, control adjusted holding adjust and coincident points counted within qc, as main.process_file'''
+	workers = workers or os.cpu_count()
+	colour.print("== BATCH ==\n%d files across %d workers\n" % (len(files), workers), Colour.LIGHT_CYAN)
+
+	started = time.perf_counter()
+	results = {}
+
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		futures = {executor.submit(run_file, fn, control, scale, use_cache, profile, plot, reject_sigma, adjust, qc): i for i, fn in enumerate(files)}
+
+		for future in as_completed(futures):
+			result = future.result()
+			results[futures[future]] = result
+
+			if result.error is None:
+				colour.print("done  %s (%d shots, %.2fs)" % (result.file_name, result.shots, result.seconds), Colour.GREEN)
+			else:
+				colour.print("error %s: %s" % (result.file_name, result.error), Colour.RED)
+
+	ordered = [results[i] for i in range(len(files))]
+	print_batch_summary(ordered, time.perf_counter() - started)
+	return ordered
+
+def print_batch_summary(results:list, elapsed:float) -> None:
+	colour.print("\n== BATCH SUMMARY ==", Colour.LIGHT_CYAN)
+
+	qc = any(result.coincident is not None for result in results)
+	rows = [['File', 'Type', 'Setups', 'Shots', 'Drawn', *(['Coincident', 'Duplicate IDs'] if qc else []), 'Seconds', 'Result']]
+	for result in results:
+		rows.append([result.file_name, result.type, result.setups, result.shots, result.drawn, *([result.coincident, result.duplicates] if qc else []), result.seconds, result.error or result.dxf])
+	colour.print(tabulate(rows, headers='firstrow', floatfmt='.2f'), Colour.CYAN)
+
+	failed = sum(1 for result in results if result.error is not None)
+	shots = sum(result.shots for result in results)
+	colour.print("\n%d files, %d failed, %d shots in %.2fs (%.0f shots/s)" % (len(results), failed, shots, elapsed, shots / elapsed if elapsed else 0), Colour.LIGHT_CYAN)
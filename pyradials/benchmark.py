@@ -0,0 +1,182 @@
+'''benchmark harness, times parse, reduce, gps averaging, dxf build and save on synthetic surveys at several scales
+
+	py pyradials/benchmark.py --scales 10000 100000 1000000 --output bench.json
+	py pyradials/benchmark.py --compare bench.json
+	py pyradials/benchmark.py --scales 20000 --formats dxf binary gzip zip
+
+Each scale writes a synthetic .gsi and a .csv of as many gps epochs (see synthetic.py) to a temporary
+folder and runs them through the same functions main() uses, timed by profiling.Profiler. Above
+--dxf-limit shots the drawing is streamed (draw_dxf stream=True) to keep memory bounded and isn't read
+back, the stages skipped are listed with the results. The json records the git commit and library
+versions so results from different commits can be compared with --compare. The readers' correctness
+checks are in tests/, this only times them.'''
+import argparse, contextlib, io, json, os, pathlib, platform, subprocess, tempfile, time
+from datetime import datetime
+import numpy, ezdxf
+from tabulate import tabulate
+from colour import Colour; colour = Colour()
+from profiling import Profiler, stage
+from synthetic import write_gsi, write_gps_csv
+from instrument import instrument_file_as_source
+from reduction import reduce_source, reduction_to_drawing
+from gps import load_and_average_gps_csv_file
+from dxf.plot import draw_dxf, new_document, plot_stations, plot_radials, LINEWORK_MODES, LABEL_MODES
+from dxf.output import OUTPUT_FORMATS, save_document, read_document
+
+def git_commit() -> str:
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, cwd=pathlib.Path(__file__).parent).stdout.strip()
+	except Exception:
+		return None
+
+def run_scale(directory:str, shots:int, shots_per_setup:int, bit_depth:int, dxf_limit:int, trace_memory:bool = False, plot:dict = None) -> tuple:
+	'''runs the pipeline once at a given number of shots, returns the profiler's stage dicts and the stages skipped'''
+	setups = max(1, shots // shots_per_setup)
+	fn = os.path.join(directory, 'BENCH%d.GSI' % shots)
+	control = write_gsi(fn, setups, shots // setups, bit_depth)
+	stations = [[key, *value] for key, value in control.items()]
+	epochs = max(1, shots // len(control)) # about as many gps epochs as shots, spread over the control
+	write_gps_csv(os.path.join(directory, 'BENCH%d.csv' % shots), control, epochs)
+	file_name = '%d shots' % shots
+	skipped = []
+
+	with Profiler(trace_memory) as profiler, profiler.file(file_name):
+		with stage('parse') as record:
+			source = instrument_file_as_source(fn)
+			record.records = len(source['store'])
+
+		with stage('reduce') as record:
+			radials = reduction_to_drawing(reduce_source(source, control))
+			record.records = len(radials)
+
+		with stage('gps') as record:
+			record.records = sum(point[7] for point in load_and_average_gps_csv_file(os.path.join(directory, 'BENCH%d.csv' % shots)))
+
+		streamed = shots > dxf_limit and not (plot or {}).get('stream')
+		with stage('draw_dxf_stream' if streamed else 'draw_dxf') as record, contextlib.redirect_stdout(io.StringIO()):
+			entities = draw_dxf(radials, stations, 100, pathlib.Path(fn).with_suffix('.dxf'), **{**(plot or {}), **({'stream': True} if streamed else {})})
+			record.records = sum(entities.values()) # entities, not shots, so linework modes compare
+
+		if shots <= dxf_limit:
+			with stage('readfile') as record: # how long the drawing takes to load back
+				record.records = len(ezdxf.readfile(pathlib.Path(fn).with_suffix('.dxf')).modelspace())
+		else:
+			skipped.append({'file': file_name, 'stage': 'readfile', 'reason': 'over --dxf-limit %d shots' % dxf_limit})
+		if streamed:
+			skipped.append({'file': file_name, 'stage': 'draw_dxf', 'reason': 'over --dxf-limit %d shots, drawn by draw_dxf_stream' % dxf_limit})
+
+	return profiler.as_dict()['stages'], skipped
+
+def compare_formats(directory:str, shots:int, shots_per_setup:int, bit_depth:int, formats:list, plot:dict = None) -> list:
+	'''writes one drawing in each output format, returns the write time, file size and re-read time of each'''
+	setups = max(1, shots // shots_per_setup)
+	fn = os.path.join(directory, 'FORMATS%d.GSI' % shots)
+	control = write_gsi(fn, setups, shots // setups, bit_depth)
+	radials = reduction_to_drawing(reduce_source(instrument_file_as_source(fn), control))
+
+	plot = plot or {}
+	doc, style = new_document(100)
+	msp = doc.modelspace()
+	plot_stations(msp, [[key, *value] for key, value in control.items()], style)
+	plot_radials(doc, msp, radials, style, linework=plot.get('linework', 'polyline'), radial_mode=plot.get('radial_mode', 'shot'))
+
+	rows = []
+	for fmt in formats:
+		started = time.perf_counter()
+		path = save_document(doc, pathlib.Path(fn).with_suffix('.dxf'), fmt)
+		written = time.perf_counter() - started
+
+		started = time.perf_counter()
+		entities = len(read_document(path).modelspace())
+		rows.append({'shots': shots, 'format': fmt, 'write_s': written, 'size_mb': os.path.getsize(path) / 2**20, 'read_s': time.perf_counter() - started, 'entities': entities})
+		os.remove(path)
+	return rows
+
+def compare(previous_fn:str, current:dict) -> None:
+	'''prints each stage's wall time against a previous run'''
+	with open(previous_fn) as json_file:
+		previous = json.load(json_file)
+
+	before = {(row['file'], row['stage']): row['wall_s'] for row in previous['stages']}
+	rows = [['Scale', 'Stage', previous.get('commit') or 'before', current.get('commit') or 'now', 'Ratio']]
+	for row in current['stages']:
+		old = before.get((row['file'], row['stage']))
+		rows.append([row['file'], row['stage'], old, row['wall_s'], row['wall_s'] / old if old else None])
+
+	colour.print("== COMPARISON (wall seconds) ==", Colour.LIGHT_CYAN)
+	colour.print(tabulate(rows, headers='firstrow', floatfmt='.3f'), Colour.CYAN)
+
+def main(arguments:list = None) -> dict:
+	parser = argparse.ArgumentParser(description='pyradials benchmark on synthetic surveys')
+	parser.add_argument('--scales', type=int, nargs='+', default=[10000, 100000, 1000000], help='total shots per run')
+	parser.add_argument('--shots-per-setup', type=int, default=1000)
+	parser.add_argument('--bit-depth', type=int, choices=(8, 16), default=16)
+	parser.add_argument('--dxf-limit', type=int, default=100000, help='above this many shots stream the dxf and skip reading it back and --formats')
+	parser.add_argument('--linework', choices=LINEWORK_MODES, default='polyline', help='how coded strings are drawn')
+	parser.add_argument('--setup-radials', action='store_true', help='one radial polyline a setup')
+	parser.add_argument('--stream', action='store_true', help='stream the dxf to disk as it\'s plotted')
+	parser.add_argument('--labels', choices=LABEL_MODES, default='fixed', help='fixed label offsets, or labels placed clear of each other')
+	parser.add_argument('--formats', nargs='+', choices=OUTPUT_FORMATS, default=None, help='also write one drawing a scale (up to --dxf-limit) in each output format, comparing write time, size and re-read time')
+	parser.add_argument('--memory', action='store_true', help='also record peak memory, tracemalloc slows every stage down')
+	parser.add_argument('--output', metavar='JSON', help='save the results')
+	parser.add_argument('--compare', metavar='JSON', help='a previous --output to compare against')
+	args = parser.parse_args(arguments)
+
+	plot = {'linework': args.linework, 'radial_mode': 'setup' if args.setup_radials else 'shot', 'stream': args.stream, 'label_mode': args.labels}
+	result = {
+		'commit': git_commit(),
+		'created': datetime.now().isoformat(timespec='seconds'),
+		'python': platform.python_version(),
+		'numpy': numpy.__version__,
+		'ezdxf': ezdxf.__version__,
+		'platform': platform.platform(),
+		'bit_depth': args.bit_depth,
+		'linework': args.linework,
+		'radial_mode': plot['radial_mode'],
+		'stream': args.stream,
+		'label_mode': args.labels,
+		'stages': [],
+		'formats': [],
+		'skipped': [],
+	}
+
+	with tempfile.TemporaryDirectory() as directory:
+		for shots in args.scales:
+			colour.print("benchmarking %d shots" % shots, Colour.LIGHT_CYAN)
+			stages, skipped = run_scale(directory, shots, args.shots_per_setup, args.bit_depth, args.dxf_limit, args.memory, plot)
+			result['stages'] += stages
+			result['skipped'] += skipped
+
+			if args.formats and shots <= args.dxf_limit:
+				result['formats'] += compare_formats(directory, shots, args.shots_per_setup, args.bit_depth, args.formats, plot)
+			elif args.formats:
+				result['skipped'].append({'file': '%d shots' % shots, 'stage': 'formats', 'reason': 'over --dxf-limit %d shots' % args.dxf_limit})
+
+	rows = [['Scale', 'Stage', 'Wall (s)', 'CPU (s)', 'Peak (MB)', 'Records']]
+	for row in result['stages']:
+		rows.append([row['file'], row['stage'], row['wall_s'], row['cpu_s'], row['peak_mb'], row['records']])
+	colour.print(tabulate(rows, headers='firstrow', floatfmt='.3f'), Colour.CYAN)
+
+	if result['skipped']:
+		colour.print("\n== SKIPPED ==", Colour.LIGHT_YELLOW)
+		rows = [['Scale', 'Stage', 'Reason']] + [[row['file'], row['stage'], row['reason']] for row in result['skipped']]
+		colour.print(tabulate(rows, headers='firstrow'), Colour.YELLOW)
+
+	if result['formats']:
+		colour.print("\n== OUTPUT FORMATS ==", Colour.LIGHT_CYAN)
+		rows = [['Shots', 'Format', 'Write (s)', 'Size (MB)', 'Re-read (s)', 'Entities']]
+		for row in result['formats']:
+			rows.append([row['shots'], row['format'], row['write_s'], row['size_mb'], row['read_s'], row['entities']])
+		colour.print(tabulate(rows, headers='firstrow', floatfmt='.3f'), Colour.CYAN)
+
+	if args.output:
+		with open(args.output, 'w') as json_file:
+			json.dump(result, json_file, indent=2)
+
+	if args.compare:
+		compare(args.compare, result)
+
+	return result
+
+if __name__ == "__main__":
+	main()
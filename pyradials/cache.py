@@ -0,0 +1,117 @@
+'''on-disk cache of parsed sources and reduced radials, keyed by file content rather than file name
+
+A key is the sha256 of the instrument file plus the source of the parsing and reduction modules, and
+for radials the control too, so an edited file, control or parser is a miss while a renamed or
+re-copied file is still a hit.
+Entries are pickles, the least recently used are evicted once the cache outgrows its size limit.'''
+import hashlib, logging, os, pathlib, pickle, tempfile
+
+# the modules whose code decides what an entry holds, their source is part of every key so changing
+# any of them misses the old entries without a version to remember to bump
+PARSER_MODULES = ('instrument', 'leica', 'leica_mmap', 'leica_numpy', 'store', 'gps', 'calc', 'reduction', 'cli')
+
+def modules_digest(modules:tuple = PARSER_MODULES) -> str:
+	'''sha256 of the source of modules, files beside this one'''
+	digest = hashlib.sha256()
+	directory = pathlib.Path(__file__).parent
+	for module in modules:
+		digest.update((directory / (module + '.py')).read_bytes())
+	return digest.hexdigest()
+
+PARSER_VERSION:str = modules_digest()
+
+DEFAULT_DIRECTORY = pathlib.Path.home() / '.pyradials' / 'cache'
+DEFAULT_MAX_MB:int = 512
+
+def file_digest(fn:str, chunk_size:int = 1024 * 1024) -> str:
+	'''sha256 of a file's content, read in chunks'''
+	digest = hashlib.sha256()
+	with open(fn, 'rb') as input_file:
+		while chunk := input_file.read(chunk_size):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+def control_digest(control) -> str:
+	'''sha256 of the control stations, independent of dict order'''
+	stations = sorted((str(name), tuple(float(value) for value in xyz)) for name, xyz in control.items())
+	return hashlib.sha256(repr(stations).encode()).hexdigest()
+
+class ResultCache:
+	'''a directory of pickled results with least recently used, size-based eviction'''
+	def __init__(self, directory = None, max_bytes:int = None):
+		self.directory = pathlib.Path(directory or os.getenv('PYRADIALS_CACHE') or DEFAULT_DIRECTORY)
+		self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv('PYRADIALS_CACHE_MB', DEFAULT_MAX_MB)) * 1024 * 1024
+		self.directory.mkdir(parents=True, exist_ok=True)
+
+	@staticmethod
+	def key(*parts) -> str:
+		return hashlib.sha256('|'.join(str(part) for part in (PARSER_VERSION, *parts)).encode()).hexdigest()
+
+	def path(self, key:str) -> pathlib.Path:
+		return self.directory / (key + '.pickle')
+
+	def get(self, key:str) -> tuple:
+		'''returns (hit, value), a corrupt or unreadable entry counts as a miss'''
+		path = self.path(key)
+		try:
+			with open(path, 'rb') as entry:
+				value = pickle.load(entry)
+		except FileNotFoundError:
+			return False, None
+		except Exception as error:
+			logging.debug('dropping unreadable cache entry %s: %s' % (path, error))
+			path.unlink(missing_ok=True)
+			return False, None
+
+		os.utime(path) # mark as recently used
+		return True, value
+
+	def put(self, key:str, value) -> None:
+		# write to a temporary file first so a crash never leaves half an entry behind
+		handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+		with os.fdopen(handle, 'wb') as entry:
+			pickle.dump(value, entry, protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(temporary, self.path(key))
+		self.evict()
+
+	def evict(self) -> None:
+		'''removes the least recently used entries until the cache fits in max_bytes'''
+		entries = [(path.stat().st_mtime, path.stat().st_size, path) for path in self.directory.glob('*.pickle')]
+		total = sum(size for _, size, _ in entries)
+
+		for _, size, path in sorted(entries):
+			if total <= self.max_bytes:
+				break
+			path.unlink(missing_ok=True)
+			total -= size
+
+	def clear(self) -> None:
+		for path in self.directory.glob('*.pickle'):
+			path.unlink(missing_ok=True)
+
+def cached_source(fn:str, load, cache:ResultCache = None, *options):
+	'''returns (digest, source) where source is load(fn) or its cached copy, options are whatever else load depends on'''
+	digest = file_digest(fn)
+	if cache is None:
+		return digest, load(fn)
+
+	key = cache.key('source', digest, *options)
+	hit, source = cache.get(key)
+	if not hit:
+		source = load(fn)
+		cache.put(key, source)
+	else:
+		source['file_name'] = pathlib.Path(fn).name # same content may have been cached under another name
+	return digest, source
+
+def cached_radials(digest:str, control, reduce, cache:ResultCache = None) -> tuple:
+	'''returns (hit, radials) where radials is reduce() or its cached copy for this file and control'''
+	if cache is None:
+		return False, reduce()
+
+	key = cache.key('radials', digest, control_digest(control))
+	hit, radials = cache.get(key)
+	if not hit:
+		radials = reduce()
+		cache.put(key, radials)
+	return hit, radials
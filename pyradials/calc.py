@@ -1,5 +1,6 @@
 '''reusable mathematical calculations/functions'''
 import math
+import numpy as np
 
 def mm_to_m(length_mm):
     '''Converts length from millimetres (mm) to decimal metres (m).'''
@@ -104,4 +105,51 @@ def horizontal_to_azimuth(horizontal_angle):
 
     return azimuth
 
+# Array counterparts, each takes whole numpy columns (or anything np.asarray accepts) and
+# matches its scalar function above, special cases included, element by element.
 
+def dms_to_decimal_array(values):
+    '''dms_to_decimal for integer gsi angles (dddmmss + a final digit that is dropped), e.g. 18716194'''
+    values = np.asarray(values).astype(np.int64)
+    dms = np.abs(values) // 10
+    degrees, minutes, seconds = dms // 10000, dms // 100 % 100, dms % 100
+    return np.sign(values) * np.round(degrees + minutes / 60 + seconds / 3600, 6)
+
+def spherical_to_cartesian_array(radius, inclination, azimuth, origin = (0,0,0)):
+    '''spherical_to_cartesian for columns, origin is a single (x, y, z) or one row per element'''
+    inclination_rad = np.radians(inclination)
+    azimuth_rad = np.radians(azimuth)
+    origin = np.asarray(origin, dtype=np.float64)
+
+    horizontal = radius * np.sin(inclination_rad)
+    x = origin[..., 0] + horizontal * np.cos(azimuth_rad)
+    y = origin[..., 1] + horizontal * np.sin(azimuth_rad)
+    z = origin[..., 2] + radius * np.cos(inclination_rad)
+
+    return x, y, z
+
+def cartesian_to_spherical_array(coord1, coord2):
+    '''cartesian_to_spherical for (n, 3) arrays of from and to coordinates (either may be a single point)'''
+    coord1 = np.asarray(coord1, dtype=np.float64)
+    coord2 = np.asarray(coord2, dtype=np.float64)
+
+    dx = coord2[..., 0] - coord1[..., 0]
+    dy = coord2[..., 1] - coord1[..., 1]
+    dz = coord2[..., 2] - coord1[..., 2]
+
+    radius = np.sqrt(dx**2 + dy**2 + dz**2)
+
+    # straight up or down: +/-90, or 0 for coincident points
+    vertical = (dx == 0) & (dy == 0)
+    inclination = np.where(vertical, np.sign(dz) * 90.0, np.degrees(np.arctan2(np.sqrt(dx**2 + dy**2), dz)))
+
+    # along the y-axis: +/-90 (not 270), or 0 when dy is 0 too
+    azimuth = np.degrees(np.arctan2(dy, dx))
+    azimuth = np.where(azimuth < 0, azimuth + 360.0, azimuth)
+    azimuth = np.where(dx == 0, np.sign(dy) * 90.0, azimuth)
+
+    return radius, inclination, azimuth
+
+def horizontal_to_azimuth_array(horizontal_angle):
+    '''horizontal_to_azimuth for a column of horizontal angles'''
+    return (90 - np.asarray(horizontal_angle) % 360) % 360
@@ -1,7 +1,7 @@
 import os
 from tabulate import tabulate
 from colour import Colour; colour = Colour()
-from calc import spherical_to_cartesian, dms_to_decimal, cartesian_to_spherical, horizontal_to_azimuth
+from reduction import reduce_source, reduction_to_drawing
 
 
 def banner(version:str = '0.0.0'):
@@ -19,7 +19,7 @@ def draw_nice_line():
 
 def print_gps(source):
 	colour.print("\n== GPS STATIONS ==\nStations observed with RTK/GNSS\n", Colour.LIGHT_BLUE)
-	view_stations = [['Name','Easting','Northing','Elev']]
+	view_stations = [['Name','Easting','Northing','Elev','sE','sN','sZ','Epochs','Rejected']]
 
 	for station in source['data']:
 		view_stations.append(station)
@@ -64,97 +64,66 @@ def print_control(control):
 	colour.print(tabulate(stations, headers='firstrow', floatfmt='.3f'), Colour.RED)
 	print('')
 
-def increment_string(s):
-	# Convert the string to a list to make it mutable
-	s = list(s)
-
-	# Start from the end of the string
-	i = len(s) - 1
-	carry = 1  # Initialize carry to 1 to increment the last character
-
-	# Iterate through the string characters from the end to the beginning
-	while i >= 0 and carry:
-		if s[i].isdigit():  # If the character is a digit
-			# Increment the digit and check for carry-over
-			carry, digit = divmod(int(s[i]) + carry, 10)
-			s[i] = str(digit)
-		else:
-			# If the character is not a digit, break the loop
-			break
-		i -= 1
-
-	# If carry is still remaining, prepend '1'
-	if carry:
-		s.insert(0, '1')
-	return ''.join(s)
+def print_adjustment(adjustment, worst:int = 10):
+	colour.print("== ADJUSTMENT ==",Colour.LIGHT_RED)
+	print("sigma0: %s, degrees of freedom: %d, iterations: %d\n" % ('%.3f' % adjustment.sigma0 if adjustment.sigma0 else '-', adjustment.degrees_of_freedom, adjustment.iterations))
 
-def print_radials(source,control) -> list:
-	colour.print("== RADIALS ==",Colour.LIGHT_YELLOW)
-	drawing = []
+	stations = []
+	stations.append(['Station','Easting','Northing','Elev','sE','sN','sZ','Major','Minor','Bearing','Fixed'])
+	stations = stations + [[*station] for station in adjustment.stations]
 
-	for setup in source['data']:
-		radials = []
-		radials.append(['Point ID','Code','Sd','Vt','Hz','Easting','Northing','Elev','Attrib'])
-		colour.print("-- " + str(setup['station']) + ", instrument height: " + str(setup['height']) + "m --",Colour.LIGHT_YELLOW)
+	colour.print(tabulate(stations, headers='firstrow', floatfmt='.4f'), Colour.RED)
+	print('')
 
-		station = setup['station']
-		backsight = setup['backsight']
+	# worst first, direction residuals are in seconds, distance and height residuals in metres
+	residuals = []
+	residuals.append(['From','To','Observation','Observed','Residual','Standardised'])
+	residuals = residuals + [[*residual] for residual in sorted(adjustment.residuals, key=lambda residual: -abs(residual.standardised))[:worst]]
 
-		# if it's the first setup, we won't have a backsight, so let's go find it (typically STN2)
-		if backsight == None:
-			backsight = increment_string(station)
+	colour.print(tabulate(residuals, headers='firstrow', floatfmt='.4f'), Colour.RED)
+	print('')
 
-		stn_xyz = control[station]
-		try:
-			bs_xyz = control[backsight]
-		except:
-			raise ValueError("cant find backsight in control" + str(setup))
-		ro_radius, ro_inclination, ro_azimuth = cartesian_to_spherical(stn_xyz,bs_xyz)
+def print_coincident(index, tolerance:float = 0.005):
+	'''qc report of points within tolerance of each other and of point ids used more than once'''
+	colour.print("== COINCIDENT POINTS ==\nwithin %.3fm in plan\n" % tolerance,Colour.LIGHT_MAGENTA)
 
-		for shot in setup['coded_measurements']:
+	for title, groups in (('coincident', index.coincident(tolerance)), ('duplicate point ids', index.duplicate_point_ids())):
+		points = []
+		points.append(['Group','Point ID','Code','Station','Easting','Northing','Elev','Distance'])
+		points = points + [[*point] for point in index.describe(groups)]
 
-			# fix for a RO done backwards
-			if setup['coded_measurements'][0].vt > 180:
-				shot_angle = shot.hz + 180 % 360
-			else:
-				shot_angle = shot.hz
+		colour.print("-- %d %s --" % (len(groups), title),Colour.LIGHT_MAGENTA)
+		colour.print(tabulate(points, headers='firstrow', floatfmt='.3f'), Colour.MAGENTA)
+		print('')
 
-			# subtract the instruments angle (j) to get a 0, then add the real RO angle (k) and the shot angle (i)
-			i = horizontal_to_azimuth(shot_angle) # angle of shot from 0
-			j = horizontal_to_azimuth(setup['coded_measurements'][0].hz) # angle of ro from 0
-			k = ro_azimuth # angle of ro from actual 0
+def print_radials(source,control) -> list:
+	'''prints each setup's shots and their coordinates, the maths is done by reduction.reduce_source'''
+	colour.print("== RADIALS ==",Colour.LIGHT_YELLOW)
 
-			shot_azimuth = i-j+k
-			x,y,z = spherical_to_cartesian(shot.sd,shot.vt,shot_azimuth,stn_xyz)
+	reduction = reduce_source(source, control)
+	store = reduction.store
 
-			# adjust height based on instrument and target offsets
-			z += setup['height']
-			z -= shot.th
+	for i, setup in enumerate(source['data']):
+		radials = []
+		radials.append(['Point ID','Code','Sd','Vt','Hz','Easting','Northing','Elev','Attrib'])
+		colour.print("-- " + str(setup['station']) + ", instrument height: " + str(setup['height']) + "m --",Colour.LIGHT_YELLOW)
 
+		rows = store.setup_slice(i)
+		for row in range(rows.start, rows.stop):
+			shot = store.shot(row)
 			radials.append([
 				shot.point_id,
 				shot.code,
 				shot.sd,
 				shot.vt,
 				shot.hz,
-				x,
-				y,
-				z,
+				reduction.easting[row],
+				reduction.northing[row],
+				reduction.elevation[row],
 				shot.attrib
 			])
 
-			if shot.code != 'RO':
-				sx,sy,sz = stn_xyz
-				drawing.append([
-					shot.point_id,
-					shot.code,
-					x, y, z,
-					shot.attrib,
-					sx,sy,sz,
-					setup['height']
-				])
-
 		colour.print(tabulate(radials, headers='firstrow', floatfmt='.3f'), Colour.YELLOW)
 		print('')
 
-	return drawing
\ No newline at end of file
+	return reduction_to_drawing(reduction)
@@ -31,7 +31,6 @@ control:dict = {
 #	'STN2':[337952.330,413380.673,10.211]
 	'STN1':[1000.000,2000.000,50.000],
 	'STN2':[997.306,1983.979,50.315],
-	'STN2':[997.306,1983.979,50.315],
 	'STNH1':[997.828,1962.487,50.613],
 	'STNH1A':[998.124,1968.381,50.634],
 	'STNH1A1':[999.615,1967.680,50.631],
@@ -0,0 +1,167 @@
+'''indexed control archive, an sqlite file of station coordinates looked up by name or by position
+
+	control = open_control('office.sqlite') # or a .csv, converted to .sqlite beside it once
+	job = job_control(source, control) # only the stations this source references are read, a dict is kept whole
+
+Opening the archive reads nothing, a lookup by name goes through the primary key and a lookup by
+position through an r-tree, so the cost of a job grows with the stations it uses and not with the
+size of the archive. A ControlStore is a Mapping, anything that reads the control dict
+can take one, but iterating it reads the whole archive, use job_control for that.
+
+	py pyradials/control_store.py import office.csv office.sqlite'''
+import csv, logging, math, os, pathlib, sqlite3, sys
+from collections.abc import Mapping
+
+SCHEMA = (
+	'create table if not exists stations (id integer primary key, name text not null unique, easting real not null, northing real not null, elevation real not null)',
+	'create virtual table if not exists stations_rtree using rtree(id, min_easting, max_easting, min_northing, max_northing)',
+)
+
+# sqlite limits the number of parameters in a query, larger lookups are split
+LOOKUP_CHUNK:int = 500
+
+class ControlStore(Mapping):
+	def __init__(self, fn:str):
+		self.fn = str(fn)
+		self.connection = sqlite3.connect(self.fn, check_same_thread=False)
+		for statement in SCHEMA:
+			self.connection.execute(statement)
+		self.loaded:dict = {} # stations read so far, name -> [easting, northing, elevation]
+
+	# a worker process gets the file name and opens its own connection
+	def __getstate__(self) -> dict:
+		return {'fn': self.fn}
+
+	def __setstate__(self, state:dict):
+		self.__init__(state['fn'])
+
+	def __getitem__(self, name:str) -> list:
+		name = str(name) # names are text in the archive, loaded is keyed the same way lookup keys it
+		if name not in self.loaded:
+			row = self.connection.execute('select easting, northing, elevation from stations where name = ?', (name,)).fetchone()
+			if row is None:
+				raise KeyError(name)
+			self.loaded[name] = list(row)
+		return self.loaded[name]
+
+	def __contains__(self, name) -> bool:
+		try:
+			self[name]
+		except KeyError:
+			return False
+		return True
+
+	def __iter__(self):
+		for name, in self.connection.execute('select name from stations order by id'):
+			yield name
+
+	def __len__(self) -> int:
+		return self.connection.execute('select count(*) from stations').fetchone()[0]
+
+	def lookup(self, names) -> dict:
+		'''the named stations found in the archive, read in as few queries as possible'''
+		wanted = [name for name in dict.fromkeys(str(name) for name in names) if name not in self.loaded]
+		for start in range(0, len(wanted), LOOKUP_CHUNK):
+			chunk = wanted[start:start + LOOKUP_CHUNK]
+			query = 'select name, easting, northing, elevation from stations where name in (%s)' % ','.join('?' * len(chunk))
+			for name, *xyz in self.connection.execute(query, chunk):
+				self.loaded[name] = xyz
+		return {str(name): self.loaded[str(name)] for name in names if str(name) in self.loaded}
+
+	def within(self, easting:float, northing:float, distance:float) -> dict:
+		'''stations within distance (in plan) of a point, nearest first'''
+		rows = self.connection.execute(
+			'select name, easting, northing, elevation from stations join stations_rtree using (id)'
+			' where min_easting <= ? and max_easting >= ? and min_northing <= ? and max_northing >= ?',
+			(easting + distance, easting - distance, northing + distance, northing - distance))
+
+		found = [(math.hypot(e - easting, n - northing), name, [e, n, z]) for name, e, n, z in rows]
+		return {name: xyz for offset, name, xyz in sorted(found) if offset <= distance}
+
+	def nearest(self, easting:float, northing:float, k:int = 1, distance:float = 100.0) -> dict:
+		'''the k stations nearest a point, searching out from distance metres until enough are found'''
+		total = len(self)
+		while True:
+			found = self.within(easting, northing, distance)
+			if len(found) >= min(k, total):
+				return dict(list(found.items())[:k])
+			distance *= 4
+
+	def add(self, stations) -> None:
+		'''inserts or replaces (name, easting, northing, elevation) rows, the last of a repeated name wins'''
+		rows = [(str(name), float(easting), float(northing), float(elevation)) for name, easting, northing, elevation in stations]
+		with self.connection:
+			self.connection.executemany(
+				'insert into stations (name, easting, northing, elevation) values (?, ?, ?, ?)'
+				' on conflict(name) do update set easting = excluded.easting, northing = excluded.northing, elevation = excluded.elevation', rows)
+			self.connection.execute('create temp table if not exists added (name text primary key)')
+			self.connection.executemany('insert or ignore into added values (?)', [row[:1] for row in rows])
+			self.connection.execute('insert or replace into stations_rtree select id, easting, easting, northing, northing from stations join added using (name)')
+			self.connection.execute('delete from added')
+		for row in rows:
+			self.loaded.pop(row[0], None)
+
+	def close(self) -> None:
+		self.connection.close()
+
+def read_control_csv(fn:str):
+	'''yields (name, easting, northing, elevation) from a name,easting,northing,elevation csv, a header row is skipped'''
+	with open(fn, newline='') as csv_file:
+		for row in csv.reader(csv_file):
+			if not row or row[0].startswith('#'):
+				continue
+			try:
+				yield row[0].strip(), float(row[1]), float(row[2]), float(row[3])
+			except ValueError:
+				logging.debug('skipping control row %s' % row)
+
+def import_csv(csv_fn:str, db_fn:str = None) -> ControlStore:
+	'''converts a control csv into an archive (default, beside it as .sqlite), only when the csv is newer'''
+	db_fn = pathlib.Path(db_fn or pathlib.Path(csv_fn).with_suffix('.sqlite'))
+	if db_fn.exists() and db_fn.stat().st_mtime >= os.stat(csv_fn).st_mtime:
+		return ControlStore(db_fn)
+
+	db_fn.unlink(missing_ok=True)
+	store = ControlStore(db_fn)
+	store.add(read_control_csv(csv_fn))
+	return store
+
+def open_control(fn:str) -> ControlStore:
+	'''an archive from an .sqlite (or .db) file, or from a .csv via import_csv'''
+	if pathlib.Path(fn).suffix.lower() == '.csv':
+		return import_csv(fn)
+	if not pathlib.Path(fn).exists():
+		raise FileNotFoundError(fn)
+	return ControlStore(fn)
+
+def referenced_stations(source:dict) -> list:
+	'''names a total station source may look up in control, its stations, backsights and named point ids'''
+	from reduction import increment_string
+	store = source.get('store')
+	if store is not None:
+		names = store.stations + [backsight or increment_string(station) for station, backsight in zip(store.stations, store.backsights)]
+		names += [name for name in store.point_ids.values if isinstance(name, str)]
+	else:
+		names = []
+		for setup in source['data']:
+			names += [setup['station'], setup['backsight'] or increment_string(setup['station'])]
+			names += [shot.point_id for shot in setup['coded_measurements'] if isinstance(shot.point_id, str)]
+	return list(dict.fromkeys(names))
+
+def job_control(source:dict, control) -> dict:
+	'''control for a source as a plain dict, only the stations it references from a ControlStore, a copy of
+	all of a dict (control.py), whose stations are printed and drawn whether the source uses them or not'''
+	if isinstance(control, ControlStore):
+		return control.lookup(referenced_stations(source))
+	return dict(control)
+
+# Main block to execute if the script is run directly, import a csv or look stations up
+if __name__ == "__main__":
+	if len(sys.argv) > 2 and sys.argv[1] == 'import':
+		store = import_csv(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+		print("%d stations in %s" % (len(store), store.fn))
+	elif len(sys.argv) > 2:
+		store = open_control(sys.argv[1])
+		print(store.lookup(sys.argv[2:]))
+	else:
+		print(__doc__)
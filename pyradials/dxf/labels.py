@@ -0,0 +1,134 @@
+'''places labels clear of each other, trying positions around each point against a grid of what's already placed
+
+	labels = LabelIndex(style.text_height * 2)
+	labels.add_point((x, y), style.point_size)
+	insert = labels.place("1.25", (x, y), height, (0.1, 0.0)) # the first clear position, the preferred offset first
+
+Label boxes are estimated from the length of the text (CHAR_WIDTH of the height a character) and kept in
+a hash grid of cells about two labels high, so checking a candidate looks only at the boxes in the few
+cells it covers. A cell that's already full (CELL_LIMIT boxes) rejects every candidate without looking,
+so a pile of points shot in the same place costs no more than a spread out survey and placing n labels
+is O(n). A label that fits nowhere goes at its preferred offset and is counted in overlaps.
+
+Labels avoid the labels and points plotted before them, a later point can still land on an earlier label.
+Placing needs every label drawn in one pass, so draw_dxf refuses it with --parallel or --tiles. In a --stream
+the cells only earlier setups touched are dropped (evict_behind) to keep memory bounded.'''
+import math
+from collections import defaultdict
+
+CHAR_WIDTH:float = 0.6 # of the text height, about right for the digits and capitals of the Standard style
+CELL_LIMIT:int = 32 # boxes in a cell before it counts as full
+SETUPS_KEPT:int = 1 # setups before the current one whose cells evict_behind keeps, the next setup often shoots the same ground
+
+# where candidates sit around the point, as (x, y) steps, right of the point first as a surveyor reads it
+DIRECTIONS = ((1, 0), (1, 1), (1, -1), (-1, 0), (-1, 1), (-1, -1), (0, 1), (0, -1))
+
+def text_box(text:str, insert:tuple, height:float) -> tuple:
+	'''(min_x, min_y, max_x, max_y) a label covers, from its insert (the left of its baseline)'''
+	x, y = insert[0], insert[1]
+	return x, y, x + len(text) * height * CHAR_WIDTH, y + height
+
+def overlaps(a:tuple, b:tuple) -> bool:
+	return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+class LabelIndex:
+	def __init__(self, cell_size:float):
+		self.cell_size = cell_size
+		self.cells = defaultdict(list) # (column, row) -> boxes touching the cell
+		self.placed:int = 0
+		self.moved:int = 0 # placed clear, away from the preferred offset
+		self.overlapping:int = 0 # nowhere clear, left at the preferred offset
+		self.setup = None # the setup boxes are being added for, and its number
+		self.setups:int = 0
+		self.touched = {} # (column, row) -> number of the last setup that added a box to the cell
+
+	@classmethod
+	def from_entities(cls, cell_size:float, entities):
+		'''an index holding the TEXT entities already in a drawing, the control names or an appended drawing's labels'''
+		index = cls(cell_size)
+		for text in entities:
+			index.add(text_box(text.dxf.text, text.dxf.insert, text.dxf.height))
+		return index
+
+	def cells_of(self, box:tuple):
+		size = self.cell_size
+		for column in range(math.floor(box[0] / size), math.floor(box[2] / size) + 1):
+			for row in range(math.floor(box[1] / size), math.floor(box[3] / size) + 1):
+				yield column, row
+
+	def clear(self, box:tuple) -> bool:
+		'''nothing placed overlaps box'''
+		for cell in self.cells_of(box):
+			boxes = self.cells.get(cell)
+			if boxes is None:
+				continue
+			if len(boxes) >= CELL_LIMIT:
+				return False
+			for placed in boxes:
+				if overlaps(box, placed):
+					return False
+		return True
+
+	def add(self, box:tuple) -> None:
+		for cell in self.cells_of(box):
+			boxes = self.cells[cell]
+			if len(boxes) < CELL_LIMIT: # a full cell already rejects everything
+				boxes.append(box)
+			self.touched[cell] = self.setups
+
+	def at_setup(self, setup:tuple) -> None:
+		'''boxes added from here on are setup's'''
+		if setup != self.setup:
+			self.setup = setup
+			self.setups += 1
+
+	def evict_behind(self, kept:int = SETUPS_KEPT) -> int:
+		'''drops the cells nothing was added to from the current setup or the kept setups before it, returns how many'''
+		oldest = self.setups - kept
+		stale = [cell for cell, setup in self.touched.items() if setup < oldest]
+		for cell in stale:
+			del self.cells[cell], self.touched[cell]
+		return len(stale)
+
+	def add_point(self, point:tuple, size:float) -> None:
+		'''keeps labels off a point's marker'''
+		x, y = point[0], point[1]
+		self.add((x - size / 2, y - size / 2, x + size / 2, y + size / 2))
+
+	def candidates(self, text:str, point:tuple, height:float, preferred:tuple):
+		'''inserts to try, the preferred offset, then around the point at one and two label heights'''
+		x, y = point[0], point[1]
+		yield x + preferred[0], y + preferred[1]
+		width = len(text) * height * CHAR_WIDTH
+		for gap in (height / 2, height * 1.5):
+			for step_x, step_y in DIRECTIONS:
+				left = x + gap if step_x > 0 else x - gap - width if step_x < 0 else x - width / 2
+				bottom = y + gap if step_y > 0 else y - gap - height if step_y < 0 else y - height / 2
+				yield left, bottom
+
+	def place(self, text:str, point:tuple, height:float, preferred:tuple) -> tuple:
+		'''(x, y) insert of a label for point, the first candidate that's clear of everything placed'''
+		self.placed += 1
+		for number, insert in enumerate(self.candidates(text, point, height, preferred)):
+			box = text_box(text, insert, height)
+			if self.clear(box):
+				self.add(box)
+				self.moved += number > 0
+				return insert
+
+		insert = point[0] + preferred[0], point[1] + preferred[1]
+		self.add(text_box(text, insert, height))
+		self.overlapping += 1
+		return insert
+
+	def __str__(self) -> str:
+		return "%d labels, %d moved clear, %d overlapping" % (self.placed, self.moved, self.overlapping)
+
+# Main block to execute if the script is run directly
+if __name__ == "__main__":
+	labels = LabelIndex(0.24)
+	for number in range(10): # ten spot levels 5cm apart along a kerb
+		point = (number * 0.05, 0.0)
+		labels.add_point(point, 0.025)
+		print(number, labels.place("12.34", point, 0.12, (0.1, 0.0)))
+	print(labels)
@@ -0,0 +1,121 @@
+'''builds a drawing a layer at a time across a process pool, then merges the layers into one dxf
+
+	draw_dxf(radials, stations, 100, 'survey.dxf', parallel=True)
+
+Shots are partitioned by their code's layer (each shot's point, labels and radial go with it), every
+partition is plotted by a worker into its own document and exported as dxf tags, handles drawn from a
+range of its own so none clash. Every document starts from new_document, so the layer table, FLAG
+and CANOPY are the same in each and the merged drawing keeps just one copy, tree blocks are named by
+their size so the merged drawing makes each once from the names the workers used. The tags go into
+the ENTITIES section through a StreamWriter, so merging costs a copy rather than a re-read.
+
+Runs remember the radial colour and setup the survey had reached and whether a string carried on
+into them, so each layer comes out as it would from a single pass.'''
+import io
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from ezdxf import bbox
+from ezdxf.lldxf.tagwriter import TagWriter
+from dxf.layers import CodeLibrary, builtin_library
+from dxf.plot import PlotState, new_document, plot_stations, plot_radials, add_string, add_setup_radials
+from dxf.shapes import is_tree_block, tree_block_from_name
+from dxf.stream import StreamWriter
+from profiling import stage
+
+# each partition allocates handles from its own range, far above the base document's
+HANDLE_RANGE:int = 1 << 32
+
+# rows are contiguous in the survey, radial_colour and setup are the survey's before the first of them
+Run = namedtuple("Run", "rows radial_colour setup continues")
+
+# a worker's merged output, entities as dxf tags
+Partition = namedtuple("Partition", "layer entities extents counts blocks next_handle")
+
+def partition_layers(radials, codes:CodeLibrary = None) -> dict:
+	'''layer name -> Runs of its rows, in survey order'''
+	codes = codes or builtin_library
+	partitions:dict = {}
+	state = PlotState()
+	last_layer, line_layer = None, None # layer of the previous row, and of the previous line row
+	for row in radials:
+		pid, code, x, y, z, attrib, sx, sy, sz, ih = row
+		record = codes[code]
+		layer_name = record.layer_name
+
+		runs = partitions.setdefault(layer_name, [])
+		if layer_name != last_layer:
+			runs.append(Run([], state.radial_colour, state.prev_setup, line_layer == layer_name))
+		runs[-1].rows.append(row)
+		last_layer = layer_name
+
+		# the same colour sequence plot_radials follows
+		if state.prev_setup is not None and state.prev_setup != (sx, sy, sz, ih):
+			state.radial_colour += 1
+		state.prev_setup = (sx, sy, sz, ih)
+		if record.type == 'line':
+			line_layer = layer_name
+	return partitions
+
+def build_layer(layer_name:str, runs:list, scale:int, linework:str, radial_mode:str, handle_start:int, codes:CodeLibrary = None) -> Partition:
+	'''plots one layer's runs in a document of its own, returns its entities as dxf tags'''
+	doc, style = new_document(scale, codes)
+	doc.entitydb.handles.reset('%X' % handle_start)
+	msp = doc.modelspace()
+
+	state = PlotState()
+	for run in runs:
+		if not run.continues and state.prev_code is not None: # another code's string came in between
+			add_string(msp, state.prev_layer, state.string, linework)
+			state.prev_code, state.string = None, []
+		if state.prev_setup != run.setup:
+			if radial_mode == 'setup':
+				add_setup_radials(msp, state)
+			state.prev_setup = run.setup
+		state.radial_colour = run.radial_colour
+		plot_radials(doc, msp, run.rows, style, state, linework, radial_mode, finish=False, codes=codes)
+	plot_radials(doc, msp, [], style, state, linework, radial_mode, codes=codes)
+
+	entities = io.StringIO()
+	tagwriter = TagWriter(entities, dxfversion=doc.dxfversion, write_handles=True)
+	for entity in msp:
+		entity.export_dxf(tagwriter)
+
+	extents = bbox.extents(msp, fast=True)
+	blocks = [block.name for block in doc.blocks if is_tree_block(block.name)]
+	counts = Counter(entity.dxftype() for entity in msp)
+	return Partition(layer_name, entities.getvalue(), (extents.extmin, extents.extmax) if extents.has_data else None, counts, blocks, int(str(doc.entitydb.handles), 16))
+
+def draw_layers(radials, stations:list, scale:int, filename:str, linework:str = 'polyline', radial_mode:str = 'shot', workers:int = None, fmt:str = 'dxf', codes:CodeLibrary = None) -> Counter:
+	'''draws each layer in a worker process and merges them into filename, returns the entities drawn'''
+	with stage('partition_layers') as record:
+		partitions = partition_layers(radials, codes)
+		record.records = len(partitions)
+
+	doc, style = new_document(scale, codes)
+	msp = doc.modelspace()
+	entities = Counter()
+
+	with StreamWriter(doc, filename, fmt) as writer:
+		plot_stations(msp, stations, style)
+		entities.update(entity.dxftype() for entity in msp)
+		writer.flush()
+
+		with stage('build_layers') as record, ProcessPoolExecutor(max_workers=workers) as executor:
+			futures = [executor.submit(build_layer, layer_name, runs, scale, linework, radial_mode, HANDLE_RANGE * number, codes)
+				for number, (layer_name, runs) in enumerate(partitions.items(), 1)]
+			next_handle = int(str(doc.entitydb.handles), 16)
+			for future in futures:
+				partition = future.result()
+				for name in partition.blocks:
+					tree_block_from_name(doc, name)
+				writer.write(partition.entities, partition.extents or [])
+				entities.update(partition.counts)
+				next_handle = max(next_handle, partition.next_handle)
+			record.records = sum(entities.values())
+
+		with stage('saveas') as record:
+			doc.entitydb.handles.reset('%X' % next_handle) # $HANDSEED past every partition's handles
+			writer.close(); print("done")
+			record.records = sum(entities.values())
+
+	return entities
@@ -1,4 +1,11 @@
-'''layers.py used to store instrument code and layer info'''
+'''layers.py used to store instrument code and layer info
+
+The tables below are the built-in code library, a survey can bring its own as a json file instead
+(load_code_library), export this one to start from with: py pyradials/dxf/layers.py export codes.json'''
+import json, logging, sys
+from collections import namedtuple
+from types import MappingProxyType
+from ezdxf.tools.standards import linetypes
 
 # Static Colour Definitions
 WHITE:int = 0
@@ -27,6 +34,14 @@ IMPORTANT:int = 240
 LASER:int = 247
 DULL:int = 252
 
+# the colours above by name, for code libraries that give colours by name
+COLOURS:dict = {
+    'WHITE': WHITE, 'RED': RED, 'YELLOW': YELLOW, 'GREEN': GREEN, 'CYAN': CYAN, 'BLUE': BLUE, 'MAGENTA': MAGENTA,
+    'DARK_GREY': DARK_GREY, 'GREY': GREY, 'LIGHT_GREY': LIGHT_GREY, 'SALMON': SALMON, 'BRICK': BRICK, 'BROWN': BROWN,
+    'ORANGE': ORANGE, 'PINK': PINK, 'WOOD': WOOD, 'SUNSHINE': SUNSHINE, 'SPARK': SPARK, 'TECH': TECH,
+    'TURQUOISE': TURQUOISE, 'NATURE': NATURE, 'SKY_BLUE': SKY_BLUE, 'IMPORTANT': IMPORTANT, 'LASER': LASER, 'DULL': DULL,
+}
+
 # Code Table, format is {'code':['desc', 'layer','type','height-code']}
 code_table = {
     # control, meta, and important
@@ -136,6 +151,7 @@ layer_table = {
     'kerb':[WHITE,'Continuous'],
     'kerb_top':[GREY,'Continuous'],
     'level':[BRICK,'Continuous'],
+    'levels':[BRICK,'Continuous'],
     'road_marking':[GREY,'Continuous'],
     'street_furniture':[GREY,'Continuous'],
     'tadpoles':[PINK,'Continuous'],
@@ -152,38 +168,125 @@ layer_table = {
     'service_water':[CYAN,'Dot'],
 }
 
-def get_code_info(code):
-    code_info = code_table.get(code)
-    if code_info:
-        desc, layer, type_, height_code = code_info
-        layer_info = layer_table.get(layer)
-        if layer_info:
-            color_code, linetype = layer_info
-            return {
-                'layer_name': layer,
-                'layer_color': color_code,
-                'layer_linetype': linetype,
-                'description': desc,
-                'type': type_,
-                'height_code': height_code
-            }
-        else:
-            return {
-                'layer_name': layer,
-                'description': desc,
-                'type': type_,
-                'height_code': height_code
-            }
-    else:
-        return None
+# codes not in a library are drawn as points on this layer, labelled with the code and level
+FALLBACK_LAYER:str = 'unknown_codes'
+FALLBACK_COLOUR:int = RED
+CODE_TYPES = ('line', 'point', 'block', 'circle')
+
+# layers dxf/plot.py and dxf/shapes.py draw on whatever the codes, every library has to have them
+REQUIRED_LAYERS = ('points', 'radials', 'control', 'vegetation')
+
+# the linetypes a drawing from dxf.plot.new_document has, names are case insensitive
+LINETYPES = frozenset(['CONTINUOUS', 'BYLAYER', 'BYBLOCK', *(name.upper() for name, *_ in linetypes())])
+
+# one compiled code, the *_attribs are shared read-only dxfattribs for the entities drawn for it
+CodeRecord = namedtuple("CodeRecord", "code description layer_name type height_code layer_color layer_linetype point_attribs text_attribs line_attribs")
+
+def colour_value(colour) -> int:
+    '''an aci colour from a number or one of the COLOURS names'''
+    if isinstance(colour, str):
+        if colour not in COLOURS:
+            raise ValueError("unknown colour %s" % colour)
+        return COLOURS[colour]
+    return int(colour)
+
+class CodeLibrary:
+    '''the codes and layers of a survey, validated and compiled once, library[code] is a CodeRecord'''
+    def __init__(self, codes:dict, layers:dict, name:str = 'builtin'):
+        self.name = name
+        self.source = (codes, layers) # rebuilt from in a worker process
+        problems = []
+
+        self.layers = {}
+        for layer, entry in layers.items():
+            if not isinstance(entry, (list, tuple)) or len(entry) != 2:
+                problems.append("layer %s: %s isn't [colour, linetype]" % (layer, json.dumps(entry)))
+                continue
+            colour, linetype = entry
+            try:
+                colour = colour_value(colour)
+                if not 0 <= colour <= 256:
+                    raise ValueError("colour %d out of range" % colour)
+            except (TypeError, ValueError) as error:
+                problems.append("layer %s: %s" % (layer, error))
+                continue
+            if str(linetype).upper() not in LINETYPES:
+                problems.append("layer %s: linetype %s isn't one of the drawing's" % (layer, linetype))
+                continue
+            self.layers[layer] = (colour, linetype)
+        problems += ["layer %s is drawn on whatever the codes and has to be in the layer table" % layer for layer in REQUIRED_LAYERS if layer not in layers]
+        self.layers.setdefault(FALLBACK_LAYER, (FALLBACK_COLOUR, 'Continuous'))
+
+        self.records = {}
+        for code, entry in codes.items():
+            if not isinstance(entry, (list, tuple)) or len(entry) != 4:
+                problems.append("code %s: %s isn't [description, layer, type, height-code]" % (code, json.dumps(entry)))
+                continue
+            description, layer, type_, height_code = entry
+            if layer not in self.layers and layer != '0':
+                problems.append("code %s: layer %s isn't in the layer table" % (code, layer))
+            elif type_ not in CODE_TYPES:
+                problems.append("code %s: type %s isn't one of %s" % (code, type_, ', '.join(CODE_TYPES)))
+            else:
+                self.records[code] = self.compile(code, description, layer, type_, height_code)
 
-# Main block to execute if the script is run directly
+        if problems:
+            raise ValueError("code library %s has problems:\n  %s" % (name, '\n  '.join(problems)))
+        self.unknown = {} # fallback records, made once per unknown code
+
+    def __reduce__(self):
+        return (CodeLibrary, (*self.source, self.name))
+
+    def compile(self, code:str, description:str, layer:str, type_:str, height_code:str) -> CodeRecord:
+        colour, linetype = self.layers.get(layer, (None, None))
+        attribs = MappingProxyType({'layer': layer})
+        return CodeRecord(code, description, layer, type_, height_code, colour, linetype, attribs, attribs, attribs)
+
+    def __getitem__(self, code:str) -> CodeRecord:
+        record = self.records.get(code)
+        if record is None:
+            record = self.unknown.get(code)
+            if record is None:
+                logging.warning("code %s isn't in the %s code library, drawn on %s" % (code, self.name, FALLBACK_LAYER))
+                record = self.unknown[code] = self.compile(code, 'Unknown Code', FALLBACK_LAYER, 'point', str(code))
+        return record
+
+    def __contains__(self, code:str) -> bool:
+        return code in self.records
+
+    def as_json(self) -> dict:
+        codes, layers = self.source
+        return {'layers': layers, 'codes': codes}
+
+def load_code_library(fn:str) -> CodeLibrary:
+    '''a library from a json file of {"layers": {layer: [colour, linetype]}, "codes": {code: [desc, layer, type, height-code]}}
+    in the same formats as the tables above, colours by number or name, with "extends": "builtin" the
+    file's layers and codes are added to (or replace) the built-in ones rather than standing alone'''
+    with open(fn) as json_file:
+        library = json.load(json_file)
+
+    codes, layers = library.get('codes', {}), library.get('layers', {})
+    if library.get('extends') == 'builtin':
+        codes, layers = {**code_table, **codes}, {**layer_table, **layers}
+    elif library.get('extends') is not None:
+        raise ValueError("code library %s extends %s, only builtin can be extended" % (fn, library['extends']))
+    return CodeLibrary(codes, layers, str(fn))
+
+builtin_library = CodeLibrary(code_table, layer_table)
+
+# Main block to execute if the script is run directly, look a code up or export the built-in library
 if __name__ == "__main__":
-    code = 'BE'
-    code_info = get_code_info(code)
-    if code_info:
+    if len(sys.argv) > 2 and sys.argv[1] == 'export':
+        with open(sys.argv[2], 'w') as json_file:
+            json.dump(builtin_library.as_json(), json_file, indent=1)
+        print("%d codes and %d layers written to %s" % (len(code_table), len(layer_table), sys.argv[2]))
+        sys.exit()
+
+    library = load_code_library(sys.argv[2]) if len(sys.argv) > 2 else builtin_library
+    code = sys.argv[1] if len(sys.argv) > 1 else 'BE'
+    if code in library:
         print("Code Information:")
-        for key, value in code_info.items():
+        for key, value in library[code]._asdict().items():
             print(f"{key}: {value}")
     else:
         print("Code not found in the code table.")
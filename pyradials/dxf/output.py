@@ -0,0 +1,75 @@
+'''how a drawing is written to disk, plain text dxf, binary dxf, or text dxf compressed with gzip or zip
+
+	path = save_document(doc, 'survey.dxf', 'gzip') # survey.dxf.gz
+	doc = read_document(path)
+
+Binary dxf holds the same document in about two thirds of the bytes and CAD packages that read R2010
+dxf read it, ezdxf writes it no faster and parses it a little slower. Compressed text is around a
+sixth of the size for about the same write time, most CAD packages need it unpacked before they open
+it, ezdxf reads .zip directly and .gz through read_document.'''
+import gzip, io, pathlib, zipfile
+import ezdxf
+from ezdxf.filemanagement import dxf_stream_info
+
+OUTPUT_FORMATS = ('dxf', 'binary', 'gzip', 'zip')
+
+def output_path(filename:str, fmt:str = 'dxf') -> pathlib.Path:
+	'''the file a format writes for a .dxf filename'''
+	filename = pathlib.Path(filename)
+	match fmt:
+		case 'dxf' | 'binary':
+			return filename
+		case 'gzip':
+			return filename.with_name(filename.name + '.gz')
+		case 'zip':
+			return filename.with_suffix('.zip')
+		case _:
+			raise ValueError("unknown output format %s" % fmt)
+
+def open_output(filename:str, fmt:str, encoding:str):
+	'''a text stream to write a dxf into, writing through gzip or zip when fmt asks for it'''
+	path = output_path(filename, fmt)
+	match fmt:
+		case 'dxf':
+			return open(path, 'wt', encoding=encoding, errors='dxfreplace')
+		case 'gzip':
+			return gzip.open(path, 'wt', encoding=encoding, errors='dxfreplace', compresslevel=6)
+		case 'zip':
+			archive = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6)
+			return ZipMember(archive, pathlib.Path(filename).name, encoding)
+		case _:
+			raise ValueError("%s output can't be written as text" % fmt)
+
+class ZipMember(io.TextIOWrapper):
+	'''a text stream into one file of a zip archive, closing it closes the archive'''
+	def __init__(self, archive:zipfile.ZipFile, name:str, encoding:str):
+		self.archive = archive
+		super().__init__(archive.open(name, 'w', force_zip64=True), encoding=encoding, errors='dxfreplace')
+
+	def close(self):
+		super().close()
+		self.archive.close()
+
+def save_document(doc, filename:str, fmt:str = 'dxf') -> pathlib.Path:
+	'''writes doc in fmt, returns the path written'''
+	if fmt == 'binary':
+		doc.saveas(filename, fmt='bin')
+		return pathlib.Path(filename)
+
+	with open_output(filename, fmt, doc.output_encoding) as stream:
+		doc.write(stream)
+	return output_path(filename, fmt)
+
+def read_document(filename:str):
+	'''reads a drawing written in any of the OUTPUT_FORMATS'''
+	filename = pathlib.Path(filename)
+	match filename.suffix.lower():
+		case '.gz':
+			with gzip.open(filename, 'rt', encoding='utf-8', errors='ignore') as stream:
+				encoding = dxf_stream_info(stream).encoding # the header is ascii, read far enough to find the encoding
+			with gzip.open(filename, 'rt', encoding=encoding, errors='surrogateescape') as stream:
+				return ezdxf.read(stream)
+		case '.zip':
+			return ezdxf.readzip(filename)
+		case _:
+			return ezdxf.readfile(filename) # binary or text
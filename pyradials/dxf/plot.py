@@ -1,63 +1,136 @@
+from collections import Counter, namedtuple
+from itertools import islice
+import json, os, pathlib, pickle
 import ezdxf
-from ezdxf import zoom
-from dxf.layers import layer_table, get_code_info
+from ezdxf import bbox, zoom
+from ezdxf.math import BoundingBox
+from types import MappingProxyType
+from dxf.layers import CodeLibrary, builtin_library
+from dxf.labels import LabelIndex
 import dxf.shapes
+from dxf.output import save_document
+from dxf.stream import StreamWriter
+from profiling import stage
 
-def draw_dxf(radials,stations,scale:int,filename:str) -> None:
+# how coded strings (linework) and radials are drawn
+LINEWORK_MODES = ('polyline', 'lwpolyline', 'lines') # one 3d polyline a string, one flat lwpolyline a string, or a line a segment
+RADIAL_MODES = ('shot', 'setup') # a line a shot, or one polyline a setup
 
-	# create the dxf document
-	doc = ezdxf.new(dxfversion='R2010', setup=True)
+# shots plotted between writes when streaming
+STREAM_CHUNK:int = 1000
+
+POINT_NUMBER_ATTRIBS = MappingProxyType({'layer': 'points'})
+
+# where labels go from their point, with label_mode 'placed' these are tried first and the label moved when they overlap
+LABEL_MODES = ('fixed', 'placed')
+POINT_NUMBER_OFFSET = (-0.075, 0.05)
+LABEL_OFFSET = (0.1, 0.0)
+
+# header custom property holding the PlotState and how many rows a drawing holds, for append_dxf
+STATE_PROPERTY:str = 'PYRADIALS_STATE'
 
-	# setup document scale parameters
-	point_size:float = 0.1
-	point_style:int = 0 # dot
-	text_height:float = 0.1
-	units:int = 6 # meters
+# beside an appended drawing, <stem>_append/ holds its document without entities, its entities as dxf tags and its placed labels
+APPEND_SUFFIX:str = '_append'
 
+Style = namedtuple("Style", "text_height point_size point_style units scale")
+
+def drawing_style(scale:int) -> Style:
+	'''text and point sizes for a plot scale'''
 	match scale:
 		case 100: # 1:200 Scale for Internals / Floor plans / Measured Building
-			text_height = 0.12
-			point_size = 0.025
-			point_style = 3 # x-cross
+			return Style(0.12, 0.025, 3, 6, scale) # x-cross, meters
 		case 200: # 1:200 Scale for Topographical and Utility Surveys
-			text_height = 0.24
-			point_size = 0.05
-			point_style = 2 # +-cross
+			return Style(0.24, 0.05, 2, 6, scale) # +-cross, meters
 		case _:
 			raise ValueError("unsupported scale factor")
 
-	# document headers
-	doc.header['$PDSIZE'] = point_size
-	doc.header['$PDMODE'] = point_style
-	doc.header['$INSUNITS'] = units
-	doc.header['$LTSCALE'] = text_height * 2
+def add_layers(doc, codes:CodeLibrary = None) -> None:
+	'''adds the layers of codes (default, the built-in library) that doc doesn't have yet'''
+	for layer, (colour, line_type) in (codes or builtin_library).layers.items():
+		if layer not in doc.layers:
+			doc.layers.add(name=layer, color=colour, linetype=line_type)
 
-	# setup the document with layers, loop through layers list to populate
-	layers = [[key, value[0], value[1]] for key, value in layer_table.items()]
-	for layer, colour, line_type in layers:
-		doc.layers.add(name=layer, color=colour, linetype=line_type)
+def new_document(scale:int, codes:CodeLibrary = None) -> tuple:
+	'''(doc, style) an empty drawing with the headers, the layers of codes (default, the built-in library) and the blocks every plot uses'''
+	style = drawing_style(scale)
 
-	# create the default modelspace
-	msp = doc.modelspace()
+	# create the dxf document
+	doc = ezdxf.new(dxfversion='R2010', setup=True)
 
-	# start plotting
-	prev_code:float = None
-	prev_coord:float = None
-	prev_setup:float = None
-	radial_colour:int = 226
-	special_labels = ['Z','US']
+	# document headers
+	doc.header['$PDSIZE'] = style.point_size
+	doc.header['$PDMODE'] = style.point_style
+	doc.header['$INSUNITS'] = style.units
+	doc.header['$LTSCALE'] = style.text_height * 2
+
+	# setup the document with layers
+	add_layers(doc, codes)
 
 	# create drawing blocks
 	dxf.shapes.flag(doc)
 	dxf.shapes.tree_canopy(doc)
 
+	return doc, style
+
+class PlotState:
+	'''what carries from one shot to the next, the radial colour of the current setup and the open string'''
+	def __init__(self):
+		self.radial_colour:int = 226
+		self.prev_setup:tuple = None
+		self.prev_code:str = None
+		self.prev_layer:str = None
+		self.prev_coord:tuple = None
+		self.string:list = [] # points of the open string, all prev_code
+		self.setup_radials:list = [] # vertices of the current setup's radial polyline
+		self.labels:LabelIndex = None # labels placed so far, when they're placed clear of each other
+
+def write_state(doc, state:PlotState, rows:int, last_row:list, scale:int, stations:list, spool_size:int = None) -> None:
+	'''records where plotting got to in the drawing's header, so append_dxf can carry on from there
+	the open string and setup radials are kept whole, an append extends them rather than starting new ones'''
+	value = json.dumps({
+		'scale': scale,
+		'rows': rows,
+		'last_row': [last_row[0], *last_row[6:10]] if last_row else None, # point id and setup of the last row drawn
+		'stations': stations, # names of the control drawn
+		'spool_size': spool_size, # bytes of entities kept when this was written
+		'radial_colour': state.radial_colour,
+		'prev_setup': state.prev_setup,
+		'prev_code': state.prev_code,
+		'prev_layer': state.prev_layer,
+		'prev_coord': state.prev_coord,
+		'string': state.string,
+		'setup_radials': state.setup_radials,
+	})
+	if doc.header.custom_vars.has_tag(STATE_PROPERTY):
+		doc.header.custom_vars.replace(STATE_PROPERTY, value)
+	else:
+		doc.header.custom_vars.append(STATE_PROPERTY, value)
+
+def read_state(doc) -> tuple:
+	'''(state, saved) written by write_state, saved holds the rest of what it was given by name'''
+	value = doc.header.custom_vars.get(STATE_PROPERTY)
+	if value is None:
+		raise ValueError("drawing has no %s, it wasn't drawn by draw_dxf and can't be appended to" % STATE_PROPERTY)
+	saved = json.loads(value)
+
+	state = PlotState()
+	state.radial_colour = saved['radial_colour']
+	state.prev_code = saved['prev_code']
+	state.prev_layer = saved['prev_layer']
+	state.prev_setup = tuple(saved['prev_setup']) if saved['prev_setup'] else None
+	state.prev_coord = tuple(saved['prev_coord']) if saved['prev_coord'] else None
+	state.string = [tuple(point) for point in saved['string']]
+	state.setup_radials = [tuple(point) for point in saved['setup_radials']]
+	return state, saved
+
+def plot_stations(msp, stations, style:Style) -> None:
 	# insert control points
 	for name, x, y, z in stations:
 		point = (x, y, z)
 		msp.add_point(point, dxfattribs={'layer': 'control'})
 		text_pos = (x + 0.1, y + 0.0, z)
 		msp.add_text(name, dxfattribs={
-				'height': text_height,
+				'height': style.text_height,
 				'insert': text_pos,
 				"layer": 'control'
 			})
@@ -68,117 +141,302 @@ def draw_dxf(radials,stations,scale:int,filename:str) -> None:
 				"layer": 'control'
 			})
 
+def add_string(msp, layer_name:str, points:list, linework:str) -> None:
+	'''a coded string of two or more points as linework'''
+	if len(points) < 2:
+		return
+	match linework:
+		case 'polyline':
+			msp.add_polyline3d(points, dxfattribs={"layer": layer_name})
+		case 'lwpolyline': # flat, at the height of the string's first point
+			msp.add_lwpolyline([point[:2] for point in points], dxfattribs={"layer": layer_name, "elevation": points[0][2]})
+		case 'lines':
+			for start, end in zip(points, points[1:]):
+				msp.add_line(start, end, dxfattribs={"layer": layer_name})
+		case _:
+			raise ValueError("unknown linework mode %s" % linework)
+
+def add_setup_radials(msp, state:PlotState) -> None:
+	'''the current setup's radials as one polyline, station to each shot and back'''
+	if len(state.setup_radials) > 1:
+		msp.add_polyline3d(state.setup_radials, dxfattribs={
+			"layer": 'radials',
+			"color": state.radial_colour
+		})
+	state.setup_radials = []
+
+def add_label(msp, text:str, point:tuple, offset:tuple, height:float, attribs, labels:LabelIndex = None) -> None:
+	'''text offset from point, or wherever labels finds clear when placing labels
+	attribs are shared (a CodeRecord's text_attribs) so ezdxf's copy of them is the only one made'''
+	x, y, z = point
+	if labels is not None:
+		x, y = labels.place(text, point, height, offset)
+	else:
+		x, y = x + offset[0], y + offset[1]
+	label = msp.add_text(text, height=height, dxfattribs=attribs)
+	label.dxf.insert = (x, y, z)
+
+def plot_radials(doc, msp, radials, style:Style, state:PlotState = None, linework:str = 'polyline', radial_mode:str = 'shot', finish:bool = True, codes:CodeLibrary = None, label_mode:str = 'fixed') -> PlotState:
+	'''plots the shots of the drawing list, strings left open at the end stay in the returned state
+	and are drawn as they stand when finish, or left for the next call to carry on when not
+	with label_mode 'placed' labels are moved clear of the labels and points plotted before them'''
+	state = state or PlotState()
+	if label_mode not in LABEL_MODES:
+		raise ValueError("unknown label mode %s" % label_mode)
+	if label_mode == 'placed' and state.labels is None: # starting from the text already drawn, the control names
+		state.labels = LabelIndex.from_entities(style.text_height * 2, msp.query('TEXT'))
+	codes = codes or builtin_library
+	text_height = style.text_height
+	special_labels = ['Z','US']
+	strings = [] # finished (layer, points) strings, drawn once complete
+	radial_attribs = None # rebuilt when the radial colour changes, once a setup
+
 	for pid, code, x, y, z, attrib, sx, sy, sz, ih in radials:
-		try:
-			layer_name, type, height_code = map(get_code_info(code).get, ('layer_name', 'type', 'height_code'))
-		except:
-			layer_name = '0'
-			type = 'line'
-			height_code = code
-			raise ValueError("ADAM YOU ARE MISSING %s" % code)
+		record = codes[code] # unknown codes come back as a record on the fallback layer
+		layer_name, type, height_code = record.layer_name, record.type, record.height_code
 
 		# point
 		point = (x, y, z)
-		msp.add_point(point, dxfattribs={"layer": layer_name})
+		msp.add_point(point, dxfattribs=record.point_attribs)
+		if state.labels is not None:
+			state.labels.at_setup((sx,sy,sz,ih))
+			state.labels.add_point(point, style.point_size)
 
 		# point number
-		text_pos = (x + -0.075, y + 0.05, z)
-		msp.add_text(str(pid), dxfattribs={
-			'height': text_height/4,
-			'insert': text_pos,
-			"layer": 'points'
-			})
+		add_label(msp, str(pid), point, POINT_NUMBER_OFFSET, text_height/4, POINT_NUMBER_ATTRIBS, state.labels)
 
 		# radial
-		if prev_setup is not None and prev_setup != (sx,sy,sz,ih):
-			radial_colour += 1
-		prev_setup = (sx,sy,sz,ih)
+		if state.prev_setup is not None and state.prev_setup != (sx,sy,sz,ih):
+			if radial_mode == 'setup':
+				add_setup_radials(msp, state)
+			state.radial_colour += 1
+		state.prev_setup = (sx,sy,sz,ih)
 
-		msp.add_line((sx, sy, sz+ih), (x, y, z), dxfattribs={
-			"layer": 'radials',
-			"color": radial_colour
-		})
+		if radial_mode == 'setup':
+			station = (sx, sy, sz+ih)
+			state.setup_radials += [point, station] if state.setup_radials else [station, point, station]
+		else:
+			if radial_attribs is None or radial_attribs['color'] != state.radial_colour:
+				radial_attribs = {"layer": 'radials', "color": state.radial_colour}
+			msp.add_line((sx, sy, sz+ih), (x, y, z), dxfattribs=radial_attribs)
 
 		# height label (with optional prefix)
 		if height_code is not None or code in special_labels:
-			text_pos = (x + 0.1, y + 0.0, z)
 			if code in special_labels:
 				text_string = "{},{}{:.2f}".format(attrib, code, z)
 			else:
 				text_string = "{}{:.2f}".format(height_code, z)
+			add_label(msp, text_string, point, LABEL_OFFSET, text_height, record.text_attribs, state.labels)
 
-			msp.add_text(text_string, dxfattribs={
-				'height': text_height,
-				'insert': text_pos,
-				"layer": layer_name
-			})
-
-		# is it a line, draw back to previous point
+		# is it a line, carry on the string of the previous point or start a new one
 		if type == 'line':
-			if prev_code is not None and prev_code == code:
-				msp.add_line(prev_coord, (x, y, z), dxfattribs={"layer": layer_name})
-			prev_code = code
-			prev_coord = (x, y, z)
+			if state.prev_code is not None and state.prev_code == code:
+				state.string.append(point)
+			else:
+				if state.prev_code is not None:
+					strings.append((state.prev_layer, state.string))
+				state.string = [point]
+			state.prev_code = code
+			state.prev_layer = layer_name
+			state.prev_coord = point
 
 
 		# if its a block, do custom block behaviour
 		if type == 'block':
 			match code:
-				case 'TE':
+				case 'TE' | 'TEMG':
 					is_multi_girth, tree_girth, tree_spread = dxf.shapes.tree_splitter(attrib)
 					if is_multi_girth:
-						dxf.shapes.create_mg_tree(doc,str(pid),tree_spread)
-						msp.add_blockref(str(pid), point, dxfattribs={
-							"layer": layer_name
-						})
+						block_name = dxf.shapes.tree_block(doc, 'MGTREE', tree_spread)
 						text_string = "TREE MG {:.2f}".format(z)
 					else:
-						dxf.shapes.create_tree(doc,str(pid),tree_spread,tree_girth)
-						msp.add_blockref(str(pid), point, dxfattribs={
-							"layer": layer_name
-						})
+						block_name = dxf.shapes.tree_block(doc, 'TREE', tree_spread, tree_girth)
 						text_string = "TREE G{:.2f} H{:.2f}".format(tree_girth, z)
-					text_pos = (x + 0.1, y + 0.0, z)
-					msp.add_text(text_string, dxfattribs={
-						'height': text_height,
-						'insert': text_pos,
-						"layer": layer_name
-					})
+					msp.add_blockref(block_name, point, dxfattribs=record.point_attribs)
+					add_label(msp, text_string, point, LABEL_OFFSET, text_height, record.text_attribs, state.labels)
 				case 'STUMP':
 					stump_radius = float(attrib) / 1000 / 3.14 / 2
-					msp.add_circle(center=point, radius=stump_radius, dxfattribs={
-						"layer": layer_name
-					})
-					text_pos = (x + 0.1, y + 0.0, z)
-					text_string = "STUMP {:.2f}".format(z)
-					msp.add_text(text_string, dxfattribs={
-						'height': text_height,
-						'insert': text_pos,
-						"layer": layer_name
-					})
+					msp.add_circle(center=point, radius=stump_radius, dxfattribs=record.line_attribs)
+					add_label(msp, "STUMP {:.2f}".format(z), point, LABEL_OFFSET, text_height, record.text_attribs, state.labels)
 				case 'SAP':
-					dxf.shapes.create_sapling_tree(doc,str(pid),tree_spread)
-					msp.add_blockref(str(pid), point, dxfattribs={
-						"layer": layer_name
-					})
-					text_pos = (x + 0.1, y + 0.0, z)
-					text_string = "SAPLING {:.2f}".format(z)
-					msp.add_text(text_string, dxfattribs={
-						'height': text_height,
-						'insert': text_pos,
-						"layer": layer_name
-					})
-					pass
+					block_name = dxf.shapes.tree_block(doc, 'SAPLING', dxf.shapes.sapling_spread(attrib))
+					msp.add_blockref(block_name, point, dxfattribs=record.point_attribs)
+					add_label(msp, "SAPLING {:.2f}".format(z), point, LABEL_OFFSET, text_height, record.text_attribs, state.labels)
 				case _:
 					pass
 					#print(code)
 
+	for layer_name, points in strings:
+		add_string(msp, layer_name, points, linework)
+
+	# the open string and setup are drawn as they stand, both carry on in state if more shots follow
+	if finish:
+		if state.prev_code is not None:
+			add_string(msp, state.prev_layer, state.string, linework)
+		state.string = [state.prev_coord] if state.prev_coord is not None else []
+
+		if radial_mode == 'setup':
+			add_setup_radials(msp, state)
+
+	return state
+
+def draw_dxf(radials,stations,scale:int,filename:str, linework:str = 'polyline', radial_mode:str = 'shot', stream:bool = False, tiles:str = None, tile_size:float = 100.0, workers:int = None, parallel:bool = False, append:bool = False, fmt:str = 'dxf', codes:CodeLibrary = None, label_mode:str = 'fixed') -> Counter:
+	'''plots and saves the drawing, returns the number of each type of entity in modelspace
+	when stream, entities are written out every STREAM_CHUNK shots rather than held until the save
+	when tiles ('grid' or 'setup'), filename is an index of tiles drawn across workers processes
+	when parallel, each layer is drawn by one of workers processes and merged into filename
+	when append, only the rows past those earlier appends drew are plotted and added to filename
+	fmt is one of dxf.output.OUTPUT_FORMATS, gzip and zip output is named for filename by output_path
+	codes is the CodeLibrary the shots are drawn with, the built-in library when None
+	label_mode 'placed' moves labels clear of each other rather than leaving them at a fixed offset, it needs
+	every label placed in one pass so it can't be used with tiles or parallel'''
+	if label_mode == 'placed' and (tiles is not None or parallel):
+		raise ValueError("placed labels are placed over the whole drawing in one pass, they can't be drawn in tiles or in parallel")
+	if tiles is not None:
+		from dxf.tiles import draw_tiles
+		return draw_tiles(radials, stations, scale, filename, tiles, tile_size, linework, radial_mode, workers, fmt, codes)
+	if parallel:
+		from dxf.layered import draw_layers
+		return draw_layers(radials, stations, scale, filename, linework, radial_mode, workers, fmt, codes)
+	if append:
+		return append_dxf(radials, stations, scale, filename, linework, radial_mode, fmt, codes, label_mode)
+
+	doc, style = new_document(scale, codes)
+
+	# create the default modelspace
+	msp = doc.modelspace()
+
+	if stream:
+		return stream_dxf(doc, msp, radials, stations, style, filename, linework, radial_mode, fmt, codes, label_mode)
+
+	plot_stations(msp, stations, style)
+	state = plot_radials(doc, msp, radials, style, linework=linework, radial_mode=radial_mode, codes=codes, label_mode=label_mode)
+	report_labels(state)
+
 	# zoom to see the created diagram
-	zoom.extents(msp)
+	with stage('zoom_extents'):
+		zoom_to(msp, bbox.extents(msp, fast=True))
 	#raise ValueError("end here")
 	# save the document
-	doc.saveas(filename); print("done")
+	with stage('saveas') as record:
+		save_document(doc, filename, fmt); print("done")
+		record.records = len(msp)
+
+	return Counter(entity.dxftype() for entity in msp)
+
+def stream_dxf(doc, msp, radials, stations, style:Style, filename:str, linework:str, radial_mode:str, fmt:str = 'dxf', codes:CodeLibrary = None, label_mode:str = 'fixed') -> Counter:
+	'''draw_dxf in bounded memory, radials can be any iterable of drawing rows'''
+	entities = Counter()
+	state = PlotState()
+	radials = iter(radials)
+
+	with StreamWriter(doc, filename, fmt) as writer:
+		plot_stations(msp, stations, style)
+		chunk = list(islice(radials, STREAM_CHUNK))
+		while chunk:
+			following = list(islice(radials, STREAM_CHUNK))
+			plot_radials(doc, msp, chunk, style, state, linework, radial_mode, finish=not following, codes=codes, label_mode=label_mode)
+			if state.labels is not None: # labels are only placed against the last few setups, keeping memory bounded
+				state.labels.evict_behind()
+			entities.update(entity.dxftype() for entity in msp)
+			writer.flush()
+			chunk = following
+
+		report_labels(state)
+		with stage('saveas') as record:
+			entities.update(entity.dxftype() for entity in msp)
+			writer.close(); print("done")
+			record.records = writer.count
+
+	return entities
+
+def report_labels(state:PlotState) -> None:
+	if state.labels is not None:
+		print(state.labels)
+
+def zoom_to(msp, extents:BoundingBox) -> None:
+	'''keeps extents as the drawing's $EXTMIN and $EXTMAX and zooms the view to them'''
+	if extents.has_data:
+		msp.dxf.extmin, msp.dxf.extmax = extents.extmin, extents.extmax
+		zoom.center(msp, extents.center, extents.size)
+
+def append_directory(filename) -> pathlib.Path:
+	'''<stem>_append/ beside filename, where append_dxf keeps what it needs to add to the drawing'''
+	filename = pathlib.Path(filename)
+	return filename.with_name(filename.stem + APPEND_SUFFIX)
+
+def append_dxf(radials, stations, scale:int, filename:str, linework:str = 'polyline', radial_mode:str = 'shot', fmt:str = 'dxf', codes:CodeLibrary = None, label_mode:str = 'fixed') -> Counter:
+	'''adds the rows past those earlier appends drew to filename, carrying on their radial colours, open
+	strings and setup radials, and any stations not drawn yet, returns the entities added
+
+	<stem>_append/ beside the drawing keeps its document without entities (header, tables, blocks and the
+	PlotState) and its entities as dxf tags, so an append reads and plots only the new rows and the drawing
+	is written by copying the kept tags, not parsing them. The open string and setup radials are kept in
+	the PlotState, not the spool, each append extends them and draws them whole into the drawing it writes.
+	Without <stem>_append/ the drawing is drawn from the start.'''
+	if fmt == 'binary':
+		raise ValueError("binary dxf is written whole, it can't be appended to (--append), use dxf, gzip or zip")
+	filename = pathlib.Path(filename)
+	directory = append_directory(filename)
+	document_fn, spool_fn, labels_fn = directory / 'document.dxf', directory / 'entities.dxf', directory / 'labels.pickle'
+
+	if document_fn.exists():
+		with stage('readfile'):
+			doc = ezdxf.readfile(document_fn)
+		state, saved = read_state(doc)
+		rows, style = saved['rows'], drawing_style(saved['scale'])
+		if len(radials) < rows or (rows and [radials[rows - 1][0], *radials[rows - 1][6:10]] != saved['last_row']):
+			raise ValueError("%s wasn't drawn from the start of these radials, remove %s to redraw it" % (filename, directory))
+		os.truncate(spool_fn, saved['spool_size']) # an append that failed part way leaves entities past this
+		if label_mode == 'placed' and labels_fn.exists():
+			with open(labels_fn, 'rb') as labels_file:
+				state.labels = pickle.load(labels_file)
+	else:
+		directory.mkdir(exist_ok=True)
+		doc, style = new_document(scale, codes)
+		state, saved, rows = PlotState(), {'stations': []}, 0
+		spool_fn.write_text('')
+
+	add_layers(doc, codes) # a library with layers the drawing was made without
+	msp = doc.modelspace()
+	entities = Counter()
+
+	with StreamWriter(doc, filename, fmt, spool_fn) as writer:
+		if msp.dxf.hasattr('extmin') and msp.dxf.extmin.x <= msp.dxf.extmax.x:
+			writer.extents.extend([msp.dxf.extmin, msp.dxf.extmax])
+
+		added = [station for station in stations if station[0] not in saved['stations']]
+		plot_stations(msp, added, style)
+		plot_radials(doc, msp, radials[rows:], style, state, linework, radial_mode, finish=False, codes=codes, label_mode=label_mode)
+		report_labels(state)
+		entities.update(entity.dxftype() for entity in msp)
+		writer.flush()
+
+		# the open string and setup radials go in the drawing but not the spool, the next append draws them longer
+		if state.prev_code is not None:
+			add_string(msp, state.prev_layer, state.string, linework)
+		if radial_mode == 'setup':
+			setup_radials = state.setup_radials
+			add_setup_radials(msp, state)
+			state.setup_radials = setup_radials
+		entities.update(entity.dxftype() for entity in msp)
+
+		drawn = saved['stations'] + [station[0] for station in added]
+		last_row = radials[-1] if len(radials) else None
+		write_state(doc, state, len(radials), last_row, style.scale, drawn)
+		with stage('saveas') as record:
+			writer.close(pending=True); print("done, %d rows appended" % (len(radials) - rows))
+			record.records = writer.count
+
+	# what the next append starts from, written last so an append that fails leaves the last one's
+	write_state(doc, state, len(radials), last_row, style.scale, drawn, os.path.getsize(spool_fn))
+	if state.labels is not None:
+		with open(labels_fn, 'wb') as labels_file:
+			pickle.dump(state.labels, labels_file)
+	doc.saveas(document_fn)
+
+	return entities
 
 # Main block to execute if the script is run directly
 if __name__ == "__main__":
-	draw_dxf(100,'test.dxf')
\ No newline at end of file
+	draw_dxf(100,'test.dxf')
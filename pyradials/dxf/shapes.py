@@ -1,5 +1,10 @@
 import ezdxf, math
 
+# trees are drawn from a shared block per quantized girth and spread, rather than one block per tree
+GIRTH_STEP:float = 0.01 # metres of circumference
+SPREAD_STEP:float = 0.1 # metres of canopy spread
+SAPLING_SPREAD:float = 1.0 # when a sapling has no spread attribute
+
 def flag(doc):
     flag_block = doc.blocks.new(name='FLAG')
 
@@ -89,6 +94,45 @@ def create_sapling_tree(doc, name, spread):
 
     return block
 
+def quantize(value:float, step:float) -> float:
+    return round(round(value / step) * step, 6)
+
+def tree_block(doc, kind:str, spread:float, girth:float = 0.0) -> str:
+    '''name of the shared block for a TREE, MGTREE or SAPLING, created in doc the first time it's needed
+    the name holds the quantized girth and spread in mm, so a drawing appended to later finds its blocks again'''
+    spread = quantize(spread, SPREAD_STEP)
+    match kind:
+        case 'TREE':
+            girth = quantize(girth, GIRTH_STEP)
+            name = 'TREE_G%d_S%d' % (round(girth * 1000), round(spread * 1000))
+        case 'MGTREE' | 'SAPLING':
+            name = '%s_S%d' % (kind, round(spread * 1000))
+        case _:
+            raise ValueError("unknown tree block %s" % kind)
+
+    if name not in doc.blocks:
+        match kind:
+            case 'TREE': create_tree(doc, name, spread, girth)
+            case 'MGTREE': create_mg_tree(doc, name, spread)
+            case 'SAPLING': create_sapling_tree(doc, name, spread)
+    return name
+
+def tree_block_from_name(doc, name:str) -> str:
+    '''makes the tree block tree_block named name, from the girth and spread held in the name'''
+    kind, *sizes = name.split('_')
+    sizes = {size[0]: int(size[1:]) / 1000 for size in sizes}
+    return tree_block(doc, kind, sizes['S'], sizes.get('G', 0.0))
+
+def is_tree_block(name:str) -> bool:
+    return name.split('_')[0] in ('TREE', 'MGTREE', 'SAPLING')
+
+def sapling_spread(attribs:str) -> float:
+    '''a sapling's spread is its last attribute, when it has one'''
+    try:
+        return float(attribs.split(',')[-1])
+    except (AttributeError, ValueError):
+        return SAPLING_SPREAD
+
 def tree_splitter(attribs:str):
 			values = attribs.split(',')
 
@@ -0,0 +1,100 @@
+'''streams modelspace entities to disk as they're plotted, so a drawing of any size is written in bounded memory
+
+	writer = StreamWriter(doc, 'big.dxf')
+	for chunk in chunks:
+		plot_radials(doc, msp, chunk, style, state, finish=False)
+		writer.flush() # entities written out and dropped, extents kept
+	writer.close() # header, tables and blocks, then the entities
+
+Entities are exported into a spool file beside the output and deleted from the document, only their
+extents and the document's tables and blocks stay in memory. close() sets $EXTMIN, $EXTMAX and the
+modelspace view from the tracked extents, writes everything before the ENTITIES section, copies the
+spool in and finishes with the rest of the document, ezdxf reads the result like any other drawing.
+Text output can be compressed (fmt 'gzip' or 'zip'), binary dxf can't be spliced together and isn't streamed.
+Given a spool file, the spool is kept after close() and opened again carries on from its end, this is how
+append_dxf adds to a drawing without reading it back.'''
+import io, os, shutil, tempfile
+from ezdxf import bbox, zoom
+from ezdxf.lldxf.tagwriter import TagWriter
+from ezdxf.math import BoundingBox
+from dxf.output import open_output
+
+ENTITIES_SECTION:str = '  0\nSECTION\n  2\nENTITIES\n'
+
+class StreamWriter:
+	def __init__(self, doc, filename:str, fmt:str = 'dxf', spool:str = None):
+		if fmt == 'binary':
+			raise ValueError("binary dxf is written whole, it can't be streamed, merged or appended to (--stream, --parallel, --append), use dxf, gzip or zip")
+		self.doc = doc
+		self.filename = str(filename)
+		self.fmt = fmt
+		self.msp = doc.modelspace()
+		self.extents = BoundingBox()
+		self.count:int = 0 # entities written so far
+
+		# the spool sits beside the output, so close() copies on the same disk
+		if spool is None:
+			directory = os.path.dirname(os.path.abspath(self.filename))
+			self.spool = tempfile.TemporaryFile('w+t', dir=directory, encoding=doc.output_encoding, errors='dxfreplace')
+		else:
+			self.spool = open(spool, 'a+t', encoding=doc.output_encoding, errors='dxfreplace')
+		self.tagwriter = TagWriter(self.spool, dxfversion=doc.dxfversion, write_handles=True)
+
+	def flush(self) -> int:
+		'''writes the modelspace entities to the spool and deletes them from the document, returns how many'''
+		count = self.export(self.tagwriter)
+		self.count += count
+		return count
+
+	def export(self, tagwriter:TagWriter) -> int:
+		entities = list(self.msp)
+		self.extents.extend(bbox.extents(entities, fast=True))
+		for entity in entities:
+			entity.export_dxf(tagwriter)
+		self.msp.delete_all_entities() # handles stay used, $HANDSEED is still past every written entity
+		self.doc.entitydb.purge() # a deleted polyline leaves its vertices in the database, dead
+		return len(entities)
+
+	def write(self, entities:str, extents) -> None:
+		'''adds entities already exported as dxf tags elsewhere, and the extents they cover'''
+		self.spool.write(entities)
+		self.extents.extend(extents)
+
+	def close(self, pending:bool = False) -> None:
+		'''writes the finished drawing to filename, once
+		when pending the entities still in modelspace go into filename but not the spool, whatever carries
+		on from the drawing draws them again (append_dxf's open string and setup radials)'''
+		if self.spool.closed:
+			return
+		pending_entities = io.StringIO()
+		if pending:
+			self.count += self.export(TagWriter(pending_entities, dxfversion=self.doc.dxfversion, write_handles=True))
+		else:
+			self.flush()
+		if self.extents.has_data:
+			self.msp.dxf.extmin = self.extents.extmin # doc.write copies these into $EXTMIN and $EXTMAX
+			self.msp.dxf.extmax = self.extents.extmax
+			zoom.window(self.msp, self.extents.extmin, self.extents.extmax)
+
+		# the document now holds an empty modelspace, its own output is small
+		document = io.StringIO()
+		self.doc.write(document)
+		document = document.getvalue()
+		start = document.index(ENTITIES_SECTION) + len(ENTITIES_SECTION)
+
+		with open_output(self.filename, self.fmt, self.doc.output_encoding) as dxf_file:
+			dxf_file.write(document[:start])
+			self.spool.seek(0)
+			shutil.copyfileobj(self.spool, dxf_file)
+			dxf_file.write(pending_entities.getvalue())
+			dxf_file.write(document[start:])
+		self.spool.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		if exc[0] is None:
+			self.close()
+		else:
+			self.spool.close()
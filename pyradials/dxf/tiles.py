@@ -0,0 +1,141 @@
+'''splits a drawing into tiles, a grid of tile_size squares or one per setup, each its own dxf
+
+	draw_dxf(radials, stations, 100, 'survey.dxf', tiles='grid', tile_size=100.0)
+
+writes survey_tiles/E1000_N2000.dxf (named by the tile's south west corner) and so on, and in place
+of the full drawing an index survey.dxf holding the tile boundaries, their names and the control.
+Tiles are drawn in parallel across a process pool. A coded string that crosses a tile boundary keeps
+its crossing segment in both tiles, so linework is unbroken when neighbouring tiles are opened together.'''
+import math, os, pathlib
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from ezdxf import zoom
+from dxf.layers import CodeLibrary, builtin_library
+from dxf.output import output_path, save_document
+from dxf.plot import PlotState, new_document, plot_stations, plot_radials, add_string
+from profiling import stage
+
+TILE_MODES = ('grid', 'setup')
+TILE_LAYER:str = 'tiles'
+TILE_COLOUR:int = 4 # cyan
+
+# runs are the tile's drawing rows split wherever the survey left the tile, edges are (layer, start, end)
+# string segments crossing into it
+Tile = namedtuple("Tile", "name bounds runs edges")
+
+# rows are contiguous in the survey, continues when no line row outside the tile came since the tile's last,
+# so its open string carries on as it would in the single drawing, whatever points shot elsewhere came between
+Run = namedtuple("Run", "rows continues")
+
+def tile_key(row:list, tiles:str, tile_size:float):
+	pid, code, x, y, z, attrib, sx, sy, sz, ih = row
+	if tiles == 'grid':
+		return math.floor(x / tile_size), math.floor(y / tile_size)
+	return sx, sy, sz, ih
+
+def split_tiles(radials, tiles:str = 'grid', tile_size:float = 100.0, codes:CodeLibrary = None) -> list:
+	'''groups the drawing rows into Tiles, in the order each tile is first reached'''
+	if tiles not in TILE_MODES:
+		raise ValueError("unknown tile mode %s" % tiles)
+	codes = codes or builtin_library
+
+	groups:dict = {} # key -> [runs, edges]
+	prev_code, prev_point, prev_key = None, None, None # of the last line row
+	last_key = None
+	for row in radials:
+		key = tile_key(row, tiles, tile_size)
+		runs, edges = groups.setdefault(key, [[], []])
+		if key != last_key:
+			runs.append(Run([], prev_key == key))
+		runs[-1].rows.append(row)
+		last_key = key
+
+		# strings carry on like plot_radials, a segment between two tiles is drawn in both
+		pid, code, x, y, z = row[:5]
+		record = codes[code]
+		if record.type == 'line':
+			if code == prev_code and key != prev_key:
+				edge = (record.layer_name, prev_point, (x, y, z))
+				edges.append(edge)
+				groups[prev_key][1].append(edge)
+			prev_code, prev_point, prev_key = code, (x, y, z), key
+
+	result = []
+	for number, (key, (runs, edges)) in enumerate(groups.items(), 1):
+		if tiles == 'grid':
+			min_e, min_n = key[0] * tile_size, key[1] * tile_size
+			bounds = (min_e, min_n, min_e + tile_size, min_n + tile_size)
+			name = 'E{:g}_N{:g}'.format(min_e, min_n)
+		else:
+			eastings = [row[2] for run in runs for row in run.rows] + [key[0]]
+			northings = [row[3] for run in runs for row in run.rows] + [key[1]]
+			bounds = (min(eastings), min(northings), max(eastings), max(northings))
+			name = 'SETUP%03d' % number
+		result.append(Tile(name, bounds, runs, edges))
+	return result
+
+def within(station:list, bounds:tuple) -> bool:
+	name, x, y, z = station
+	return bounds[0] <= x <= bounds[2] and bounds[1] <= y <= bounds[3]
+
+def draw_tile(tile:Tile, stations:list, scale:int, filename:str, linework:str = 'polyline', radial_mode:str = 'shot', fmt:str = 'dxf', codes:CodeLibrary = None) -> Counter:
+	'''one tile's drawing, the control inside it, its rows and the strings crossing into it'''
+	doc, style = new_document(scale, codes)
+	msp = doc.modelspace()
+
+	plot_stations(msp, [station for station in stations if within(station, tile.bounds)], style)
+	state = PlotState()
+	for run in tile.runs:
+		if not run.continues and state.prev_code is not None: # another string came in between, outside the tile
+			add_string(msp, state.prev_layer, state.string, linework)
+			state.prev_code, state.string = None, []
+		plot_radials(doc, msp, run.rows, style, state, linework, radial_mode, finish=False, codes=codes)
+	plot_radials(doc, msp, [], style, state, linework, radial_mode, codes=codes)
+	for layer_name, start, end in tile.edges:
+		add_string(msp, layer_name, [start, end], linework)
+
+	zoom.extents(msp)
+	save_document(doc, filename, fmt)
+	return Counter(entity.dxftype() for entity in msp)
+
+def draw_index(tiles:list, stations:list, scale:int, filename:str, tile_dir:str, fmt:str = 'dxf') -> None:
+	'''the index drawing, each tile's boundary and file name over the control'''
+	doc, style = new_document(scale)
+	doc.layers.add(name=TILE_LAYER, color=TILE_COLOUR)
+	msp = doc.modelspace()
+
+	plot_stations(msp, stations, style)
+	for tile in tiles:
+		min_e, min_n, max_e, max_n = tile.bounds
+		msp.add_lwpolyline([(min_e, min_n), (max_e, min_n), (max_e, max_n), (min_e, max_n)], close=True, dxfattribs={"layer": TILE_LAYER})
+		msp.add_text(os.path.join(tile_dir, output_path(tile.name + '.dxf', fmt).name), dxfattribs={
+			'height': style.text_height * 4,
+			'insert': (min_e + style.text_height, min_n + style.text_height),
+			"layer": TILE_LAYER
+		})
+
+	zoom.extents(msp)
+	save_document(doc, filename, fmt)
+
+def draw_tiles(radials, stations:list, scale:int, filename:str, tiles:str = 'grid', tile_size:float = 100.0, linework:str = 'polyline', radial_mode:str = 'shot', workers:int = None, fmt:str = 'dxf', codes:CodeLibrary = None) -> Counter:
+	'''draws each tile in a worker process and the index at filename, returns the entities across every tile'''
+	filename = pathlib.Path(filename)
+	tile_dir = filename.with_name(filename.stem + '_tiles')
+	tile_dir.mkdir(exist_ok=True)
+
+	with stage('split_tiles') as record:
+		split = split_tiles(radials, tiles, tile_size, codes)
+		record.records = len(split)
+
+	entities = Counter()
+	with stage('draw_tiles') as record, ProcessPoolExecutor(max_workers=workers) as executor:
+		futures = [executor.submit(draw_tile, tile, stations, scale, tile_dir / (tile.name + '.dxf'), linework, radial_mode, fmt, codes) for tile in split]
+		for future in futures:
+			entities.update(future.result())
+		record.records = sum(entities.values())
+
+	with stage('draw_index'):
+		draw_index(split, stations, scale, filename, tile_dir.name, fmt)
+	print("done, %d tiles in %s" % (len(split), tile_dir))
+
+	return entities
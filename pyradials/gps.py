@@ -1,42 +1,128 @@
-'''loads a .csv file with gps coordinates in a given format'''
-import csv
+'''loads a .csv file with gps coordinates in a given format
 
-# Function to group and average data
-def load_and_average_gps_csv_file(filename):
-    # Dictionary to store data grouped by keys
-    data_dict = {}
+Epochs are read a chunk at a time and folded into a running mean and variance per point
+(Welford, merged a chunk at a time), so memory grows with the number of points not epochs.
+Every epoch is averaged unless a reject_sigma is given (--reject), then further passes over the
+file reject epochs more than reject_sigma standard deviations from their point's mean on any
+axis and average what's left.'''
+from itertools import islice
+import numpy as np
+
+# chunks are read as numpy arrays of this many epochs
+CHUNK_SIZE: int = 100000
+
+# a point's standard deviation is never taken as less than this when rejecting, so near-identical
+# epochs don't turn millimetre noise into outliers
+MIN_SIGMA: float = 0.002
+
+# reject_sigma for --reject given without one
+REJECT_SIGMA: float = 3.0
+
+# a chunk's rows, the point name as it's written and its easting, northing and elevation
+EPOCH_DTYPE = np.dtype([('name', object), ('xyz', np.float64, 3)])
 
-    # Open the CSV file
+class RunningStats:
+    '''count, mean and sum of squared deviations of easting, northing and elevation'''
+    def __init__(self):
+        self.count: int = 0
+        self.mean = np.zeros(3)
+        self.m2 = np.zeros(3)
+        self.rejected: int = 0
+
+    def merge(self, count: int, mean, m2):
+        '''folds in another group's count, mean and m2 (Chan et al's pairwise update)'''
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def std(self):
+        return np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.zeros(3)
+
+def iter_gps_chunks(filename, chunk_size: int = CHUNK_SIZE):
+    '''yields (keys, xyz) chunks, keys are the point names (epoch suffix dropped), xyz an n x 3 array'''
     with open(filename, newline='') as csv_file:
-        # Create a CSV reader object
-        csv_reader = csv.reader(csv_file, delimiter=',')
+        while True:
+            chunk = list(islice(csv_file, chunk_size))
+            if not chunk:
+                return
+            lines = [line for line in chunk if line.strip()]
+            if not lines:
+                continue
 
-        # Iterate through each row in the CSV
-        for row in csv_reader:
-            # Extract the grouping key from the first column
-            key = row[0].split('.')[0]  # Grouping key
+            # loadtxt parses in c, once a chunk, a chunk at a time keeps memory to chunk_size epochs
+            epochs = np.loadtxt(lines, delimiter=',', usecols=(0, 1, 2, 3), dtype=EPOCH_DTYPE, ndmin=1)
+            yield np.char.partition(epochs['name'].astype(str), '.')[:, 0], epochs['xyz']  # Grouping key
 
-            # Check if the key is already in the dictionary
-            if key not in data_dict:
-                data_dict[key] = []  # Initialize list for the group
+def aggregate_chunk(keys, xyz, stats: dict, limits: dict = None):
+    '''adds a chunk to the per point stats, dropping epochs outside limits[point] = (low, high) when given'''
+    names, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
 
-            # Append values of columns 2, 3, and 4 as floats to the group
-            data_dict[key].append([float(row[1]), float(row[2]), float(row[3])])
+    # points go into stats in the order they first appear in the file
+    for position in np.argsort(first):
+        stats.setdefault(str(names[position]), RunningStats())
+    groups = [stats[str(name)] for name in names]
 
-    # List to store the averages for each group
-    averages = []
+    if limits is not None:
+        low = np.array([limits[str(name)][0] for name in names])[inverse]
+        high = np.array([limits[str(name)][1] for name in names])[inverse]
+        keep = ((xyz >= low) & (xyz <= high)).all(axis=1)
+        for position, count in enumerate(np.bincount(inverse[~keep], minlength=len(names))):
+            groups[position].rejected += int(count)
+        xyz, inverse = xyz[keep], inverse[keep]
+
+    counts = np.bincount(inverse, minlength=len(names))
+    sums = np.stack([np.bincount(inverse, xyz[:, axis], len(names)) for axis in range(3)], axis=1)
+    means = sums / np.maximum(counts, 1)[:, None]
+    m2 = np.stack([np.bincount(inverse, (xyz[:, axis] - means[inverse, axis]) ** 2, len(names)) for axis in range(3)], axis=1)
 
-    # Calculate averages for each group
-    for key, values in data_dict.items():
-        # Calculate the average for each column and round to 3 decimal places
-        avg = [round(sum(col) / len(values), 3) for col in zip(*values)]
-        # Append the key and averages to the result list
-        averages.append([key] + avg)
+    for position in np.flatnonzero(counts):
+        groups[position].merge(int(counts[position]), means[position], m2[position])
+
+def aggregate_gps_csv_file(filename, reject_sigma: float = None, chunk_size: int = CHUNK_SIZE, passes: int = 3) -> dict:
+    '''point name -> RunningStats, rejecting outliers when reject_sigma is given
+
+    each pass re-reads the file against the previous pass's mean and standard deviation, stopping
+    once a pass rejects nothing new, an outlier inflates the first pass's spread so can take two'''
+    stats = {}
+    for keys, xyz in iter_gps_chunks(filename, chunk_size):
+        aggregate_chunk(keys, xyz, stats)
+
+    if reject_sigma is None:
+        return stats
+
+    unrejected = stats
+    for _ in range(passes - 1):
+        limits = {}
+        for key, point in stats.items():
+            spread = reject_sigma * np.maximum(point.std(), MIN_SIGMA)
+            limits[key] = (point.mean - spread, point.mean + spread)
+
+        kept = {}
+        for keys, xyz in iter_gps_chunks(filename, chunk_size):
+            aggregate_chunk(keys, xyz, kept, limits)
+
+        # a point with every epoch rejected (e.g. two equal clusters) keeps its unrejected average
+        kept = {key: point if point.count else unrejected[key] for key, point in kept.items()}
+        settled = all(kept[key].rejected == stats[key].rejected for key in kept)
+        stats = kept
+        if settled:
+            break
+
+    return stats
+
+# Function to group and average data
+def load_and_average_gps_csv_file(filename, reject_sigma: float = None, chunk_size: int = CHUNK_SIZE, passes: int = 3):
+    '''[name, easting, northing, elevation, sd easting, sd northing, sd elevation, epochs, rejected] per point'''
+    averages = []
+    for key, point in aggregate_gps_csv_file(filename, reject_sigma, chunk_size, passes).items():
+        averages.append([key] + [round(float(value), 3) for value in point.mean] + [round(float(value), 4) for value in point.std()] + [point.count, point.rejected])
 
     return averages
 
 # Main block to execute if the script is run directly
 if __name__ == "__main__":
     filename = 'data/SROAD.csv'  # Replace 'data.csv' with your file name
-    result = load_and_average_gps_csv_file(filename)
+    result = load_and_average_gps_csv_file(filename, REJECT_SIGMA)
     print(result)
@@ -1,6 +1,8 @@
 '''opens instrument file and parses them into a tidy list of setups and measurements'''
 import pathlib
 from leica import gsi
+from leica_numpy import gsi_to_store
+from store import ObservationStore
 from gps import load_and_average_gps_csv_file
 
 def filename_details(fn: str):
@@ -10,8 +12,9 @@ def filename_details(fn: str):
 
 	return stem, suffix
 
-def instrument_file_as_source(full_fn:str, debug_json_output:bool = False):
-	'''with a given fn, check compatibility/support and load the file into memory'''
+def instrument_file_as_source(full_fn:str, debug_json_output:bool = False, reject_sigma:float = None):
+	'''with a given fn, check compatibility/support and load the file into memory
+	gps epochs more than reject_sigma standard deviations from their point's mean are rejected when it's given'''
 
 	stem, suffix = filename_details(full_fn)
 
@@ -22,20 +25,23 @@ def instrument_file_as_source(full_fn:str, debug_json_output:bool = False):
 				first_line = leica_gsi.readline().strip('\n')
 
 			# * in first position equals 16-bit
-			if first_line[0] == '*':
-				gsi_bit_depth = 16
-				data = gsi(full_fn, gsi_bit_depth, debug_json_output)
-				source = {
-					'file_name': stem + suffix,
-					'format': 'Leica Geosystems 16-bit GSI (Geo Serial Interface)',
-					'capture_date_time': data[0]['date_time'],
-					'type': 'total_station',
-					'data': data,
-				}
+			gsi_bit_depth = 16 if first_line[0] == '*' else 8
 
+			# decode the whole file into the columnar store with numpy, the debug json needs the full list
+			if debug_json_output:
+				store = ObservationStore.from_setups(gsi(full_fn, gsi_bit_depth, debug_json_output))
 			else:
-				gsi_bit_depth = 8
-				raise Exception('8-bit Leica .GSI Not Supported')
+				store = gsi_to_store(full_fn, gsi_bit_depth)
+
+			data = store.setups()
+			source = {
+				'file_name': stem + suffix,
+				'format': 'Leica Geosystems %d-bit GSI (Geo Serial Interface)' % gsi_bit_depth,
+				'capture_date_time': data[0]['date_time'],
+				'type': 'total_station',
+				'data': data,
+				'store': store,
+			}
 
 		case ".r25":  # Carlson RW5
 			raise Exception('Carlson RW5 Not Supported')
@@ -47,7 +53,7 @@ def instrument_file_as_source(full_fn:str, debug_json_output:bool = False):
 			raise Exception('Trimble ARE Not Supported')
 
 		case ".csv": # GPS Survey Data
-			data = load_and_average_gps_csv_file(full_fn)
+			data = load_and_average_gps_csv_file(full_fn, reject_sigma)
 			source = {
 				'file_name': stem + suffix,
 				'format': 'RTK/GNSS Position Data: CSV Format',
@@ -2,6 +2,7 @@ import logging, json
 from collections import namedtuple
 from textwrap import wrap
 from calc import mm_to_m, dms_to_decimal
+from profiling import stage
 
 '''
 General
@@ -77,12 +78,59 @@ def derive_date_time(w18:str, w19:str) -> str:
 
 		return (str(year) + "-" + str(month) + "-" + str(day) + " " + str(hour) + ":" + str(min) + ":" + str(sec))
 
-def gsi_to_blocks_list(fn:str, bit_depth:int = 16, debug_json_output = False) -> list:
-	'''takes a gsi filename and returns a list of tuples with the setups, codes, and measurements'''
+# word unit (6th character of a word) -> (divisor, factor) to reach metres, mm ('0') is the default
+distance_units:dict = {
+	'1': (1000, 0.3048), # 1/1000 ft
+	'6': (10000, 1.0), # 1/10 mm
+	'7': (10000, 0.3048), # 1/10000 ft
+	'8': (100000, 1.0), # 1/100 mm
+}
+
+# word unit -> (divisor, factor) to reach decimal degrees, anything else is read as DMS
+angle_units:dict = {
+	'2': (100000, 0.9), # 400 gon
+	'3': (100000, 1.0), # 360 decimal degrees
+	'5': (10000, 360 / 6400), # 6400 mil
+}
+
+ANGLE_WORDS = (21, 22)
+DISTANCE_WORDS = (31, 81, 82, 83, 84, 85, 86, 87, 88)
+
+def word_unit(index:int, unit:str) -> str:
+	'''the unit of an angle or distance word when it isn't the default (DMS or mm), otherwise None'''
+	if index in ANGLE_WORDS and unit in angle_units:
+		return unit
+	if index in DISTANCE_WORDS and unit in distance_units:
+		return unit
+	return None
+
+def angle_to_decimal(value, unit:str = None) -> float:
+	'''decimal degrees of an angle word's value, DMS unless unit is one of angle_units'''
+	if unit in angle_units:
+		divisor, factor = angle_units[unit]
+		return value / divisor * factor
+	sign = -1 if isinstance(value, int) and value < 0 else 1
+	return sign * dms_to_decimal(str(abs(value) if sign < 0 else value))
+
+def distance_to_m(value, unit:str = None) -> float:
+	'''metres of a distance word's value, mm unless unit is one of distance_units'''
+	if unit in distance_units and value is not None:
+		divisor, factor = distance_units[unit]
+		return value / divisor * factor
+	return mm_to_m(value)
+
+# Named Tuples, units holds {word index: unit} for the angle and distance words that aren't DMS or mm, None when all are
+Setup = namedtuple("Setup","type station w84 w85 w86 w88 w79 units raw")
+Code = namedtuple("Code","type code w42 w43 w44 w45 w46 w47 w48 w49 raw")
+Measurement = namedtuple("Measurement","type point_id w21 w22 w31 w87 w81 w82 w83 date_time units raw")
+Coded_Measurement = namedtuple("Coded_Measurement", "point_id code attrib hz vt sd ea no el th")
+
+def gsi_word_size(bit_depth:int = 16) -> tuple:
+	'''returns the word size and whether to trim the * prefix for a given gsi bit-depth'''
 	# Set word_size based on bit_depth
 	match bit_depth:
 		case 8:
-			word_size:int = 12
+			word_size:int = 16
 			trim_16bit_prefix = False
 			logging.debug('word size:%d, trim * prefix: %r' % (word_size, trim_16bit_prefix))
 
@@ -94,71 +142,86 @@ def gsi_to_blocks_list(fn:str, bit_depth:int = 16, debug_json_output = False) ->
 		case _:
 			raise Exception('Unknown File Type: Leica .GSI Incorrect Bit-depth')
 
-	# Open and read the file
+	return word_size, trim_16bit_prefix
+
+def gsi_row_to_block(row:str, word_size:int = 24, trim_16bit_prefix:bool = True):
+	'''takes a single stripped gsi row and returns it as a setup, code or measurement tuple'''
+	words = wrap(row, word_size)
+
+	if trim_16bit_prefix:
+		words[0] = words[0][1:]
+
+	intermediate_dict = {}
+	units = {}
+
+	for word in words:
+		value = strip_leading_zeros(word[7:])
+		if word[6:7] == '-' and isinstance(value, int): # sign is the 7th character of the word
+			value = -value
+		intermediate_dict[word[:2]] = value
+		if word[:2].isdigit() and word_unit(int(word[:2]), word[5:6]): # unit is the 6th character
+			units[int(word[:2])] = word[5:6]
+
+	if intermediate_dict.get('84') is not None:
+		logging.debug("this block is a setup")
+		return Setup("setup",
+			intermediate_dict.get('11'),
+			intermediate_dict.get('84'),
+			intermediate_dict.get('85'),
+			intermediate_dict.get('86'),
+			intermediate_dict.get('88'),
+			intermediate_dict.get('79'),
+			units or None,
+			words,
+		)
+
+	elif intermediate_dict.get('41') is not None:
+		logging.debug("this block is a code")
+		return Code("code",
+			intermediate_dict.get('41'),
+			intermediate_dict.get('42'),
+			intermediate_dict.get('43'),
+			intermediate_dict.get('44'),
+			intermediate_dict.get('45'),
+			intermediate_dict.get('46'),
+			intermediate_dict.get('47'),
+			intermediate_dict.get('48'),
+			intermediate_dict.get('49'),
+			words,
+		)
+
+	else:
+		logging.debug("this block is a measurement")
+		return Measurement("measurement",
+			intermediate_dict.get('11'),
+			intermediate_dict.get('21'),
+			intermediate_dict.get('22'),
+			intermediate_dict.get('31'),
+			intermediate_dict.get('87'),
+			intermediate_dict.get('81'),
+			intermediate_dict.get('82'),
+			intermediate_dict.get('83'),
+			derive_date_time(intermediate_dict.get('18'),intermediate_dict.get('19')),
+			units or None,
+			words,
+		)
+
+def iter_gsi_blocks(fn:str, bit_depth:int = 16):
+	'''takes a gsi filename and yields the setups, codes, and measurements one line at a time'''
+	word_size, trim_16bit_prefix = gsi_word_size(bit_depth)
+
+	# Open the file and read it lazily, a line is only held while it is being parsed
 	with open(fn, 'r') as gsi_file:
-		gsi_file_reader = [text.rstrip() for text in gsi_file.readlines()]
-
-	list_of_blocks = []
-	# Named Tuples
-	Setup = namedtuple("Setup","type station w84 w85 w86 w88 w79 raw")
-	Code = namedtuple("Code","type code w42 w43 w44 w45 w46 w47 w48 w49 raw")
-	Measurement = namedtuple("Measurement","type point_id w21 w22 w31 w87 w81 w82 w83 date_time raw")
-
-	for row in gsi_file_reader:
-		words = wrap(row, word_size)
-
-		if trim_16bit_prefix:
-			words[0] = words[0][1:]
-
-		intermediate_dict = {}
-
-		for word in words:
-			intermediate_dict[word[:2]] = strip_leading_zeros(word[7:])
-
-		if intermediate_dict.get('84') is not None:
-			logging.debug("this block is a setup")
-			setup = Setup("setup",
-				intermediate_dict.get('11'),
-				intermediate_dict.get('84'),
-				intermediate_dict.get('85'),
-				intermediate_dict.get('86'),
-				intermediate_dict.get('88'),
-				intermediate_dict.get('79'),
-				words,
-			)
-			list_of_blocks.append(setup)
-
-		elif intermediate_dict.get('41') is not None:
-			logging.debug("this block is a code")
-			code = Code("code",
-				intermediate_dict.get('41'),
-				intermediate_dict.get('42'),
-				intermediate_dict.get('43'),
-				intermediate_dict.get('44'),
-				intermediate_dict.get('45'),
-				intermediate_dict.get('46'),
-				intermediate_dict.get('47'),
-				intermediate_dict.get('48'),
-				intermediate_dict.get('49'),
-				words,
-			)
-			list_of_blocks.append(code)
-
-		else:
-			logging.debug("this block is a measurement")
-			measurement = Measurement("measurement",
-				intermediate_dict.get('11'),
-				intermediate_dict.get('21'),
-				intermediate_dict.get('22'),
-				intermediate_dict.get('31'),
-				intermediate_dict.get('87'),
-				intermediate_dict.get('81'),
-				intermediate_dict.get('82'),
-				intermediate_dict.get('83'),
-				derive_date_time(intermediate_dict.get('18'),intermediate_dict.get('19')),
-				words,
-			)
-			list_of_blocks.append(measurement)
+		for text in gsi_file:
+			row = text.rstrip()
+			if row: # skip blank lines, typically a trailing newline
+				yield gsi_row_to_block(row, word_size, trim_16bit_prefix)
+
+def gsi_to_blocks_list(fn:str, bit_depth:int = 16, debug_json_output = False) -> list:
+	'''takes a gsi filename and returns a list of tuples with the setups, codes, and measurements'''
+	with stage('gsi_to_blocks_list') as record:
+		list_of_blocks = list(iter_gsi_blocks(fn, bit_depth))
+		record.records = len(list_of_blocks)
 
 	if debug_json_output:
 		with open('debug/processed_gsi.json', "w") as write_file:
@@ -166,80 +229,130 @@ def gsi_to_blocks_list(fn:str, bit_depth:int = 16, debug_json_output = False) ->
 
 	return list_of_blocks
 
-def check_integrity_of_setup(setup_block,ro_code_block,ro_measurement) -> None:
+def check_integrity_of_setup(setup_block,ro_code_block = None,ro_measurement = None) -> None:
+	'''raises unless a setup is followed by its RO code and measurement, None for blocks that never came'''
 
 	logging.debug(setup_block)
 
 	if setup_block.type != "setup":
 		raise Exception('gsi does not start with a setup' + str(setup_block))
-	if ro_code_block.type != "code":
+	if ro_code_block is None or ro_code_block.type != "code":
 		raise Exception('gsi does not follow setup with a RO' + str(setup_block))
 	if ro_code_block.code != "RO":
 		raise Exception('code is not RO following setup' + str(setup_block))
-	if ro_measurement.type != "measurement":
+	if ro_measurement is None or ro_measurement.type != "measurement":
 		raise Exception('ro is missing the measurement' + str(setup_block))
 
 def combine_strings(*args):
 	filtered_args = [str(arg) for arg in args if arg not in (None, '', '0', 0, '.', '>')]
 	return ', '.join(filtered_args)
 
-def reduce_and_code_measurements(gsi_blocks:list , debug_json_output:bool = False) -> dict:
+def iter_coded_measurements(gsi_blocks):
+	'''takes an iterable of gsi blocks and yields (setup, coded_measurement) as soon as each measurement is read
 
-	check_integrity_of_setup(gsi_blocks[0],gsi_blocks[1],gsi_blocks[2])
-	setups_with_coded_measurements = []
-	Coded_Measurement = namedtuple("Coded_Measurement", "point_id code attrib hz vt sd ea no el th")
+	setup is the dict of the setup being filled, its coded_measurements grow as the stream is read
+	and the recent code and attributes carry over between reads, so the blocks can come from a live source'''
+	setup:dict = None
+	pending_check:list = [] # the setup, RO code and RO measurement waiting on an integrity check
 
 	recent_code:str = None
 	recent_attrib:str = None
 
-	for i, block in enumerate(gsi_blocks, start=0):
+	for block in gsi_blocks:
+		if setup is None and block.type != "setup":
+			raise Exception('gsi does not start with a setup' + str(block))
+
+		# a setup can only be checked once its RO code and measurement have been read, or the next setup has
+		if pending_check:
+			pending_check.append(block)
+			if len(pending_check) == 3 or block.type == "setup":
+				check_integrity_of_setup(*pending_check)
+				pending_check = []
+
 		match block.type:
 			case "setup":
-				check_integrity_of_setup(gsi_blocks[i],gsi_blocks[i+1],gsi_blocks[i+2])
-				setups_with_coded_measurements.append(dict())
-				setups_with_coded_measurements[-1]['station'] = block.station
-				setups_with_coded_measurements[-1]['easting'] = mm_to_m(block.w84)
-				setups_with_coded_measurements[-1]['northing'] = mm_to_m(block.w85)
-				setups_with_coded_measurements[-1]['elevation'] = mm_to_m(block.w86)
-				setups_with_coded_measurements[-1]['height'] = mm_to_m(block.w88)
-				setups_with_coded_measurements[-1]['backsight'] = block.w79
-				setups_with_coded_measurements[-1]['date_time'] = None
-				setups_with_coded_measurements[-1]['coded_measurements'] = []
+				pending_check = [block]
+				units = block.units or {}
+				setup = {
+					'station': block.station,
+					'easting': distance_to_m(block.w84, units.get(84)),
+					'northing': distance_to_m(block.w85, units.get(85)),
+					'elevation': distance_to_m(block.w86, units.get(86)),
+					'height': distance_to_m(block.w88, units.get(88)),
+					'backsight': block.w79,
+					'date_time': None,
+					'coded_measurements': [],
+				}
 
 			case "code":
 				recent_code = block.code
 				recent_attrib = combine_strings(block.w42,block.w43,block.w44,block.w45,block.w46,block.w47,block.w48,block.w49)
 
 			case "measurement":
+				units = block.units or {}
 				coded_measurement = Coded_Measurement(
 					block.point_id,
 					recent_code,
 					recent_attrib,
-					dms_to_decimal(str(block.w21)),
-					dms_to_decimal(str(block.w22)),
-					mm_to_m(block.w31),
-					mm_to_m(block.w81),
-					mm_to_m(block.w82),
-					mm_to_m(block.w83),
-					mm_to_m(block.w87)
+					angle_to_decimal(block.w21, units.get(21)),
+					angle_to_decimal(block.w22, units.get(22)),
+					distance_to_m(block.w31, units.get(31)),
+					distance_to_m(block.w81, units.get(81)),
+					distance_to_m(block.w82, units.get(82)),
+					distance_to_m(block.w83, units.get(83)),
+					distance_to_m(block.w87, units.get(87))
 				)
 
 				if block.date_time is not None:
-					setups_with_coded_measurements[-1]['date_time'] = block.date_time
+					setup['date_time'] = block.date_time
 
-				setups_with_coded_measurements[-1]['coded_measurements'].append(coded_measurement)
+				setup['coded_measurements'].append(coded_measurement)
+				yield setup, coded_measurement
 
 			case _: raise Exception('block isn\'t a code, measurement or setup')
 
+	if pending_check: # the stream ended before the last setup's RO
+		check_integrity_of_setup(*pending_check)
+
+def iter_reduced_setups(gsi_blocks):
+	'''takes an iterable of gsi blocks and yields one completed setup (with its coded measurements) at a time'''
+	current:dict = None
+
+	for setup, coded_measurement in iter_coded_measurements(gsi_blocks):
+		# the previous setup is complete once the next one starts, every setup has at least its RO
+		if setup is not current:
+			if current is not None:
+				yield current
+			current = setup
+
+	if current is not None:
+		yield current
+
+def reduce_and_code_measurements(gsi_blocks:list , debug_json_output:bool = False) -> list:
+	with stage('reduce_and_code_measurements') as record:
+		setups_with_coded_measurements = list(iter_reduced_setups(gsi_blocks))
+		if record.live:
+			record.records = sum(len(setup['coded_measurements']) for setup in setups_with_coded_measurements)
+
 	if debug_json_output:
 		with open('debug/reduce_measurements.json', "w") as write_file:
 			write_file.write(json.dumps(setups_with_coded_measurements) + "\n")
 
 	return setups_with_coded_measurements
 
+def iter_gsi(fn:str, bit_depth:int = 16):
+	'''streams a gsi file, yielding one reduced setup at a time, memory stays flat regardless of file size'''
+	return iter_reduced_setups(iter_gsi_blocks(fn, bit_depth))
+
 def gsi(fn:str, bit_depth:int, debug_json_output:bool = False) -> list:
-	gsi_blocks = gsi_to_blocks_list(fn,bit_depth,debug_json_output)
-	data = reduce_and_code_measurements(gsi_blocks,True)
+	if debug_json_output: # the debug json needs the full list of blocks held in memory
+		gsi_blocks = gsi_to_blocks_list(fn,bit_depth,debug_json_output)
+		return reduce_and_code_measurements(gsi_blocks,debug_json_output)
+
+	with stage('iter_gsi') as record:
+		data = list(iter_gsi(fn, bit_depth))
+		if record.live:
+			record.records = sum(len(setup['coded_measurements']) for setup in data)
 
 	return data
 
@@ -0,0 +1,130 @@
+'''memory-mapped leica .gsi reader, words are sliced at fixed offsets instead of being wrapped as text
+
+A GSI word is always the same width, so rather than splitting each row with textwrap we walk
+the mapped file and read the two byte word index at every word boundary. Only the value bytes
+of the words a block actually needs are copied out and decoded.
+
+	16-bit: *WWIIIIS0000000000000000 (24 bytes per word, leading * on each row)
+	8-bit:  WWIIIIS00000000 (16 bytes per word)
+
+	WW = word index, IIII = information (units etc.), S = sign, 0 = value'''
+import mmap, os, sys
+from leica import Setup, Code, Measurement, derive_date_time, iter_reduced_setups, word_unit, ANGLE_WORDS, DISTANCE_WORDS
+
+# bit-depth: (word stride, value length, row prefix length)
+word_layout:dict = {
+	8: (16, 8, 0),
+	16: (24, 16, 1),
+}
+
+WHITESPACE = b' \t\r'
+ZERO:int = ord('0')
+NINE:int = ord('9')
+MINUS:int = ord('-')
+VALUE_OFFSET:int = 7 # WWIIIIS
+
+# word indices used by the setup, code and measurement blocks
+SETUP_WORDS = (11, 84, 85, 86, 88, 79)
+CODE_WORDS = (41, 42, 43, 44, 45, 46, 47, 48, 49)
+MEASUREMENT_WORDS = (11, 21, 22, 31, 87, 81, 82, 83)
+UNIT_WORDS = frozenset(ANGLE_WORDS + DISTANCE_WORDS)
+UNIT_OFFSET:int = 5 # WWIII, the unit is the last information character
+
+def decode_value(value:bytes):
+	'''bytes equivalent of leica.strip_leading_zeros, digits become an int, anything else a str'''
+	stripped = value.lstrip(b'0')
+	if not stripped:
+		return 0
+	if stripped.isdigit():
+		return int(stripped)
+	return stripped.decode('ascii')
+
+def iter_gsi_rows_mmap(gsi_map, prefix:int = 1):
+	'''yields (start, end) byte offsets of each non-blank row, trailing whitespace trimmed'''
+	size = len(gsi_map)
+	start = 0
+	while start < size:
+		end = gsi_map.find(b'\n', start)
+		if end == -1:
+			end = size
+		next_start = end + 1
+
+		while end > start and gsi_map[end - 1] in WHITESPACE:
+			end -= 1
+
+		if end - start > prefix:
+			yield start, end
+
+		start = next_start
+
+def iter_gsi_blocks_mmap(fn:str, bit_depth:int = 16, keep_raw:bool = False):
+	'''memory-maps a gsi file and yields the same Setup, Code and Measurement tuples as leica.iter_gsi_blocks
+
+	raw holds the row bytes when keep_raw is set, otherwise None, a word index that isn't two digits raises ValueError'''
+	try:
+		stride, value_length, prefix = word_layout[bit_depth]
+	except KeyError:
+		raise Exception('Unknown File Type: Leica .GSI Incorrect Bit-depth')
+
+	if os.path.getsize(fn) == 0:
+		return
+
+	# word index -> offset of that word's value in the current row, 0 means not present
+	offsets = [0] * 100
+
+	with open(fn, 'rb') as gsi_file, mmap.mmap(gsi_file.fileno(), 0, access=mmap.ACCESS_READ) as gsi_map:
+
+		def value(index:int, end:int):
+			offset = offsets[index]
+			if offset == 0:
+				return None
+			decoded = decode_value(gsi_map[offset:min(offset + value_length, end)])
+			if gsi_map[offset - 1] == MINUS and type(decoded) is int:
+				decoded = -decoded
+			return decoded
+
+		for start, end in iter_gsi_rows_mmap(gsi_map, prefix):
+			seen = []
+			units = None
+			for word in range(start + prefix, end - 1, stride):
+				tens, ones = gsi_map[word], gsi_map[word + 1]
+				if not (ZERO <= tens <= NINE and ZERO <= ones <= NINE): # a malformed row, or the wrong bit-depth
+					raise ValueError("%s: word index %r at byte %d isn't two digits" % (fn, gsi_map[word:word + 2].decode('ascii', 'replace'), word))
+				index = (tens - ZERO) * 10 + ones - ZERO
+				offsets[index] = word + VALUE_OFFSET
+				seen.append(index)
+				if index in UNIT_WORDS and word_unit(index, chr(gsi_map[word + UNIT_OFFSET])):
+					units = units or {}
+					units[index] = chr(gsi_map[word + UNIT_OFFSET])
+
+			raw = gsi_map[start:end] if keep_raw else None
+
+			if offsets[84]:
+				block = Setup("setup", *[value(index, end) for index in SETUP_WORDS], units, raw)
+			elif offsets[41]:
+				block = Code("code", *[value(index, end) for index in CODE_WORDS], raw)
+			else:
+				block = Measurement("measurement",
+					*[value(index, end) for index in MEASUREMENT_WORDS],
+					derive_date_time(value(18, end), value(19, end)),
+					units,
+					raw,
+				)
+
+			# reset only the slots this row touched
+			for index in seen:
+				offsets[index] = 0
+
+			yield block
+
+def iter_gsi_mmap(fn:str, bit_depth:int = 16):
+	'''drop-in for leica.iter_gsi, yields one reduced setup at a time using the mmap reader'''
+	return iter_reduced_setups(iter_gsi_blocks_mmap(fn, bit_depth))
+
+# Main block to execute if the script is run directly, prints the blocks of each given file
+if __name__ == "__main__":
+	for fn in sys.argv[1:] or ['data/SOUTHPOR.GSI']:
+		with open(fn, 'rb') as gsi_file:
+			bit_depth = 16 if gsi_file.read(1) == b'*' else 8 # * in first position equals 16-bit
+		for block in iter_gsi_blocks_mmap(fn, bit_depth):
+			print(block)
@@ -0,0 +1,292 @@
+'''vectorised leica .gsi decoder for 8-bit and 16-bit files
+
+Every row is loaded into one fixed-width numpy byte grid. A word sits at a fixed offset, so each
+word slot is a column of the grid and each word index (11, 21, 22, 31, 84...) can be pulled out
+for every row at once. Signs, units and DMS angles are converted to floats in bulk and the result
+is returned as a store.ObservationStore, python only touches the distinct text values.'''
+import math, sys
+from collections import namedtuple
+import numpy as np
+from leica import combine_strings, derive_date_time, iter_gsi, distance_units, angle_units
+from calc import dms_to_decimal_array
+from leica_mmap import word_layout, decode_value
+from store import ObservationStore
+from profiling import stage
+
+SPACE:int = ord(' ')
+ZERO:int = ord('0')
+MINUS:int = ord('-')
+STAR:int = ord('*')
+POWERS = 10 ** np.arange(15, -1, -1, dtype=np.int64)
+
+# a single word index for the rows it appears in
+Word = namedtuple("Word", "rows values units signs")
+
+def unit_table(units:dict, default:tuple) -> tuple:
+	'''expands a unit dict into two 256 long lookup arrays indexed by the unit byte'''
+	divisors = np.full(256, default[0], dtype=np.float64)
+	factors = np.full(256, default[1], dtype=np.float64)
+	for character, (divisor, factor) in units.items():
+		divisors[ord(character)] = divisor
+		factors[ord(character)] = factor
+	return divisors, factors
+
+# the unit tables are leica.py's, so every reader reads a word the same way
+DISTANCE_DIVISORS, DISTANCE_FACTORS = unit_table(distance_units, (1000, 1.0))
+ANGLE_DIVISORS, ANGLE_FACTORS = unit_table(angle_units, (0, 1.0)) # 0 marks DMS
+
+def load_gsi_grid(fn:str):
+	'''reads a gsi file into a (rows, width) uint8 array padded with spaces, blank rows dropped'''
+	with open(fn, 'rb') as gsi_file:
+		buffer = np.frombuffer(gsi_file.read(), dtype=np.uint8)
+
+	ends = np.flatnonzero(buffer == ord('\n'))
+	if len(buffer) and buffer[-1] != ord('\n'):
+		ends = np.append(ends, len(buffer))
+	starts = np.concatenate(([0], ends[:-1] + 1)).astype(np.int64)
+	lengths = ends - starts
+
+	width = int(lengths.max()) if len(lengths) else 0
+	grid = np.full((len(starts), width), SPACE, dtype=np.uint8)
+	for column in range(width):
+		rows = lengths > column
+		grid[rows, column] = buffer[starts[rows] + column]
+
+	grid[(grid == ord('\r')) | (grid == ord('\t'))] = SPACE
+	return grid[(grid != SPACE).any(axis=1)]
+
+def split_words(grid, bit_depth:int) -> dict:
+	'''returns {word index: Word} with the value bytes, unit and sign of every row holding that word'''
+	stride, value_length, prefix = word_layout[bit_depth]
+	rows, width = grid.shape
+	slots = max(0, -(-(width - prefix) // stride))
+
+	# pad so the last (right stripped) word of the longest row is a full word
+	padded_width = prefix + slots * stride
+	if padded_width > width:
+		grid = np.pad(grid, ((0, 0), (0, padded_width - width)), constant_values=SPACE)
+
+	offsets = prefix + np.arange(slots) * stride
+	tens = grid[:, offsets].astype(np.int16) - ZERO
+	units = grid[:, offsets + 1].astype(np.int16) - ZERO
+	valid = (tens >= 0) & (tens <= 9) & (units >= 0) & (units <= 9)
+	indices = np.where(valid, tens * 10 + units, -1)
+
+	words = {}
+	for index in np.unique(indices[valid]):
+		matches = indices == index
+		present = np.flatnonzero(matches.any(axis=1))
+		# when a word repeats in a row the last one wins, as with leica.gsi_row_to_block
+		slot = slots - 1 - np.argmax(matches[present, ::-1], axis=1)
+		start = offsets[slot]
+		values = grid[present[:, None], start[:, None] + 7 + np.arange(value_length)]
+		words[int(index)] = Word(present, values, grid[present, start + 5], grid[present, start + 6])
+
+	return words
+
+def word_integers(word:Word) -> tuple:
+	'''signed integer value of each row and a mask of which rows were purely digits'''
+	digits = word.values.astype(np.int64) - ZERO
+	numeric = ((digits >= 0) & (digits <= 9)).all(axis=1)
+	integers = (np.where(numeric[:, None], digits, 0) * POWERS[-digits.shape[1]:]).sum(axis=1)
+	return np.where(word.signs == MINUS, -integers, integers), numeric
+
+def column(words:dict, index:int, rows:int, convert) -> np.ndarray:
+	'''a float column over all rows, nan where the word is missing'''
+	result = np.full(rows, np.nan)
+	word = words.get(index)
+	if word is not None:
+		integers, numeric = word_integers(word)
+		result[word.rows] = np.where(numeric, convert(integers, word.units), np.nan)
+	return result
+
+def distances_to_m(integers, units):
+	return integers / DISTANCE_DIVISORS[units] * DISTANCE_FACTORS[units]
+
+def angles_to_decimal(integers, units):
+	'''decimal degrees, DMS follows calc.dms_to_decimal and drops the final (tenths) digit'''
+	divisors = ANGLE_DIVISORS[units]
+	decimal = integers / np.where(divisors == 0, 1, divisors) * ANGLE_FACTORS[units]
+
+	sexagesimal = dms_to_decimal_array(integers) # keeps the sign
+
+	return np.where(divisors == 0, sexagesimal, decimal)
+
+def word_text(words:dict, index:int, rows:np.ndarray, value_length:int) -> list:
+	'''decodes a word to int/str (as leica.strip_leading_zeros) for the given rows, None if missing'''
+	return [decode_row_value(raw.tobytes(), value_length) for raw in row_values(words, (index,), rows, value_length)]
+
+def unique_rows(values) -> tuple:
+	'''np.unique over whole byte rows, returns (unique rows, inverse)'''
+	values = np.ascontiguousarray(values)
+	keys = values.view(np.dtype((np.void, values.shape[1]))).ravel()
+	unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+	return values[first], inverse.ravel()
+
+def row_values(words:dict, indices:tuple, rows:np.ndarray, value_length:int):
+	'''(rows, len(indices) * (value_length + 1)) bytes of sign + value for each word, spaces when missing'''
+	block = np.full((len(rows), len(indices), value_length + 1), SPACE, dtype=np.uint8)
+	lookup = np.full(max(int(rows.max()) + 1 if len(rows) else 0, 1), -1)
+	lookup[rows] = np.arange(len(rows))
+	for i, index in enumerate(indices):
+		word = words.get(index)
+		if word is None:
+			continue
+		inside = word.rows < len(lookup)
+		at = lookup[word.rows[inside]]
+		keep = at >= 0
+		block[at[keep], i, 0] = word.signs[inside][keep]
+		block[at[keep], i, 1:] = word.values[inside][keep]
+	return block.reshape(len(rows), len(indices) * (value_length + 1))
+
+def decode_row_value(raw:bytes, value_length:int):
+	'''sign + value bytes back to a leica.strip_leading_zeros style value, None if blank'''
+	if raw[:1] == b' ':
+		return None
+	decoded = decode_value(raw[1:value_length + 1])
+	return -decoded if raw[:1] == b'-' and type(decoded) is int else decoded
+
+def gsi_to_store(fn:str, bit_depth:int = None) -> ObservationStore:
+	'''decodes a whole gsi file with numpy and returns the reduced setups as an ObservationStore'''
+	with stage('gsi_to_store') as record:
+		store = decode_gsi(fn, bit_depth)
+		record.records = len(store)
+	return store
+
+def decode_gsi(fn:str, bit_depth:int = None) -> ObservationStore:
+	'''gsi_to_store without the profiling stage'''
+	grid = load_gsi_grid(fn)
+	store = ObservationStore()
+	if grid.shape[0] == 0:
+		return store
+
+	if bit_depth is None:
+		bit_depth = 16 if grid[0, 0] == STAR else 8 # * in first position equals 16-bit
+	if bit_depth not in word_layout:
+		raise Exception('Unknown File Type: Leica .GSI Incorrect Bit-depth')
+	value_length = word_layout[bit_depth][1]
+
+	words = split_words(grid, bit_depth)
+	rows = grid.shape[0]
+	everything = np.arange(rows)
+
+	def present(index:int):
+		mask = np.zeros(rows, dtype=bool)
+		if index in words:
+			mask[words[index].rows] = True
+		return mask
+
+	is_setup = present(84)
+	is_code = present(41) & ~is_setup
+	is_measurement = ~(is_setup | is_code)
+
+	# block codes, decoded once per distinct value
+	code_rows = np.flatnonzero(is_code)
+	code_bytes, code_inverse = unique_rows(row_values(words, (41,), code_rows, value_length))
+	code_ids = np.array([store.codes.intern(decode_row_value(raw.tobytes(), value_length)) for raw in code_bytes], dtype=np.int64)
+	code_of_row = np.full(rows, -1)
+	code_of_row[code_rows] = code_ids[code_inverse]
+
+	# integrity, as leica.check_integrity_of_setup for every setup at once
+	setup_rows = np.flatnonzero(is_setup)
+	if not is_setup[0]:
+		raise Exception('gsi does not start with a setup, row 0')
+	if setup_rows[-1] + 2 >= rows or not is_measurement[np.minimum(setup_rows + 2, rows - 1)].all():
+		raise Exception('ro is missing the measurement, row %d' % setup_rows[~is_measurement[np.minimum(setup_rows + 2, rows - 1)] | (setup_rows + 2 >= rows)][0])
+	if not is_code[setup_rows + 1].all():
+		raise Exception('gsi does not follow setup with a RO, row %d' % setup_rows[~is_code[setup_rows + 1]][0])
+	not_ro = [row for row in setup_rows if store.codes[code_of_row[row + 1]] != 'RO']
+	if not_ro:
+		raise Exception('code is not RO following setup, row %d' % not_ro[0])
+
+	# attributes, combined once per distinct set of info words
+	attrib_bytes, attrib_inverse = unique_rows(row_values(words, (42, 43, 44, 45, 46, 47, 48, 49), code_rows, value_length))
+	stride = value_length + 1
+	attrib_ids = np.array([store.attribs.intern(combine_strings(*[decode_row_value(raw[i:i + stride].tobytes(), value_length) for i in range(0, len(raw), stride)])) for raw in attrib_bytes], dtype=np.int64)
+	attrib_of_row = np.full(rows, -1)
+	attrib_of_row[code_rows] = attrib_ids[attrib_inverse]
+
+	# carry the most recent code forward onto each measurement
+	recent_code_row = np.maximum.accumulate(np.where(is_code, everything, -1))
+	setup_of_row = np.cumsum(is_setup) - 1
+	measurement_rows = np.flatnonzero(is_measurement)
+	recent = recent_code_row[measurement_rows]
+
+	store.code_index = code_of_row[recent].astype(np.int32)
+	store.attrib_index = attrib_of_row[recent].astype(np.int32)
+	store.setup_index = setup_of_row[measurement_rows].astype(np.int32)
+	store.setup_offsets = np.concatenate(([0], np.cumsum(np.bincount(store.setup_index, minlength=len(setup_rows))))).astype(np.int64)
+
+	# point ids, numbers are kept as they are and only names are decoded and interned
+	point_ids = np.full(len(measurement_rows), -1, dtype=np.int64)
+	if 11 in words:
+		integers, numeric = word_integers(words[11])
+		direct = np.full(rows, -1, dtype=np.int64)
+		direct[words[11].rows] = np.where(numeric & (integers >= 0), integers, -1)
+		point_ids = direct[measurement_rows]
+	named = point_ids < 0
+	point_id_bytes, point_id_inverse = unique_rows(row_values(words, (11,), measurement_rows[named], value_length))
+	named_index = np.array([store.point_id_to_index(decode_row_value(raw.tobytes(), value_length)) for raw in point_id_bytes], dtype=np.int64)
+	point_ids[named] = named_index[point_id_inverse] if len(named_index) else point_ids[named]
+	store.point_id_index = point_ids
+
+	store.columns = {
+		'hz': column(words, 21, rows, angles_to_decimal)[measurement_rows],
+		'vt': column(words, 22, rows, angles_to_decimal)[measurement_rows],
+		'sd': column(words, 31, rows, distances_to_m)[measurement_rows],
+		'ea': column(words, 81, rows, distances_to_m)[measurement_rows],
+		'no': column(words, 82, rows, distances_to_m)[measurement_rows],
+		'el': column(words, 83, rows, distances_to_m)[measurement_rows],
+		'th': column(words, 87, rows, distances_to_m)[measurement_rows],
+	}
+
+	# setups, there are few enough of these to handle row by row
+	store.stations = word_text(words, 11, setup_rows, value_length)
+	store.backsights = word_text(words, 79, setup_rows, value_length)
+	store.setup_columns = {
+		'easting': column(words, 84, rows, distances_to_m)[setup_rows],
+		'northing': column(words, 85, rows, distances_to_m)[setup_rows],
+		'elevation': column(words, 86, rows, distances_to_m)[setup_rows],
+		'height': column(words, 88, rows, distances_to_m)[setup_rows],
+	}
+
+	# date and time, the last timed measurement of each setup wins
+	store.date_times = [None] * len(setup_rows)
+	timed = measurement_rows[present(18)[measurement_rows] & present(19)[measurement_rows]]
+	for row, w18, w19 in zip(timed, word_text(words, 18, timed, value_length), word_text(words, 19, timed, value_length)):
+		store.date_times[setup_of_row[row]] = derive_date_time(w18, w19)
+
+	return store
+
+def check_parity(fn:str, bit_depth:int = None, tolerance:float = 1e-9) -> int:
+	'''compares the numpy decoder against leica.iter_gsi shot by shot, returns the number of shots compared'''
+	store = gsi_to_store(fn, bit_depth)
+	if bit_depth is None:
+		with open(fn, 'rb') as gsi_file:
+			bit_depth = 16 if gsi_file.read(1) == b'*' else 8
+
+	row:int = 0
+	for i, setup in enumerate(iter_gsi(fn, bit_depth)):
+		if setup['station'] != store.stations[i] or setup['backsight'] != store.backsights[i] or setup['date_time'] != store.date_times[i]:
+			raise ValueError("parity mismatch at setup %d: %s" % (i, setup['station']))
+
+		for shot in setup['coded_measurements']:
+			decoded = store.shot(row)
+			for expected, actual in zip(shot, decoded):
+				if isinstance(expected, float) and isinstance(actual, float):
+					same = math.isclose(expected, actual, abs_tol=tolerance)
+				else:
+					same = expected == actual
+				if not same:
+					raise ValueError("parity mismatch at shot %d: %s != %s" % (row, shot, decoded))
+			row += 1
+
+	if row != len(store):
+		raise ValueError("parity mismatch: %d shots != %d shots" % (row, len(store)))
+
+	return row
+
+# Main block to execute if the script is run directly, checks parity of each given file
+if __name__ == "__main__":
+	for fn in sys.argv[1:] or ['data/SOUTHPOR.GSI']:
+		print(fn, check_parity(fn), 'shots match')
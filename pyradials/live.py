@@ -0,0 +1,117 @@
+'''live ingest, reduces shots as they arrive from a growing .gsi file or an instrument stream
+
+Only new lines are parsed, the recent code and attributes carry over between reads exactly as in
+leica.iter_coded_measurements, and each shot goes through the same orientation and reduction
+maths as print_radials, so a shot is on screen milliseconds after the instrument records it.
+The preview is appended to (draw_dxf append=True), a refresh plots only the shots since the last one.'''
+import os, shutil, socket, sys, time
+from itertools import chain
+from colour import Colour; colour = Colour()
+from leica import gsi_word_size, gsi_row_to_block, iter_coded_measurements
+from reduction import orientate_setup, reduce_shot
+
+def follow_file(fn:str, poll_interval:float = 0.5, idle_timeout:float = None):
+	'''tails a gsi file and yields each complete line as it is written
+
+	waits for more data at the end of the file, stops after idle_timeout seconds without a new line
+	(None follows forever) and starts over if the file is truncated or replaced by a shorter one'''
+	with open(fn, 'r') as gsi_file:
+		partial:str = ''
+		last_read:float = time.monotonic()
+
+		while True:
+			text = gsi_file.readline()
+
+			if text:
+				last_read = time.monotonic()
+				partial += text
+				# the instrument may still be writing this line, wait for its newline
+				if partial.endswith('\n'):
+					row = partial.rstrip()
+					partial = ''
+					if row:
+						yield row
+				continue
+
+			if os.path.getsize(fn) < gsi_file.tell():
+				gsi_file.seek(0)
+				partial = ''
+				continue
+
+			if idle_timeout is not None and time.monotonic() - last_read > idle_timeout:
+				return
+
+			time.sleep(poll_interval)
+
+def follow_stream(stream):
+	'''yields gsi lines from any file-like object, e.g. sys.stdin or a serial port, as a serial stand-in'''
+	for text in stream:
+		row = text.rstrip()
+		if row:
+			yield row
+
+def follow_socket(host:str, port:int, timeout:float = None):
+	'''yields gsi lines sent over tcp, e.g. from an instrument on a serial-to-network bridge'''
+	with socket.create_connection((host, port), timeout) as connection:
+		with connection.makefile('r', newline=None) as stream:
+			yield from follow_stream(stream)
+
+def iter_live_radials(lines, control):
+	'''reduces each shot as its line arrives, yields (setup, coded_measurement, (x, y, z))
+
+	the bit-depth is taken from the first line, * in first position equals 16-bit'''
+	lines = iter(lines)
+	first_line = next(lines, None)
+	if first_line is None:
+		return
+
+	word_size, trim_16bit_prefix = gsi_word_size(16 if first_line[0] == '*' else 8)
+	blocks = (gsi_row_to_block(row, word_size, trim_16bit_prefix) for row in chain([first_line], lines))
+
+	oriented_setup:dict = None
+	for setup, shot in iter_coded_measurements(blocks):
+		# orientate once per setup, as soon as its RO has been read
+		if setup is not oriented_setup:
+			stn_xyz, ro_azimuth = orientate_setup(setup, control)
+			oriented_setup = setup
+
+		yield setup, shot, reduce_shot(setup, shot, stn_xyz, ro_azimuth)
+
+def run_live(lines, control, preview_fn:str = None, scale:int = 100) -> list:
+	'''prints each shot as it is reduced, refreshes the preview dxf as each setup completes,
+	returns the drawing list in the same format as print_radials'''
+	from dxf.plot import draw_dxf, append_directory
+
+	if preview_fn is not None: # a session starts its preview over, an earlier session's appends don't carry on
+		shutil.rmtree(append_directory(preview_fn), ignore_errors=True)
+
+	colour.print("== LIVE RADIALS ==", Colour.LIGHT_YELLOW)
+	drawing = []
+	used:dict = {} # the control this session has set up on or backsighted, all that gets drawn
+	current:dict = None
+
+	try:
+		for setup, shot, (x, y, z) in iter_live_radials(lines, control):
+			if setup is not current:
+				if current is not None and preview_fn is not None:
+					draw_dxf(drawing, [[key, *value] for key, value in used.items()], scale, preview_fn, append=True)
+				current = setup
+				for name in (setup['station'], setup['backsight']):
+					if name in control:
+						used[name] = control[name]
+				colour.print("-- " + str(setup['station']) + ", instrument height: " + str(setup['height']) + "m --", Colour.LIGHT_YELLOW)
+
+			colour.print("%-10s %-6s %12.3f %12.3f %9.3f %s" % (shot.point_id, shot.code, x, y, z, shot.attrib or ''), Colour.YELLOW)
+			sys.stdout.flush()
+
+			if shot.code != 'RO':
+				sx, sy, sz = control[setup['station']]
+				drawing.append([shot.point_id, shot.code, x, y, z, shot.attrib, sx, sy, sz, setup['height']])
+
+	except KeyboardInterrupt:
+		pass # ctrl+c ends a live session, keep what has been reduced so far
+
+	if drawing and preview_fn is not None:
+		draw_dxf(drawing, [[key, *value] for key, value in used.items()], scale, preview_fn, append=True)
+
+	return drawing
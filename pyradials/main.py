@@ -1,16 +1,26 @@
 # default imports
-import logging, sys, os, pathlib
+import argparse, contextlib, logging, sys, os, pathlib
 from tabulate import tabulate
 from datetime import datetime
 
 # this projects imports
-from cli import banner, draw_nice_line, print_gps, print_coordinates, print_stations, print_radials, print_control
+from cli import banner, draw_nice_line, print_gps, print_coordinates, print_stations, print_radials, print_control, print_adjustment, print_coincident
 from instrument import instrument_file_as_source
+from gps import REJECT_SIGMA
 from calc import spherical_to_cartesian, dms_to_decimal, cartesian_to_spherical, horizontal_to_azimuth
 from colour import Colour
-from control import control
-
-from dxf.plot import draw_dxf
+from control import control as default_control
+from control_store import open_control, job_control
+
+from dxf.plot import draw_dxf, LINEWORK_MODES, LABEL_MODES
+from dxf.output import OUTPUT_FORMATS
+from dxf.layers import load_code_library
+from live import follow_file, follow_socket, follow_stream, run_live
+from cache import ResultCache, cached_source, cached_radials
+from batch import run_batch
+from adjust import adjust_source
+from spatial import PointIndex
+from profiling import Profiler, stage
 
 DEBUG_MODE = False
 if DEBUG_MODE:
@@ -24,6 +34,7 @@ if DEBUG_MODE:
 		'file_name': 'example.gsi',
 		'format': 'Leica Geosystems 16-bit GSI (Geo Serial Interface)',
 		'capture_date_time': '2024-03-03 01:50:45',
+		'store': ObservationStore, # .gsi only, the columns behind the 'data' views below
 		'data': [
 			{
 				'station': 'STN1',
@@ -68,34 +79,135 @@ if DEBUG_MODE:
 	}
 '''
 
+def parse_arguments(arguments:list = None):
+	parser = argparse.ArgumentParser(prog='pyradials', description='Traverse, Reduce, and Plot Leica TPS1100 .GSI')
+	parser.add_argument('files', nargs='*', help='instrument files (.gsi, .csv) to process')
+	parser.add_argument('--follow', metavar='GSI', help='live mode, tail a growing .gsi file ("-" reads stdin)')
+	parser.add_argument('--connect', metavar='HOST:PORT', help='live mode, read .gsi lines from a tcp socket')
+	parser.add_argument('--preview', metavar='DXF', help='live mode, dxf refreshed as each setup completes')
+	parser.add_argument('--no-cache', action='store_true', help='always parse and reduce, skip the result cache')
+	parser.add_argument('--batch', action='store_true', help='process the files in parallel and print a summary instead of tables')
+	parser.add_argument('--workers', type=int, default=None, metavar='N', help='batch, tile and layer worker processes (default: one per core)')
+	parser.add_argument('--control', metavar='FILE', help='control archive (.sqlite, or a name,easting,northing,elevation .csv), default: control.py')
+	parser.add_argument('--adjust', nargs='*', default=None, metavar='STATION', help='least-squares adjust the control from each file\'s station shots before reducing, holding STATIONs fixed (default: the first setup and its backsight)')
+	parser.add_argument('--reject', nargs='?', type=float, const=REJECT_SIGMA, default=None, metavar='SIGMA', help='average gps points without the epochs more than SIGMA standard deviations from their mean (default: %s), every epoch is averaged without it' % REJECT_SIGMA)
+	parser.add_argument('--qc', nargs='?', type=float, const=0.005, default=None, metavar='TOLERANCE', help='report reduced points within TOLERANCE metres of each other (default: 0.005) and repeated point ids')
+	parser.add_argument('--linework', choices=LINEWORK_MODES, default='polyline', help='draw each coded string as one 3d polyline (default), one flat lwpolyline, or a line a segment')
+	parser.add_argument('--setup-radials', action='store_true', help='draw the radials of each setup as one polyline rather than a line a shot')
+	parser.add_argument('--labels', choices=LABEL_MODES, default='fixed', help='leave labels at a fixed offset from their point (default), or place them clear of each other (not with --parallel or --tiles)')
+	parser.add_argument('--stream', action='store_true', help='write the dxf as it\'s plotted, in bounded memory, for very large surveys')
+	parser.add_argument('--tiles', choices=('grid', 'setup'), default=None, help='split the dxf into a grid of tiles or one a setup, the .dxf becomes an index of them')
+	parser.add_argument('--tile-size', type=float, default=100.0, metavar='METRES', help='grid tile size (default: 100)')
+	parser.add_argument('--parallel', action='store_true', help='draw each layer in its own worker process and merge them into one dxf')
+	parser.add_argument('--append', action='store_true', help='keep the .dxf\'s entities beside it (in <name>_append/) and on later runs plot and add only the shots of new setups')
+	parser.add_argument('--format', choices=OUTPUT_FORMATS, default='dxf', help='write text dxf (default), binary dxf, or text dxf compressed as .dxf.gz or .zip')
+	parser.add_argument('--codes', metavar='JSON', help='code library to draw with (layers and codes as json, see dxf/layers.py export), default: the built-in codes')
+	parser.add_argument('--profile', nargs='?', const=True, default=None, metavar='JSON', help='time and measure each stage of each file, optionally saving the report as json')
+	args = parser.parse_args(arguments)
+	if args.labels == 'placed' and (args.parallel or args.tiles):
+		parser.error("--labels placed places every label in one pass, it can't be used with --parallel or --tiles")
+	return args
+
+def plot_options(args) -> dict:
+	'''draw_dxf keyword arguments from the command line, the code library is loaded and compiled here'''
+	return {'codes': load_code_library(args.codes) if args.codes else None, 'linework': args.linework, 'radial_mode': 'setup' if args.setup_radials else 'shot', 'stream': args.stream, 'tiles': args.tiles, 'tile_size': args.tile_size, 'workers': args.workers, 'parallel': args.parallel, 'append': args.append, 'fmt': args.format, 'label_mode': args.labels}
+
+def live(args, control):
+	'''reduces shots as they arrive until the stream ends or ctrl+c'''
+	if args.connect:
+		host, port = args.connect.rsplit(':', 1)
+		lines = follow_socket(host, int(port))
+	elif args.follow == '-':
+		lines = follow_stream(sys.stdin)
+	else:
+		lines = follow_file(args.follow)
+
+	preview = args.preview
+	if preview is None and args.follow not in (None, '-'):
+		preview = pathlib.Path(args.follow).with_suffix('.dxf')
+
+	run_live(lines, control, preview)
+
 def main():
+	args = parse_arguments()
 
 	colour = Colour() # initialise the colour object, this will allow us to print in colour
 	banner()
 
-	for argument in sys.argv[1:]:
-		source = instrument_file_as_source(argument,True)
+	control = open_control(args.control) if args.control else default_control
 
-		print("\nfilename: %s" % source.get('file_name'))
-		print("type: %s" % source.get('type'))
-		print("format: %s" % source.get('format'))
-		print("capture_date: %s" % source.get('capture_date_time'))
-		draw_nice_line()
+	if args.follow or args.connect:
+		live(args, control)
+		return
 
-		if source['type'] == 'gps':
-			print_gps(source)
+	profiler = Profiler()
+	plot = plot_options(args)
 
-		if source['type'] == 'total_station':
-			#print_coordinates(source)
-			print_stations(source)
-			print_control(control)
-			radials = print_radials(source,control)
+	if args.batch:
+		results = run_batch(args.files, control, args.workers, 100, not args.no_cache, bool(args.profile), plot, args.reject, args.adjust, args.qc)
+		for result in results:
+			profiler.extend(result.stages or [])
+		args.files = []
 
-			stations = [[key, *value] for key, value in control.items()]
+	cache = None if args.no_cache or DEBUG_MODE else ResultCache()
 
-			draw_dxf(radials,stations,100,pathlib.Path(argument).with_suffix('.dxf'))
-			#os.system("start %s " % pathlib.Path(argument).with_suffix('.dxf'))
+	with profiler if args.profile else contextlib.nullcontext():
+		for argument in args.files:
+			with profiler.file(argument):
+				process_file(argument, colour, control, cache, args.adjust, args.qc, plot, args.reject)
 
+	if args.profile:
+		profiler.print_report()
+		if args.profile is not True:
+			profiler.save_json(args.profile)
 
 	# End of Program
 	print("\n")
+
+def process_file(argument:str, colour:Colour, control = default_control, cache:ResultCache = None, adjust:list = None, qc:float = None, plot:dict = None, reject_sigma:float = None) -> None:
+	'''parses, prints, reduces and plots a single instrument file, adjusting control first when adjust isn't None
+	and reporting coincident points within qc metres when it's given, plot holds draw_dxf's keyword arguments
+	and gps epochs are rejected reject_sigma standard deviations from their mean when it's given'''
+	with stage('instrument_file_as_source') as record:
+		digest, source = cached_source(argument, lambda fn: instrument_file_as_source(fn,DEBUG_MODE,reject_sigma), cache, reject_sigma)
+		if record.live:
+			record.records = sum(len(setup['coded_measurements']) for setup in source['data']) if source['type'] == 'total_station' else len(source['data'])
+
+	print("\nfilename: %s" % source.get('file_name'))
+	print("type: %s" % source.get('type'))
+	print("format: %s" % source.get('format'))
+	print("capture_date: %s" % source.get('capture_date_time'))
+	draw_nice_line()
+
+	if source['type'] == 'gps':
+		print_gps(source)
+
+	if source['type'] == 'total_station':
+		#print_coordinates(source)
+		print_stations(source)
+		control = job_control(source, control) # only the stations this file references when it's an archive (--control)
+		if adjust is not None:
+			with stage('adjust_source') as record:
+				adjustment = adjust_source(source, control, adjust)
+				record.records = len(adjustment.stations)
+			print_adjustment(adjustment)
+			control.update(adjustment.control) # print_radials and draw_dxf use the adjusted control
+		print_control(control)
+		with stage('print_radials') as record:
+			hit, radials = cached_radials(digest, control, lambda: print_radials(source,control), cache)
+			record.records = len(radials)
+		if hit:
+			colour.print("== RADIALS ==\n%d radials unchanged, loaded from cache\n" % len(radials), Colour.LIGHT_YELLOW)
+
+		if qc is not None:
+			with stage('coincident') as record:
+				index = PointIndex.from_drawing(radials, control)
+				record.records = len(index)
+			print_coincident(index, qc)
+
+		stations = [[key, *value] for key, value in control.items()]
+
+		with stage('draw_dxf') as record:
+			entities = draw_dxf(radials,stations,100,pathlib.Path(argument).with_suffix('.dxf'),**(plot or {}))
+			record.records = sum(entities.values())
+		#os.system("start %s " % pathlib.Path(argument).with_suffix('.dxf'))
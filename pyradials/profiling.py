@@ -0,0 +1,153 @@
+'''opt-in per-stage profiling, wall time, cpu time, peak memory and record counts for each stage of each file
+
+	with Profiler() as profiler:
+		with profiler.file('data/SOUTHPOR.GSI'):
+			with stage('print_radials') as record:
+				radials = print_radials(source, control)
+				record.records = len(radials)
+	profiler.print_report()
+	profiler.save_json('profile.json')
+
+stage() is free to leave in library code, it does nothing unless a Profiler is active, a count that
+costs a pass over the data goes under `if record.live:` so it's only made when profiling. Stages
+nest, a stage inside another is reported by its path e.g. draw_dxf/saveas, times are inclusive.'''
+import json, platform, time, tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from tabulate import tabulate
+from colour import Colour; colour = Colour()
+
+active = None # the Profiler currently recording
+
+class StageRecord:
+	'''totals for one stage path of one file, a stage entered many times (e.g. per setup) accumulates'''
+	live:bool = True
+	def __init__(self, file_name:str, path:str):
+		self.file = file_name
+		self.stage = path
+		self.calls:int = 0
+		self.wall:float = 0.0
+		self.cpu:float = 0.0
+		self.peak_bytes:int = 0
+		self.records:int = None
+
+	def as_dict(self) -> dict:
+		return {
+			'file': self.file,
+			'stage': self.stage,
+			'calls': self.calls,
+			'wall_s': round(self.wall, 6),
+			'cpu_s': round(self.cpu, 6),
+			'peak_mb': round(self.peak_bytes / 1024 / 1024, 3) if self.peak_bytes is not None else None,
+			'records': self.records,
+		}
+
+class Profiler:
+	def __init__(self, trace_memory:bool = True):
+		self.trace_memory = trace_memory
+		self.current_file:str = None
+		self.records:dict = {} # (file, path) -> StageRecord, in order of first entry
+		self.stack:list = [] # [path, peak_abs] of the stages currently open
+		self.started_tracing:bool = False
+
+	def __enter__(self):
+		global active
+		active = self
+		if self.trace_memory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+			self.started_tracing = True
+		return self
+
+	def __exit__(self, *exc_info):
+		global active
+		active = None
+		if self.started_tracing:
+			tracemalloc.stop()
+			self.started_tracing = False
+
+	@contextmanager
+	def file(self, file_name:str):
+		'''attributes the stages run inside it to file_name'''
+		previous, self.current_file = self.current_file, str(file_name)
+		try:
+			yield
+		finally:
+			self.current_file = previous
+
+	@contextmanager
+	def stage(self, name:str):
+		path = '/'.join([frame[0] for frame in self.stack] + [name])
+		key = (self.current_file, path)
+		record = self.records.get(key)
+		if record is None:
+			record = self.records[key] = StageRecord(self.current_file, path)
+
+		tracing = tracemalloc.is_tracing()
+		if tracing:
+			start_bytes = tracemalloc.get_traced_memory()[0]
+			tracemalloc.reset_peak()
+
+		frame = [path, 0]
+		self.stack.append(frame)
+		wall, cpu = time.perf_counter(), time.process_time()
+		try:
+			yield record
+		finally:
+			record.wall += time.perf_counter() - wall
+			record.cpu += time.process_time() - cpu
+			record.calls += 1
+			self.stack.pop()
+
+			if tracing:
+				# a nested stage resets the peak, so take the highest of ours and our children's
+				peak_abs = max(tracemalloc.get_traced_memory()[1], frame[1])
+				record.peak_bytes = max(record.peak_bytes, peak_abs - start_bytes)
+				if self.stack:
+					self.stack[-1][1] = max(self.stack[-1][1], peak_abs)
+			else:
+				record.peak_bytes = None
+
+	def extend(self, stages:list) -> None:
+		'''adds stage dicts recorded elsewhere, e.g. by a batch worker process'''
+		for row in stages:
+			record = self.records[(row['file'], row['stage'])] = StageRecord(row['file'], row['stage'])
+			record.calls = row['calls']
+			record.wall = row['wall_s']
+			record.cpu = row['cpu_s']
+			record.peak_bytes = row['peak_mb'] * 1024 * 1024 if row['peak_mb'] is not None else None
+			record.records = row['records']
+
+	def as_dict(self) -> dict:
+		return {
+			'created': datetime.now().isoformat(timespec='seconds'),
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'stages': [record.as_dict() for record in self.records.values()],
+		}
+
+	def save_json(self, fn:str) -> None:
+		with open(fn, 'w') as json_file:
+			json.dump(self.as_dict(), json_file, indent=2)
+
+	def print_report(self) -> None:
+		colour.print("== PROFILE ==", Colour.LIGHT_CYAN)
+		rows = [['File', 'Stage', 'Calls', 'Wall (s)', 'CPU (s)', 'Peak (MB)', 'Records']]
+		for record in self.records.values():
+			row = record.as_dict()
+			rows.append([row['file'], row['stage'], row['calls'], row['wall_s'], row['cpu_s'], row['peak_mb'], row['records']])
+		colour.print(tabulate(rows, headers='firstrow', floatfmt='.3f'), Colour.CYAN)
+		print('')
+
+class NullRecord:
+	'''stands in for a StageRecord when nothing is being profiled'''
+	live:bool = False
+	records:int = None
+
+@contextmanager
+def stage(name:str):
+	'''times the enclosed block as a stage of the active Profiler, a no-op when profiling is off'''
+	if active is None:
+		yield NullRecord()
+	else:
+		with active.stage(name) as record:
+			yield record
@@ -0,0 +1,139 @@
+'''headless radial reduction, orientates each setup once and reduces all of its shots to E/N/Z as one batch
+
+reduce_source returns a Reduction of numpy columns aligned with the source's ObservationStore and
+never prints, so batch and server runs can skip print_radials and its tables. The single shot
+functions (orientate_setup, reduce_shot) are kept for live ingest, both give the same coordinates.'''
+from collections import namedtuple
+import numpy as np
+from calc import spherical_to_cartesian, cartesian_to_spherical, horizontal_to_azimuth, spherical_to_cartesian_array, horizontal_to_azimuth_array
+from store import ObservationStore
+
+# easting, northing and elevation are aligned with the store's shot rows, station_xyz and
+# ro_azimuth have one row per setup
+Reduction = namedtuple("Reduction", "store station_xyz ro_azimuth easting northing elevation")
+
+def increment_string(s):
+	# Convert the string to a list to make it mutable
+	s = list(s)
+
+	# Start from the end of the string
+	i = len(s) - 1
+	carry = 1  # Initialize carry to 1 to increment the last character
+
+	# Iterate through the string characters from the end to the beginning
+	while i >= 0 and carry:
+		if s[i].isdigit():  # If the character is a digit
+			# Increment the digit and check for carry-over
+			carry, digit = divmod(int(s[i]) + carry, 10)
+			s[i] = str(digit)
+		else:
+			# If the character is not a digit, break the loop
+			break
+		i -= 1
+
+	# If carry is still remaining, prepend '1'
+	if carry:
+		s.insert(0, '1')
+	return ''.join(s)
+
+def orientate_setup(setup, control) -> tuple:
+	'''returns the station coordinates and the azimuth from the station to its backsight'''
+	station = setup['station']
+	backsight = setup['backsight']
+
+	# if it's the first setup, we won't have a backsight, so let's go find it (typically STN2)
+	if backsight == None:
+		backsight = increment_string(station)
+
+	stn_xyz = control[station]
+	try:
+		bs_xyz = control[backsight]
+	except:
+		raise ValueError("cant find backsight in control" + str(setup))
+	ro_radius, ro_inclination, ro_azimuth = cartesian_to_spherical(stn_xyz,bs_xyz)
+
+	return stn_xyz, ro_azimuth
+
+def reduce_shot(setup, shot, stn_xyz, ro_azimuth) -> tuple:
+	'''reduces a single shot to easting, northing and elevation, the setup's first shot is its RO'''
+	ro_shot = setup['coded_measurements'][0]
+
+	# fix for a RO done backwards
+	if ro_shot.vt > 180:
+		shot_angle = shot.hz + 180 % 360
+	else:
+		shot_angle = shot.hz
+
+	# subtract the instruments angle (j) to get a 0, then add the real RO angle (k) and the shot angle (i)
+	i = horizontal_to_azimuth(shot_angle) # angle of shot from 0
+	j = horizontal_to_azimuth(ro_shot.hz) # angle of ro from 0
+	k = ro_azimuth # angle of ro from actual 0
+
+	shot_azimuth = i-j+k
+	x,y,z = spherical_to_cartesian(shot.sd,shot.vt,shot_azimuth,stn_xyz)
+
+	# adjust height based on instrument and target offsets
+	z += setup['height']
+	z -= shot.th
+
+	return x, y, z
+
+def reduce_source(source, control) -> Reduction:
+	'''reduces every shot of a total station source, one vectorised batch per setup'''
+	store = source.get('store')
+	if store is None: # sources built without the columnar store, e.g. the debug json path
+		store = ObservationStore.from_setups(source['data'])
+
+	setups = store.setup_count()
+	station_xyz = np.zeros((setups, 3))
+	ro_azimuth = np.zeros(setups)
+	easting, northing, elevation = np.empty(len(store)), np.empty(len(store)), np.empty(len(store))
+
+	hz, vt, sd, th = store['hz'], store['vt'], store['sd'], store['th']
+	height = store.setup_columns['height']
+
+	for i in range(setups):
+		rows = store.setup_slice(i)
+		if rows.start == rows.stop:
+			continue
+
+		setup = {'station': store.stations[i], 'backsight': store.backsights[i]}
+		stn_xyz, azimuth = orientate_setup(setup, control)
+		station_xyz[i] = stn_xyz
+		ro_azimuth[i] = azimuth
+
+		# the setup's first shot is its RO, see reduce_shot for the maths one shot at a time
+		ro_hz, ro_vt = hz[rows.start], vt[rows.start]
+		shot_angle = hz[rows] + 180 if ro_vt > 180 else hz[rows] # fix for a RO done backwards
+
+		shot_azimuth = horizontal_to_azimuth_array(shot_angle) - horizontal_to_azimuth(ro_hz) + azimuth
+		x, y, z = spherical_to_cartesian_array(sd[rows], vt[rows], shot_azimuth, station_xyz[i])
+
+		easting[rows] = x
+		northing[rows] = y
+		elevation[rows] = z + height[i] - th[rows]
+
+	return Reduction(store, station_xyz, ro_azimuth, easting, northing, elevation)
+
+def reduction_to_drawing(reduction:Reduction) -> list:
+	'''the drawing list draw_dxf takes, one row per non-RO shot:
+	[point_id, code, x, y, z, attrib, station x, station y, station z, instrument height]'''
+	store = reduction.store
+	height = store.setup_columns['height']
+	drawing = []
+
+	not_ro = np.array([code != 'RO' for code in store.codes.values], dtype=bool)
+	rows = np.flatnonzero(not_ro[store.code_index]) if len(store.codes) else np.empty(0, dtype=np.int64)
+
+	for row, setup, x, y, z in zip(rows.tolist(), store.setup_index[rows].tolist(), reduction.easting[rows].tolist(), reduction.northing[rows].tolist(), reduction.elevation[rows].tolist()):
+		sx, sy, sz = reduction.station_xyz[setup].tolist()
+		drawing.append([
+			store.index_to_point_id(store.point_id_index[row]),
+			store.codes[store.code_index[row]],
+			x, y, z,
+			store.attribs[store.attrib_index[row]],
+			sx, sy, sz,
+			float(height[setup])
+		])
+
+	return drawing
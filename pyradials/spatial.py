@@ -0,0 +1,122 @@
+'''spatial index over reduced points, radius, nearest and coincident point queries without an O(n²) scan
+
+	index = PointIndex.from_reduction(reduce_source(source, control))
+	index.radius(control['STN1'], 5.0) # rows within 5m of STN1
+	index.nearest((1000.0, 2000.0), 3) # distances and rows of the 3 closest
+	index.coincident(0.005) # groups of rows within 5mm of each other
+
+Built once per job on a scipy cKDTree, queries are in plan (easting, northing) unless the index is
+built with dimensions=3, so a point shot twice at different heights still counts as coincident.'''
+from collections import namedtuple
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+from scipy.spatial import cKDTree
+
+# one coincident point, distance is how far it is from the first point of its group
+Coincident = namedtuple("Coincident", "group point_id code station easting northing elevation distance")
+
+class PointIndex:
+	def __init__(self, xyz:np.ndarray, point_ids:list, codes:list, stations:list, dimensions:int = 2):
+		self.xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+		self.point_ids = point_ids
+		self.codes = codes
+		self.stations = stations
+		self.dimensions = dimensions
+		self.tree = cKDTree(self.xyz[:, :dimensions])
+
+	@classmethod
+	def from_reduction(cls, reduction, dimensions:int = 2, include_ro:bool = False):
+		'''indexes the shots of a reduction.Reduction, ROs are left out unless include_ro'''
+		store = reduction.store
+		rows = np.arange(len(store))
+		ro = store.codes.index.get((str, 'RO'))
+		if not include_ro and ro is not None:
+			rows = rows[store.code_index != ro]
+
+		xyz = np.column_stack([reduction.easting[rows], reduction.northing[rows], reduction.elevation[rows]])
+		point_ids = [store.index_to_point_id(i) for i in store.point_id_index[rows]]
+		codes = [store.codes[i] for i in store.code_index[rows]]
+		stations = [store.stations[i] for i in store.setup_index[rows]]
+		return cls(xyz, point_ids, codes, stations, dimensions)
+
+	@classmethod
+	def from_drawing(cls, drawing:list, control:dict = None, dimensions:int = 2):
+		'''indexes the drawing list from print_radials, station names are looked up in control by their coordinates'''
+		names = {tuple(xyz): name for name, xyz in (control or {}).items()}
+		xyz = np.array([row[2:5] for row in drawing], dtype=np.float64)
+		stations = [names.get((row[6], row[7], row[8])) for row in drawing]
+		return cls(xyz, [row[0] for row in drawing], [row[1] for row in drawing], stations, dimensions)
+
+	def __len__(self) -> int:
+		return len(self.xyz)
+
+	def radius(self, point, distance:float) -> np.ndarray:
+		'''rows within distance of point, nearest first'''
+		point = np.asarray(point, dtype=np.float64)[:self.dimensions]
+		rows = np.asarray(self.tree.query_ball_point(point, distance), dtype=np.int64)
+		return rows[np.argsort(np.linalg.norm(self.xyz[rows, :self.dimensions] - point, axis=1))]
+
+	def nearest(self, point, k:int = 1) -> tuple:
+		'''(distances, rows) of the k nearest rows to point'''
+		k = min(k, len(self))
+		distances, rows = self.tree.query(np.asarray(point, dtype=np.float64)[:self.dimensions], k=k)
+		return np.atleast_1d(distances), np.atleast_1d(rows)
+
+	def pairs(self, tolerance:float) -> np.ndarray:
+		'''(i, j) rows closer than tolerance, each pair once with i < j'''
+		return self.tree.query_pairs(tolerance, output_type='ndarray')
+
+	def coincident(self, tolerance:float) -> list:
+		'''groups of rows chained within tolerance of each other, as arrays of rows, largest group first'''
+		pairs = self.pairs(tolerance)
+		if len(pairs) == 0:
+			return []
+
+		graph = scipy.sparse.coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(len(self), len(self)))
+		count, labels = scipy.sparse.csgraph.connected_components(graph, directed=False)
+		sizes = np.bincount(labels, minlength=count)
+
+		grouped = np.flatnonzero(sizes[labels] > 1)
+		grouped = grouped[np.lexsort((grouped, labels[grouped]))]
+		groups = np.split(grouped, np.flatnonzero(np.diff(labels[grouped])) + 1)
+		return sorted(groups, key=lambda rows: (-len(rows), rows[0]))
+
+	def duplicate_point_ids(self) -> list:
+		'''groups of rows sharing a point id, e.g. the same point observed from two setups'''
+		rows_by_id:dict = {}
+		for row, point_id in enumerate(self.point_ids):
+			rows_by_id.setdefault(point_id, []).append(row)
+		return [np.array(rows) for rows in rows_by_id.values() if len(rows) > 1]
+
+	def describe(self, groups:list) -> list:
+		'''Coincident rows for each group, the first point of a group is its reference'''
+		report = []
+		for number, rows in enumerate(groups, 1):
+			reference = self.xyz[rows[0], :self.dimensions]
+			for row in rows:
+				distance = float(np.linalg.norm(self.xyz[row, :self.dimensions] - reference))
+				report.append(Coincident(number, self.point_ids[row], self.codes[row], self.stations[row], *self.xyz[row].tolist(), distance))
+		return report
+
+# Main block to execute if the script is run directly, times the index on a million random points
+if __name__ == "__main__":
+	import sys, time
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+	generator = np.random.default_rng(0)
+	xyz = generator.uniform(0, 1000, (count, 3))
+	xyz[1::1000] = xyz[::1000][:len(xyz[1::1000])] + 0.001 # a coincident twin for one point in a thousand
+
+	started = time.perf_counter()
+	index = PointIndex(xyz, list(range(count)), ['SL'] * count, [None] * count)
+	print("built %d points in %.2fs" % (count, time.perf_counter() - started))
+
+	started = time.perf_counter()
+	groups = index.coincident(0.005)
+	print("%d coincident groups in %.2fs" % (len(groups), time.perf_counter() - started))
+
+	started = time.perf_counter()
+	for point in xyz[:1000]:
+		index.nearest(point, 5)
+		index.radius(point, 2.0)
+	print("1000 nearest and radius queries in %.2fs" % (time.perf_counter() - started))
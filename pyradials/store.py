@@ -0,0 +1,190 @@
+'''columnar, array-backed store for setups and their coded measurements
+
+Each shot is a row across a set of numpy columns rather than a Coded_Measurement namedtuple,
+codes, attributes and named point ids are interned into lookup tables and stored as integer
+indices, numbered point ids are stored directly.
+SetupView and ShotsView give the "Instrument Source Format" (see main.py) back as views so
+existing callers such as print_stations and print_radials work unchanged.'''
+import math
+from array import array
+from collections.abc import Mapping, Sequence
+import numpy as np
+from leica import Coded_Measurement
+
+# float columns, in Coded_Measurement order, None is stored as nan
+SHOT_COLUMNS = ('hz', 'vt', 'sd', 'ea', 'no', 'el', 'th')
+SETUP_COLUMNS = ('easting', 'northing', 'elevation', 'height')
+
+def to_float(value) -> float:
+	return math.nan if value is None else value
+
+def from_float(value):
+	value = float(value)
+	return None if math.isnan(value) else value
+
+class InternTable:
+	'''stores each distinct value once, rows refer to it by index'''
+	def __init__(self):
+		self.values:list = []
+		self.index:dict = {}
+
+	def intern(self, value) -> int:
+		# key on type too, point id 1 and '1' are different points
+		key = (type(value), value)
+		position = self.index.get(key)
+		if position is None:
+			position = len(self.values)
+			self.index[key] = position
+			self.values.append(value)
+		return position
+
+	def __getitem__(self, position:int):
+		return self.values[position]
+
+	def __len__(self) -> int:
+		return len(self.values)
+
+class ObservationStore:
+	'''holds every shot of a source as columns, shots are grouped by setup in file order'''
+	def __init__(self):
+		self.stations:list = []
+		self.backsights:list = []
+		self.date_times:list = []
+		self.setup_columns:dict = {name: np.empty(0) for name in SETUP_COLUMNS}
+
+		self.columns:dict = {name: np.empty(0) for name in SHOT_COLUMNS}
+		self.setup_index = np.empty(0, dtype=np.int32)
+		self.code_index = np.empty(0, dtype=np.int32)
+		self.attrib_index = np.empty(0, dtype=np.int32)
+		self.point_id_index = np.empty(0, dtype=np.int64) # point number, or -1 - index into point_ids for named points
+		self.setup_offsets = np.zeros(1, dtype=np.int64) # shots of setup i are setup_offsets[i]:setup_offsets[i+1]
+
+		self.codes = InternTable()
+		self.attribs = InternTable()
+		self.point_ids = InternTable()
+
+	@classmethod
+	def from_setups(cls, setups):
+		'''builds a store from any iterable of reduced setups, e.g. leica.iter_gsi, without holding the dicts'''
+		store = cls()
+		setup_columns = {name: array('d') for name in SETUP_COLUMNS}
+		columns = {name: array('d') for name in SHOT_COLUMNS}
+		setup_index, code_index, attrib_index, point_id_index = array('i'), array('i'), array('i'), array('q')
+		setup_offsets = array('q', [0])
+
+		for i, setup in enumerate(setups):
+			store.stations.append(setup['station'])
+			store.backsights.append(setup['backsight'])
+			store.date_times.append(setup['date_time'])
+			for name in SETUP_COLUMNS:
+				setup_columns[name].append(to_float(setup[name]))
+
+			for shot in setup['coded_measurements']:
+				for name in SHOT_COLUMNS:
+					columns[name].append(to_float(getattr(shot, name)))
+				setup_index.append(i)
+				code_index.append(store.codes.intern(shot.code))
+				attrib_index.append(store.attribs.intern(shot.attrib))
+				point_id_index.append(store.point_id_to_index(shot.point_id))
+
+			setup_offsets.append(len(setup_index))
+
+		store.setup_columns = {name: np.frombuffer(values, dtype=np.float64) for name, values in setup_columns.items()}
+		store.columns = {name: np.frombuffer(values, dtype=np.float64) for name, values in columns.items()}
+		store.setup_index = np.frombuffer(setup_index, dtype=np.int32)
+		store.code_index = np.frombuffer(code_index, dtype=np.int32)
+		store.attrib_index = np.frombuffer(attrib_index, dtype=np.int32)
+		store.point_id_index = np.frombuffer(point_id_index, dtype=np.int64)
+		store.setup_offsets = np.frombuffer(setup_offsets, dtype=np.int64)
+
+		return store
+
+	def __len__(self) -> int:
+		'''number of shots'''
+		return len(self.setup_index)
+
+	def __getitem__(self, name:str):
+		'''whole column of a shot attribute, e.g. store['sd']'''
+		return self.columns[name]
+
+	def point_id_to_index(self, point_id) -> int:
+		# most point ids are plain numbers, only interning names keeps the table small
+		if type(point_id) is int and point_id >= 0:
+			return point_id
+		return -1 - self.point_ids.intern(point_id)
+
+	def index_to_point_id(self, index):
+		index = int(index)
+		return index if index >= 0 else self.point_ids[-1 - index]
+
+	def setup_count(self) -> int:
+		return len(self.stations)
+
+	def setup_slice(self, i:int) -> slice:
+		return slice(int(self.setup_offsets[i]), int(self.setup_offsets[i + 1]))
+
+	def shot(self, row:int) -> Coded_Measurement:
+		'''materialises a single shot as a Coded_Measurement'''
+		columns = self.columns
+		return Coded_Measurement(
+			self.index_to_point_id(self.point_id_index[row]),
+			self.codes[self.code_index[row]],
+			self.attribs[self.attrib_index[row]],
+			*[from_float(columns[name][row]) for name in SHOT_COLUMNS],
+		)
+
+	def setups(self) -> list:
+		'''the store as a list of setup views, a drop-in for source['data']'''
+		return [SetupView(self, i) for i in range(self.setup_count())]
+
+	def nbytes(self) -> int:
+		'''memory held by the numpy columns'''
+		arrays = [*self.columns.values(), *self.setup_columns.values(),
+			self.setup_index, self.code_index, self.attrib_index, self.point_id_index, self.setup_offsets]
+		return sum(column.nbytes for column in arrays)
+
+class ShotsView(Sequence):
+	'''the coded_measurements of one setup, Coded_Measurement tuples are built on access'''
+	def __init__(self, store:ObservationStore, rows:slice):
+		self.store = store
+		self.rows = range(rows.start, rows.stop)
+
+	def __len__(self) -> int:
+		return len(self.rows)
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [self.store.shot(row) for row in self.rows[i]]
+		return self.store.shot(self.rows[i])
+
+class SetupView(Mapping):
+	'''a read-only setup dict backed by the store'''
+	keys_ = ('station', 'easting', 'northing', 'elevation', 'height', 'backsight', 'date_time', 'coded_measurements')
+
+	def __init__(self, store:ObservationStore, i:int):
+		self.store = store
+		self.i = i
+
+	def __getitem__(self, key:str):
+		store, i = self.store, self.i
+		match key:
+			case 'station': return store.stations[i]
+			case 'backsight': return store.backsights[i]
+			case 'date_time': return store.date_times[i]
+			case 'coded_measurements': return ShotsView(store, store.setup_slice(i))
+			case 'easting' | 'northing' | 'elevation' | 'height':
+				return from_float(store.setup_columns[key][i])
+			case _: raise KeyError(key)
+
+	def __iter__(self):
+		return iter(self.keys_)
+
+	def __len__(self) -> int:
+		return len(self.keys_)
+
+# Main block to execute if the script is run directly
+if __name__ == "__main__":
+	import sys
+	from leica import iter_gsi
+	store = ObservationStore.from_setups(iter_gsi(sys.argv[1] if len(sys.argv) > 1 else 'data/SOUTHPOR.GSI', 16))
+	print("%d setups, %d shots, %d bytes of columns" % (store.setup_count(), len(store), store.nbytes()))
@@ -0,0 +1,155 @@
+'''synthetic survey data, writes valid 8-bit and 16-bit .gsi files and matching gps .csv files
+
+A traverse of setups is laid out on a local grid, each setup observes its backsight (RO) then
+a run of coded shots at random targets around it. Codes come from dxf/layers.code_table, line
+codes are shot as strings of consecutive points so the linework plots as it would on site.
+The control dict returned alongside matches the file, so it reduces straight through reduction.reduce_source.'''
+import math, random, sys
+from dxf.layers import code_table
+
+# codes that aren't observations
+EXCLUDED_CODES = ('RO', 'Z')
+
+# bit-depth: (value length, row prefix)
+gsi_layout:dict = {
+	8: (8, ''),
+	16: (16, '*'),
+}
+
+def gsi_word(index:str, info:str, value, bit_depth:int = 16) -> str:
+	'''a single word, index (2) + information (4) + sign (1) + value, e.g. 21.324+0000000018716190'''
+	value_length, prefix = gsi_layout[bit_depth]
+	sign = '-' if isinstance(value, int) and value < 0 else '+'
+	text = str(abs(value)) if isinstance(value, int) else str(value)
+	if len(text) > value_length:
+		raise ValueError("%s does not fit a %d-bit gsi word" % (text, bit_depth))
+	return index + info + sign + text.rjust(value_length, '0')
+
+def gsi_row(words:list, bit_depth:int = 16) -> str:
+	return gsi_layout[bit_depth][1] + ' '.join(words)
+
+def decimal_to_dms(angle:float) -> int:
+	'''decimal degrees to the gsi dddmmsss form (last digit tenths of a second, written as 0)'''
+	angle %= 360
+	degrees = int(angle)
+	minutes = int((angle - degrees) * 60)
+	seconds = int(round(((angle - degrees) * 60 - minutes) * 60))
+	if seconds == 60:
+		seconds, minutes = 0, minutes + 1
+	if minutes == 60:
+		minutes, degrees = 0, (degrees + 1) % 360
+	return degrees * 100000 + minutes * 1000 + seconds * 10
+
+def m_to_mm(length:float) -> int:
+	return int(round(length * 1000))
+
+def traverse_control(setups:int, origin:tuple = (1000.0, 2000.0, 50.0), leg:float = 40.0, seed:int = 0) -> dict:
+	'''control for STN1..STN{setups + 1} along a meandering traverse'''
+	generator = random.Random(seed)
+	control = {}
+	x, y, z = origin
+	bearing = generator.uniform(0, 360)
+
+	for i in range(1, setups + 2):
+		control['STN%d' % i] = [round(x, 3), round(y, 3), round(z, 3)]
+		bearing += generator.uniform(-45, 45)
+		x += leg * math.cos(math.radians(bearing))
+		y += leg * math.sin(math.radians(bearing))
+		z += generator.uniform(-0.5, 0.5)
+
+	return control
+
+def observe(station:list, target:tuple, instrument_height:float, target_height:float, orientation:float) -> tuple:
+	'''hz, vt (decimal degrees) and slope distance from a station to a target, the inverse of reduction.reduce_shot'''
+	dx = target[0] - station[0]
+	dy = target[1] - station[1]
+	dz = target[2] - (station[2] + instrument_height) + target_height
+
+	horizontal = math.hypot(dx, dy)
+	azimuth = math.degrees(math.atan2(dy, dx))
+	hz = (90 - azimuth + orientation) % 360
+	vt = math.degrees(math.atan2(horizontal, dz))
+	return hz, vt, math.sqrt(horizontal ** 2 + dz ** 2)
+
+def shot_codes(generator:random.Random, codes:list):
+	'''yields (code, attribs) forever, line codes come in strings of 3-10 shots'''
+	while True:
+		code = generator.choice(codes)
+		desc, layer, type_, height_code = code_table[code]
+		repeat = generator.randint(3, 10) if type_ == 'line' else 1
+
+		for _ in range(repeat):
+			match code:
+				case 'TE': attribs = ['%.1f' % generator.uniform(0.3, 3.0), '%d' % generator.randint(2, 12)]
+				case 'TEMG': attribs = ['MG', '%.1f' % generator.uniform(0.3, 3.0), '%d' % generator.randint(2, 12)]
+				case 'STUMP': attribs = ['%d' % generator.randint(300, 2000)]
+				case 'SAP': attribs = ['%.1f' % generator.uniform(0.5, 2.0)]
+				case _: attribs = []
+			yield code, attribs
+
+def write_gsi(fn:str, setups:int = 10, shots:int = 100, bit_depth:int = 16, seed:int = 0, codes:list = None, foresight:bool = False) -> dict:
+	'''writes a gsi file of setups x shots coded shots (plus an RO per setup), returns the matching control
+
+	foresight also shoots the next station (code Z) from each setup, tying each setup to the next for adjust.py'''
+	generator = random.Random(seed)
+	control = traverse_control(setups, seed=seed)
+	codes = codes or [code for code in code_table if code not in EXCLUDED_CODES]
+	code_stream = shot_codes(generator, codes)
+	point_id:int = 1
+
+	def word(index, info, value):
+		return gsi_word(index, info, value, bit_depth)
+
+	with open(fn, 'w') as gsi_file:
+		for i in range(1, setups + 1):
+			station = 'STN%d' % i
+			backsight = 'STN%d' % (i + 1 if i == 1 else i - 1) # the first setup looks forward to STN2
+			xyz = control[station]
+			instrument_height = round(generator.uniform(1.4, 1.7), 3)
+			orientation = generator.uniform(0, 360)
+
+			setup_words = [word('11', '0001', station), word('84', '..10', m_to_mm(xyz[0])), word('85', '..10', m_to_mm(xyz[1])), word('86', '..10', m_to_mm(xyz[2])), word('88', '..10', m_to_mm(instrument_height))]
+			if i > 1: # as on the instrument, the first setup records no backsight
+				setup_words.append(word('79', '..00', backsight))
+			gsi_file.write(gsi_row(setup_words, bit_depth) + '\n')
+
+			rows = [('RO', [], backsight, control[backsight], 0.0)]
+			if foresight and backsight != 'STN%d' % (i + 1):
+				rows.append(('Z', [], 'STN%d' % (i + 1), control['STN%d' % (i + 1)], 0.0))
+			for _ in range(shots):
+				code, attribs = next(code_stream)
+				distance = generator.uniform(2, 30)
+				angle = generator.uniform(0, 2 * math.pi)
+				target = (xyz[0] + distance * math.cos(angle), xyz[1] + distance * math.sin(angle), xyz[2] + generator.uniform(-1.5, 1.5))
+				rows.append((code, attribs, point_id, target, generator.choice((0.0, 0.0, 1.5))))
+				point_id += 1
+
+			for code, attribs, pid, target, target_height in rows:
+				hz, vt, sd = observe(xyz, target, instrument_height, target_height, orientation)
+				code_words = [word('41', '0001', code)] + [word('%d' % (42 + k), '....', attrib) for k, attrib in enumerate(attribs)]
+				gsi_file.write(gsi_row(code_words, bit_depth) + '\n')
+				gsi_file.write(gsi_row([
+					word('11', '0002', pid),
+					word('21', '.324', decimal_to_dms(hz)),
+					word('22', '.324', decimal_to_dms(vt)),
+					word('31', '..00', m_to_mm(sd)),
+					word('87', '..10', m_to_mm(target_height)),
+				], bit_depth) + '\n')
+
+	return control
+
+def write_gps_csv(fn:str, control:dict, epochs:int = 60, noise:float = 0.01, seed:int = 0) -> None:
+	'''writes rtk/gnss epochs around each control station in the format gps.load_and_average_gps_csv_file reads'''
+	generator = random.Random(seed)
+	with open(fn, 'w') as csv_file:
+		for name, (x, y, z) in control.items():
+			for epoch in range(1, epochs + 1):
+				csv_file.write('%s.%d,%.4f,%.4f,%.4f\n' % (name, epoch, x + generator.gauss(0, noise), y + generator.gauss(0, noise), z + generator.gauss(0, noise * 2)))
+
+# Main block to execute if the script is run directly, e.g. synthetic.py out.gsi 10 100 16
+if __name__ == "__main__":
+	fn = sys.argv[1] if len(sys.argv) > 1 else 'data/SYNTHETIC.GSI'
+	setups, shots, bit_depth = [int(value) for value in sys.argv[2:5]] + [10, 100, 16][len(sys.argv[2:5]):]
+	control = write_gsi(fn, setups, shots, bit_depth)
+	write_gps_csv(fn.rsplit('.', 1)[0] + '.csv', control)
+	print(control)
@@ -0,0 +1,4 @@
+'''the modules import each other flat (from dxf.plot import ...), as when run from pyradials/'''
+import pathlib, sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
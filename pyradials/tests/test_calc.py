@@ -0,0 +1,57 @@
+'''calc.py's array functions against their scalar functions, shot by shot, to the millimetre'''
+import random
+import numpy as np
+from calc import dms_to_decimal, spherical_to_cartesian, cartesian_to_spherical, horizontal_to_azimuth, \
+	dms_to_decimal_array, spherical_to_cartesian_array, cartesian_to_spherical_array, horizontal_to_azimuth_array
+from leica import angle_to_decimal
+
+TOLERANCE:float = 1e-3 # metres
+
+def gsi_angle(generator:random.Random, low:int, high:int) -> int:
+	'''a dms angle as a gsi word holds it, dddmmss and a final digit, e.g. 18716194'''
+	return ((generator.randint(low, high) * 100 + generator.randint(0, 59)) * 100 + generator.randint(0, 59)) * 10 + generator.randint(0, 9)
+
+def random_shots(count:int = 2000, seed:int = 0) -> tuple:
+	'''(sd mm, vt, hz) columns of gsi integers, a slope distance up to 2km'''
+	generator = random.Random(seed)
+	sd = [generator.randint(1, 2000000) for _ in range(count)]
+	vt = [gsi_angle(generator, 1, 179) for _ in range(count)]
+	hz = [gsi_angle(generator, 1, 359) for _ in range(count)]
+	return sd, vt, hz
+
+def test_shots_reduce_the_same():
+	sd, vt, hz = random_shots()
+	origin = (1000.0, 2000.0, 50.0)
+
+	scalar = [spherical_to_cartesian(s / 1000, dms_to_decimal(str(v)), horizontal_to_azimuth(dms_to_decimal(str(h))), origin) for s, v, h in zip(sd, vt, hz)]
+	x, y, z = spherical_to_cartesian_array(np.array(sd) / 1000, dms_to_decimal_array(vt), horizontal_to_azimuth_array(dms_to_decimal_array(hz)), origin)
+
+	assert np.abs(np.column_stack([x, y, z]) - np.array(scalar)).max() < TOLERANCE
+
+def test_negative_dms_keeps_its_sign():
+	generator = random.Random(1)
+	angles = [-gsi_angle(generator, 1, 359) for _ in range(500)] + [-1000, -100] # under a degree
+
+	expected = [angle_to_decimal(angle) for angle in angles]
+	assert np.abs(dms_to_decimal_array(angles) - np.array(expected)).max() < 1e-9
+	assert (dms_to_decimal_array(angles) < 0).all()
+
+	# and a shot with a negative vertical angle lands where the scalar maths puts it
+	radius = np.full(len(angles), 100.0)
+	scalar = [spherical_to_cartesian(100.0, inclination, 45.0) for inclination in expected]
+	x, y, z = spherical_to_cartesian_array(radius, dms_to_decimal_array(angles), 45.0)
+	assert np.abs(np.column_stack([x, y, z]) - np.array(scalar)).max() < TOLERANCE
+
+def test_back_to_spherical_the_same():
+	generator = random.Random(2)
+	start = (1000.0, 2000.0, 50.0)
+	ends = [(start[0] + generator.uniform(-500, 500), start[1] + generator.uniform(-500, 500), start[2] + generator.uniform(-20, 20)) for _ in range(1000)]
+	# dx == 0 and dy == 0, straight up, straight down and the same point, then dx == 0 alone either way
+	ends += [(start[0], start[1], 60.0), (start[0], start[1], 40.0), start, (start[0], 2100.0, 50.0), (start[0], 1900.0, 55.0), (1100.0, start[1], 50.0)]
+
+	scalar = np.array([cartesian_to_spherical(start, end) for end in ends])
+	radius, inclination, azimuth = cartesian_to_spherical_array(start, ends)
+
+	assert np.abs(radius - scalar[:, 0]).max() < TOLERANCE
+	assert np.abs(inclination - scalar[:, 1]).max() < 1e-9
+	assert np.abs(azimuth - scalar[:, 2]).max() < 1e-9
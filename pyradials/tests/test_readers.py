@@ -0,0 +1,48 @@
+'''the mmap and numpy gsi readers against leica.py's text reader, on synthetic 8-bit and 16-bit files,
+and the spatial index built from what they read
+
+	py -m pytest pyradials/tests'''
+import pytest
+import leica_numpy
+from leica import iter_gsi_blocks
+from leica_mmap import iter_gsi_blocks_mmap
+from instrument import instrument_file_as_source
+from reduction import reduce_source
+from spatial import PointIndex
+from synthetic import write_gsi
+
+@pytest.fixture(params=(8, 16))
+def gsi_file(request, tmp_path):
+	'''(fn, bit_depth) of a synthetic survey, 5 setups of 200 shots'''
+	fn = str(tmp_path / ('PARITY%d.GSI' % request.param))
+	write_gsi(fn, 5, 200, request.param)
+	return fn, request.param
+
+def test_mmap_blocks_match_text_blocks(gsi_file):
+	fn, bit_depth = gsi_file
+	text_blocks = list(iter_gsi_blocks(fn, bit_depth))
+	mmap_blocks = list(iter_gsi_blocks_mmap(fn, bit_depth))
+
+	assert len(mmap_blocks) == len(text_blocks) > 1000
+	for text_block, mmap_block in zip(text_blocks, mmap_blocks):
+		assert type(mmap_block) is type(text_block)
+		assert mmap_block[:-1] == text_block[:-1] # raw is held as words by one reader and bytes by the other
+
+def test_mmap_rejects_a_word_index_that_isnt_digits(tmp_path):
+	fn = tmp_path / 'BAD.GSI'
+	fn.write_text('*110001+0000000000000001 21.322+0000000000000000 \n*1100A2+0000000000000002 X1.322+0000000000000000 \n')
+
+	with pytest.raises(ValueError, match="word index"):
+		list(iter_gsi_blocks_mmap(str(fn), 16))
+
+def test_numpy_store_matches_text_reader(gsi_file):
+	fn, bit_depth = gsi_file
+	assert leica_numpy.check_parity(fn, bit_depth) == 5 * (200 + 1) # each setup's RO is a shot too
+
+def test_point_index_leaves_out_ros(tmp_path):
+	fn = str(tmp_path / 'RO.GSI')
+	control = write_gsi(fn, 3, 50)
+	index = PointIndex.from_reduction(reduce_source(instrument_file_as_source(fn), control))
+
+	assert 'RO' not in index.codes
+	assert len(index) == 3 * 50
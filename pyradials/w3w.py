@@ -1,40 +1,136 @@
 '''Convert OSGB36 (E,N using OSTN15 corrections) to W3W (with intermedia Lat/Long pair)
 	- Latitude: Measured from Equator (53)
-	- Longitude: Measured from Prime Meridian (-2)'''
-import os
+	- Longitude: Measured from Prime Meridian (-2)
+
+osgb36_to_w3w_batch converts every easting and northing in one convert_lonlat call, answers what
+it can from an sqlite cache keyed by rounded lat/long and looks the rest up concurrently over a
+single rate limited geocoder. W3W_OFFLINE=1 (or geocoder=OfflineGeocoder()) swaps the api for a
+local stand-in that makes up stable words, for testing without a key or a network.'''
+import hashlib, os, pathlib, sqlite3, threading, time
+from concurrent.futures import ThreadPoolExecutor
 import what3words
 from dotenv import load_dotenv
 from convertbng.util import convert_lonlat
 
-def unpack_long_lat_data(data):
-    foo, = data[0]
-    bar, = data[1]
-    return foo, bar
-
 # load env vars and configure w3w app key
 load_dotenv()
 w3w_app_key:str = os.getenv('W3W_APP_KEY')
 
-def osgb360_to_w3w(easting:float,northing:float) -> str:
+DEFAULT_CACHE = pathlib.Path.home() / '.pyradials' / 'w3w.sqlite'
+CACHE_PRECISION:int = 6 # decimal places of lat/long in a cache key, about 0.1m, well inside a 3m square
+
+class OfflineGeocoder:
+	'''stands in for what3words.Geocoder, the same square always gets the same made up words'''
+	WORDS = ('index', 'home', 'raft', 'limit', 'spray', 'tiles', 'dream', 'table', 'crest', 'wing', 'pencil', 'slot', 'river', 'stone', 'cable', 'lamp')
+
+	def convert_to_3wa(self, coordinates) -> dict:
+		# about 3m squares, like the real grid, so nearby points share words
+		square = '%d,%d' % (round(coordinates.lat / 0.000027), round(coordinates.lng / 0.000045))
+		digest = hashlib.sha256(square.encode()).digest()
+		return {'words': '.'.join(self.WORDS[byte % len(self.WORDS)] + str(byte) for byte in digest[:3])}
+
+shared_geocoder = None # made on first use then reused, the what3words client keeps its http session
+
+def make_geocoder(offline:bool = None):
+	offline = os.getenv('W3W_OFFLINE') == '1' if offline is None else offline
+	return OfflineGeocoder() if offline else what3words.Geocoder(w3w_app_key)
+
+def default_geocoder():
+	global shared_geocoder
+	if shared_geocoder is None:
+		shared_geocoder = make_geocoder()
+	return shared_geocoder
+
+class RateLimiter:
+	'''allows at most rate calls a second across every thread'''
+	def __init__(self, rate:float):
+		self.interval = 1 / rate if rate else 0
+		self.next_call = time.monotonic()
+		self.lock = threading.Lock()
+
+	def wait(self):
+		with self.lock:
+			now = time.monotonic()
+			delay = self.next_call - now
+			self.next_call = max(now, self.next_call) + self.interval
+		if delay > 0:
+			time.sleep(delay)
+
+class W3WCache:
+	'''three word addresses by rounded lat/long in an sqlite file'''
+	def __init__(self, fn = None, precision:int = CACHE_PRECISION):
+		self.fn = pathlib.Path(fn or os.getenv('PYRADIALS_W3W_CACHE') or DEFAULT_CACHE)
+		self.fn.parent.mkdir(parents=True, exist_ok=True)
+		self.precision = precision
+		self.connection = sqlite3.connect(self.fn, check_same_thread=False)
+		self.connection.execute('create table if not exists words (lat integer, lng integer, words text not null, primary key (lat, lng))')
+
+	def key(self, lat:float, lng:float) -> tuple:
+		scale = 10 ** self.precision
+		return round(lat * scale), round(lng * scale)
+
+	def get_many(self, keys:list) -> dict:
+		found = {}
+		for start in range(0, len(keys), 400): # two parameters a key, inside sqlite's limit
+			chunk = keys[start:start + 400]
+			query = 'select lat, lng, words from words where ' + ' or '.join(['(lat = ? and lng = ?)'] * len(chunk))
+			for lat, lng, words in self.connection.execute(query, [value for key in chunk for value in key]):
+				found[(lat, lng)] = words
+		return found
+
+	def put_many(self, entries:dict) -> None:
+		with self.connection:
+			self.connection.executemany('insert or replace into words values (?, ?, ?)', [(*key, words) for key, words in entries.items()])
+
+shared_cache = None # opened on first single lookup then reused
+
+def default_cache() -> W3WCache:
+	global shared_cache
+	if shared_cache is None:
+		shared_cache = W3WCache()
+	return shared_cache
+
+def osgb36_to_w3w_batch(eastings:list, northings:list, geocoder = None, cache:W3WCache = None, workers:int = 8, rate:float = 10.0) -> list:
+	'''"///three.word.address" for each easting and northing, only cache misses reach the geocoder'''
+	if len(eastings) == 0:
+		return []
+
 	# W3W works best if I go a meter north, box seems to fit better
-	northing += 1
+	longs, lats = convert_lonlat(list(eastings), [northing + 1 for northing in northings])
+
+	keys = [cache.key(lat, long) for lat, long in zip(lats, longs)] if cache else list(zip(lats, longs))
+	found = cache.get_many(list(dict.fromkeys(keys))) if cache else {}
+	missing = {key: (lat, long) for key, lat, long in zip(keys, lats, longs) if key not in found}
+
+	if missing:
+		geocoder = geocoder or default_geocoder()
+		limiter = RateLimiter(rate)
+
+		def lookup(lat_long):
+			limiter.wait()
+			return geocoder.convert_to_3wa(what3words.Coordinates(*lat_long))['words']
 
-	# convert easting, northing to long, lat
-	long_and_lat_res = convert_lonlat(easting,northing)
-	long, lat = unpack_long_lat_data(long_and_lat_res)
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			resolved = dict(zip(missing, executor.map(lookup, missing.values())))
+		if cache:
+			cache.put_many(resolved)
+		found.update(resolved)
 
-	# pass app key to object, and make api call with lat & long
-	geocoder = what3words.Geocoder(w3w_app_key)
-	w3w_resp = geocoder.convert_to_3wa(what3words.Coordinates(lat,long))
+	return ["///" + found[key] for key in keys] # w3w branding
 
-	return "///" + w3w_resp['words'] # w3w branding
+def osgb360_to_w3w(easting:float,northing:float, cache:W3WCache = None) -> str:
+	'''one point's "///three.word.address", answered from cache (the default cache file when None) when it can be'''
+	return osgb36_to_w3w_batch([easting], [northing], cache=cache or default_cache())[0]
 
 # Main block to execute if the script is run directly
 if __name__ == "__main__":
+	import sys
 	from gps import load_and_average_gps_csv_file
-	filename = 'data/SROAD.csv'  # Replace 'data.csv' with your file name
+	filename = sys.argv[1] if len(sys.argv) > 1 else 'data/SROAD.csv'  # Replace 'data.csv' with your file name
 	result = load_and_average_gps_csv_file(filename)
 
-	for station, easting, northing, elevation in result[1:]:
-		w3w_dot_string = osgb360_to_w3w(easting, northing)
-		print(station, easting, northing, w3w_dot_string)
\ No newline at end of file
+	started = time.perf_counter()
+	addresses = osgb36_to_w3w_batch([row[1] for row in result], [row[2] for row in result], cache=W3WCache())
+	for (station, easting, northing, elevation, *spread), w3w_dot_string in zip(result, addresses):
+		print(station, easting, northing, w3w_dot_string)
+	print("%d stations in %.2fs" % (len(result), time.perf_counter() - started))